@@ -1,54 +1,47 @@
+import csv
+import functools
+import hashlib
+import io
+import json
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 from urllib.parse import urlencode
 
-from flask import Flask, render_template, request, redirect, url_for, flash
+import click
+import requests
+from flask import (Flask, Response, jsonify, make_response, render_template, request, redirect, session, url_for,
+                   flash, stream_with_context)
+from markupsafe import Markup
 
-from models import db, WeatherRecord
+from models import db, Job, WeatherRecord, MonthlyRollup
 import weather_api as weather_api
+from storage import configure_sqlite, drop_duplicates, find_stored, find_stored_days, is_fresh, upgrade_schema, upsert_days, upsert_record
+from write_buffer import WriteBuffer
+import autocomplete
+import bulk_import
+import climatology
+import geo
+import hourly
+import jobs
+import metrics
+import queries
+import quota
+import refresher
+import rollups
+import snapshot
+import versions
+from cache import MISS, LRUCache
 
 from jinja2 import TemplateNotFound
 
-# Helper: build keyword-args that match the actual column names
-def _coord_kwargs(latitude, longitude, timezone):
-    """Return coord fields keyed to whatever columns your model actually has."""
-    from models import WeatherRecord
-    cols = set(WeatherRecord.__table__.columns.keys())
-    coord_fields = {}
-    if 'lat' in cols:
-        coord_fields['lat'] = latitude
-    elif 'latitude' in cols:
-        coord_fields['latitude'] = latitude
-    if 'lon' in cols:
-        coord_fields['lon'] = longitude
-    elif 'longitude' in cols:
-        coord_fields['longitude'] = longitude
-    if 'timezone' in cols:
-        coord_fields['timezone'] = timezone
-    return coord_fields
-
-def _date_kwargs(date_value):
-    """Return a dict mapping the given date_value to the model's actual date column."""
-    from models import WeatherRecord
-    cols = set(WeatherRecord.__table__.columns.keys())
-
-    for candidate in (
-        'requested_date',  # <-- add this
-        'date',
-        'record_date',
-        'day',
-        'observation_date',
-        'observed_date',
-    ):
-        if candidate in cols:
-            return {candidate: date_value}
-
-    # Any column that contains 'date'
-    for col in cols:
-        if 'date' in col:
-            return {col: date_value}
-
-    return {}
+# Rows per chunk written to streaming exports.
+EXPORT_CHUNK_ROWS = 500
+
+# Converts a column value into something csv/json can write (dates become ISO strings).
+def _export_value(value):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
 
 # App factory — sets configuration, initializes the database, and registers routes.
 def create_app():
@@ -56,40 +49,243 @@ def create_app():
     app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "dev-secret")
     app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///weather.db")
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    # "production" runs SQLite in WAL mode with synchronous=NORMAL and a busy timeout, for several workers.
+    app.config["SQLITE_MODE"] = os.environ.get("SQLITE_MODE", "default")
+    app.config["SQLITE_BUSY_TIMEOUT_MS"] = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    app.config["DB_POOL_SIZE"] = int(os.environ.get("DB_POOL_SIZE", "5"))
+    app.config["DB_MAX_OVERFLOW"] = int(os.environ.get("DB_MAX_OVERFLOW", "10"))
+    # Write-behind for /add: rows per flush (0 commits every request itself) and the longest a row waits.
+    app.config["WRITE_BEHIND_ROWS"] = int(os.environ.get("WRITE_BEHIND_ROWS", "0"))
+    app.config["WRITE_BEHIND_DELAY_MS"] = int(os.environ.get("WRITE_BEHIND_DELAY_MS", "250"))
+    app.config["FORECAST_MAX_AGE"] = timedelta(seconds=int(os.environ.get("FORECAST_MAX_AGE_SECONDS", "10800")))
+    app.config["MAX_RANGE_DAYS"] = int(os.environ.get("MAX_RANGE_DAYS", "366"))
+    app.config["IMPORT_WORKERS"] = int(os.environ.get("IMPORT_WORKERS", "8"))
+    app.config["IMPORT_BATCH_SIZE"] = int(os.environ.get("IMPORT_BATCH_SIZE", "500"))
+    # Longest a low-priority upstream call made inside a request (/import, /batch) waits for quota.
+    app.config["QUOTA_REQUEST_MAX_WAIT"] = float(os.environ.get("WEATHER_QUOTA_REQUEST_MAX_WAIT", "30"))
+    # "sync" fetches inside the request; "async" queues /add for background workers (see jobs.py).
+    app.config["ADD_MODE"] = os.environ.get("ADD_MODE", "sync")
+    app.config["JOB_WORKERS"] = int(os.environ.get("JOB_WORKERS", "4"))
+    # A running job untouched for this long is taken to belong to a dead process and is requeued on startup.
+    app.config["JOB_LEASE"] = timedelta(seconds=int(os.environ.get("JOB_LEASE_SECONDS", "600")))
+    # Seconds between in-process runs of the forecast -> historical refresher (0 disables it).
+    app.config["REFRESH_INTERVAL_SECONDS"] = float(os.environ.get("REFRESH_INTERVAL_SECONDS", "0"))
+
+    app.config["BATCH_MAX_TASKS"] = int(os.environ.get("BATCH_MAX_TASKS", "100"))
+    app.config["FRAGMENT_CACHE_SIZE"] = int(os.environ.get("FRAGMENT_CACHE_SIZE", "256"))
+    app.config["AUTOCOMPLETE_MAX_ENTRIES"] = int(os.environ.get("AUTOCOMPLETE_MAX_ENTRIES", "50000"))
+
+    app.config["METRICS_ENABLED"] = os.environ.get("METRICS_ENABLED", "1") == "1"
+    app.config["METRICS_SERVER_TIMING"] = os.environ.get("METRICS_SERVER_TIMING", "0") == "1"
+
+    sqlite_production = (
+        app.config["SQLITE_MODE"] == "production"
+        and app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite")
+        and ":memory:" not in app.config["SQLALCHEMY_DATABASE_URI"]
+    )
+    if sqlite_production:
+        # Each worker process keeps its own small pool; waiting on a lock is bounded by the busy timeout
+        app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {
+            "pool_size": app.config["DB_POOL_SIZE"],
+            "max_overflow": app.config["DB_MAX_OVERFLOW"],
+            "pool_timeout": app.config["SQLITE_BUSY_TIMEOUT_MS"] / 1000,
+            "connect_args": {"timeout": app.config["SQLITE_BUSY_TIMEOUT_MS"] / 1000},
+        })
 
     db.init_app(app)
+    metrics.init_app(app)
 
     with app.app_context():
+        if sqlite_production:
+            configure_sqlite(db.engine, busy_timeout_ms=app.config["SQLITE_BUSY_TIMEOUT_MS"])
         db.create_all()
+        upgrade_schema(db.engine)
+        hourly.upgrade_schema(db.engine)
+        if app.config["ADD_MODE"] == "async":
+            jobs.get_queue(app).resume()
+
+    if app.config["REFRESH_INTERVAL_SECONDS"] > 0:
+        app.extensions["weather_refresher"] = refresher.RefreshScheduler(
+            app, app.config["REFRESH_INTERVAL_SECONDS"]
+        ).start()
+
+    if app.config["WRITE_BEHIND_ROWS"] > 0:
+        app.extensions["write_buffer"] = WriteBuffer(
+            app, max_rows=app.config["WRITE_BEHIND_ROWS"], max_delay=app.config["WRITE_BEHIND_DELAY_MS"] / 1000
+        )
+
+    # Saves one fetched day for /add, through the write-behind buffer when enabled; returns the flash message.
+    def save_record(city, country, requested_date, daily, latitude, longitude, timezone):
+        buffer = app.extensions.get("write_buffer")
+        if buffer is not None:
+            buffer.add(city, country, requested_date, daily, latitude, longitude, timezone)
+            return "Record saved; it appears in the table within a moment."
+        _, created = upsert_record(city, country, requested_date, daily, latitude, longitude, timezone)
+        return "Record added." if created else "Record refreshed."
+
+    # Read-through for /add: (stored or buffered and still fresh, stored record or None) for a location's day.
+    def stored_day(city, country, requested_date, latitude=None, longitude=None):
+        stored = find_stored(city, country, requested_date, latitude, longitude)
+        buffer = app.extensions.get("write_buffer")
+        fresh = (stored is not None and is_fresh(stored, app.config["FORECAST_MAX_AGE"])) or (
+            buffer is not None and buffer.pending(city, country, requested_date, latitude, longitude) is not None
+        )
+        return fresh, stored
+
+    # Days /add served stale during an outage, refetched in the background once the circuit allows it.
+    revalidator = app.extensions["weather_revalidator"] = refresher.Revalidator(app)
+
+    # Outage fallback for /add: shows the last known values, marked stale, and schedules a revalidation.
+    # Only sync mode gets here (async /add hands the fetch to a job), so the revalidation runs on a timer, not the job pool.
+    def serve_stale(error, city, country, requested_date, stored, latitude=None, longitude=None, timezone=None):
+        if latitude is None and stored is not None and stored.latitude is not None:
+            latitude, longitude, timezone = stored.latitude, stored.longitude, stored.timezone
+        scheduled = latitude is not None and longitude is not None
+        if scheduled:
+            revalidator.schedule(city, country, requested_date, latitude, longitude, timezone, error.retry_after)
+        retry = f"try again in about {error.retry_after:.0f}s"
+
+        cached = None
+        if stored is None and latitude is not None and longitude is not None:
+            cached = weather_api.cached_weather_for_date(latitude, longitude, timezone, requested_date)
+        if stored is not None:
+            fetched_at = stored.updated_at or stored.created_at
+            message = (f"Weather service unavailable; showing the stored {stored.source} values "
+                       f"from {fetched_at:%Y-%m-%d %H:%M} (stale). "
+                       + ("They are refreshed once the service recovers." if scheduled else f"To refresh them, {retry}."))
+        elif cached is not None:
+            message = (f"Weather service unavailable; last known {cached['source']} values (stale): "
+                       f"max {cached['temp_max_c']} °C, min {cached['temp_min_c']} °C, "
+                       f"precipitation {cached['precip_mm']} mm, wind {cached['wind_max_kmh']} km/h. "
+                       "The record is saved once the service recovers.")
+        elif scheduled:
+            message = "Weather service unavailable; the record is fetched and saved once the service recovers."
+        else:
+            message = f"Weather service unavailable; nothing is stored for this day yet, {retry}."
+        flash(message, "warning")
+        return redirect(url_for("index"))
+
+    # Rendered records-table fragments keyed by (records version, view parameters).
+    fragment_cache = LRUCache(max_entries=app.config["FRAGMENT_CACHE_SIZE"])
+    app.extensions["fragment_cache"] = fragment_cache
+
+    # Strong ETag for the index page: the table view plus pending jobs and the template sources.
+    def _page_etag(table_key, job_states):
+        digest = hashlib.sha1(repr((table_key, job_states, _template_revision())).encode())
+        return digest.hexdigest()
+
+    # Digest of the templates the index page is built from, so a deploy that changes them changes the ETag.
+    @functools.cache
+    def _template_revision():
+        text = "".join(app.jinja_env.loader.get_source(app.jinja_env, name)[0]
+                       for name in ("_layout.html", "index.html", "_records_table.html"))
+        return hashlib.sha1(text.encode()).hexdigest()
 
     @app.route("/", methods=["GET"])
     def index():
-        sort = request.args.get("sort", "requested_date")
-        direction = request.args.get("dir", "desc")
-
-        sortable = {
-            "id": WeatherRecord.id,
-            "requested_date": WeatherRecord.requested_date,
-            "city": WeatherRecord.city,
-            "country": WeatherRecord.country,
-            "temp_max_c": WeatherRecord.temp_max_c,
-            "temp_min_c": WeatherRecord.temp_min_c,
-            "precip_mm": WeatherRecord.precip_mm,
-            "wind_max_kmh": WeatherRecord.wind_max_kmh,
-            "source": WeatherRecord.source,
-            "created_at": WeatherRecord.created_at,
+        sort, direction, filters, per_page = queries.parse_listing_args(request.args)
+        cursor = request.args.get("after")
+
+        # Query-string values (filters, page size) that every sort/page link carries along
+        carried = {
+            name: request.args[name]
+            for name in (*queries.FILTER_FIELDS, "per_page")
+            if request.args.get(name)
         }
-        sort_column = sortable.get(sort, WeatherRecord.requested_date)
-        records = WeatherRecord.query.order_by(sort_column.asc() if direction == "asc" else sort_column.desc()).all()
+
+        # The table only changes when the records version does, so it is cached per (version, view)
+        table_key = (versions.current(), sort, direction, tuple(sorted(carried.items())), cursor, per_page)
+        recent_jobs = jobs.recent_jobs()
+        etag = None
+        if not session.get("_flashes"):
+            etag = _page_etag(table_key, [(job.id, job.status) for job in recent_jobs])
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+
+        records_table = fragment_cache.get(table_key)
+        if records_table is MISS:
+            records_table = _render_records_table(sort, direction, filters, carried, cursor, per_page)
+            fragment_cache.set(table_key, records_table)
+
+        response = make_response(render_template("index.html", records_table=Markup(records_table), jobs=recent_jobs))
+        response.headers["Cache-Control"] = "no-cache"
+        if etag:
+            response.set_etag(etag)
+        return response
+
+    # Renders the records table section (filters, table, export links and pager) for one view.
+    def _render_records_table(sort, direction, filters, carried, cursor, per_page):
+        records, next_cursor = queries.keyset_page(sort, direction, filters, cursor=cursor, per_page=per_page)
 
         def sort_link(col_name):
             next_direction = "asc"
             if sort == col_name and direction == "asc":
                 next_direction = "desc"
-            params = {"sort": col_name, "dir": next_direction}
+            params = {"sort": col_name, "dir": next_direction, **carried}
             return f"?{urlencode(params)}"
 
-        return render_template("index.html", records=records, sort=sort, direction=direction, sort_link=sort_link)
+        page_params = {"sort": sort, "dir": direction, **carried}
+        next_link = f"?{urlencode({**page_params, 'after': next_cursor})}" if next_cursor else None
+        first_link = f"?{urlencode(page_params)}" if cursor else None
+        export_query = urlencode(page_params)
+
+        return render_template(
+            "_records_table.html",
+            records=records,
+            sort=sort,
+            direction=direction,
+            sort_link=sort_link,
+            filters=carried,
+            next_link=next_link,
+            first_link=first_link,
+            export_query=export_query,
+        )
+
+    # Export routes — stream every row matching the index's sort/filter parameters without loading them all.
+    @app.route("/export.csv", methods=["GET"])
+    def export_csv():
+        sort, direction, filters, _ = queries.parse_listing_args(request.args)
+        columns = list(WeatherRecord.__table__.columns.keys())
+
+        def generate():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(columns)
+            for count, row in enumerate(queries.iter_rows(sort, direction, filters), start=1):
+                writer.writerow([_export_value(row[c]) for c in columns])
+                if count % EXPORT_CHUNK_ROWS == 0:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue()
+
+        return Response(
+            stream_with_context(generate()),
+            mimetype="text/csv",
+            headers={"Content-Disposition": "attachment; filename=weather_records.csv"},
+        )
+
+    @app.route("/export.ndjson", methods=["GET"])
+    def export_ndjson():
+        sort, direction, filters, _ = queries.parse_listing_args(request.args)
+
+        def generate():
+            lines = []
+            for row in queries.iter_rows(sort, direction, filters):
+                lines.append(json.dumps({key: _export_value(value) for key, value in row.items()}))
+                if len(lines) == EXPORT_CHUNK_ROWS:
+                    yield "\n".join(lines) + "\n"
+                    lines = []
+            if lines:
+                yield "\n".join(lines) + "\n"
+
+        return Response(
+            stream_with_context(generate()),
+            mimetype="application/x-ndjson",
+            headers={"Content-Disposition": "attachment; filename=weather_records.ndjson"},
+        )
 
     # Add route — parses form inputs, resolves location if needed, fetches weather for the selected date, and saves a new record.
     @app.route("/add", methods=["POST"])
@@ -113,7 +309,8 @@ def create_app():
             flash("Date must be in YYYY-MM-DD format.", "error")
             return redirect(url_for("index"))
 
-        # If coordinates + timezone already provided, fetch & save directly
+        # Coordinates chosen on the selection page (or from autocomplete) identify the place exactly
+        latitude = longitude = None
         if latitude_str and longitude_str and timezone_str:
             try:
                 latitude = float(latitude_str)
@@ -122,94 +319,414 @@ def create_app():
                 flash("Latitude/Longitude must be numeric.", "error")
                 return redirect(url_for("index"))
 
-            daily = weather_api.fetch_weather_for_date(
-                city=city,
-                country=country,
-                target_date=requested_date,
-                latitude=latitude,          
-                longitude=longitude,        
-                timezone=timezone_str,      
-            )
+        # Read-through: a stored row that is still valid is returned without any network call.
+        # A region without coordinates needs geocoding to tell same-named places apart, so it is checked after that.
+        stored = None
+        if latitude is not None or not region_text:
+            fresh, stored = stored_day(city, country, requested_date, latitude, longitude)
+            if fresh:
+                flash("Record already stored.", "success")
+                return redirect(url_for("index"))
 
-            record_fields = dict(
-                city=city,
-                country=country,
-                temp_max_c=daily.get("temp_max_c"),
-                temp_min_c=daily.get("temp_min_c"),
-                precip_mm=daily.get("precip_mm"),
-                wind_max_kmh=daily.get("wind_max_kmh"),
-                source=daily.get("source"),
+        # Async mode: queue the fetch for a background worker and return immediately
+        if app.config["ADD_MODE"] == "async":
+            payload = {"city": city, "country": country, "region": region_text,
+                       "requested_date": requested_date.isoformat()}
+            if latitude is not None:
+                payload.update(latitude=latitude, longitude=longitude, timezone=timezone_str)
+            jobs.get_queue(app).submit("add", payload, city, country, requested_date)
+            flash("Request queued; the record appears once it has been fetched.", "success")
+            return redirect(url_for("index"))
+
+        try:
+            # If coordinates + timezone already provided, fetch & save directly
+            if latitude is not None:
+                daily = weather_api.fetch_weather_for_date(
+                    city=city,
+                    country=country,
+                    target_date=requested_date,
+                    latitude=latitude,          
+                    longitude=longitude,        
+                    timezone=timezone_str,      
+                )
+
+                flash(save_record(city, country, requested_date, daily, latitude, longitude, timezone_str), "success")
+                return redirect(url_for("index"))
+
+            # Otherwise search for a location first
+            candidates = weather_api.search_locations(
+                city=city, country=country, admin1=(region_text or None)
             )
-            record_fields.update(_coord_kwargs(latitude, longitude, timezone_str))
-            record_fields.update(_date_kwargs(requested_date))
 
-            record = WeatherRecord(**record_fields)
-            db.session.add(record)
-            db.session.commit()
+            # Show a selection page; if template is missing, return simple HTML fallback
+            if len(candidates) > 1:
+                try:
+                    return render_template(
+                        "select_location.html",
+                        candidates=candidates,
+                        hidden_fields={"requested_date": requested_date_str},
+                        city=city,
+                        country=country,
+                    )
+                except TemplateNotFound:
+                    options = "".join(
+                        f"<li>{c['name']}, {c.get('admin1','')} ({c['country']})</li>"
+                        for c in candidates
+                    )
+                    html = f"<h1>Choose a location</h1><ul>{options}</ul>"
+                    return html, 200
+
+            # Single match
+            if len(candidates) == 1:
+                match = candidates[0]
+                latitude = match["latitude"]
+                longitude = match["longitude"]
+                timezone_str = match["timezone"]
+                fresh, stored = stored_day(city, country, requested_date, latitude, longitude)
+                if fresh:
+                    flash("Record already stored.", "success")
+                    return redirect(url_for("index"))
+                daily = weather_api.fetch_weather_for_date(
+                    city=city,
+                    country=country,
+                    target_date=requested_date,
+                    latitude=latitude,          
+                    longitude=longitude,        
+                    timezone=timezone_str,      
+                )
+
+                flash(save_record(city, country, requested_date, daily, latitude, longitude, timezone_str), "success")
+                return redirect(url_for("index"))
 
-            flash("Record added.", "success")
+            flash("No matching locations found.", "error")
             return redirect(url_for("index"))
+        except weather_api.CircuitOpenError as e:
+            return serve_stale(e, city, country, requested_date, stored, latitude, longitude, timezone_str)
 
-        # Otherwise search for a location first
-        candidates = weather_api.search_locations(
-            city=city, country=country, admin1=(region_text or None)
-        )
 
-        # Show a selection page; if template is missing, return simple HTML fallback
-        if len(candidates) > 1:
+    # Add-range route — resolves the location once, fetches every day in the span, and saves all rows in one commit.
+    @app.route("/add_range", methods=["POST"])
+    def add_range():
+        start_date_str = (request.form.get("start_date") or "").strip()
+        end_date_str = (request.form.get("end_date") or "").strip()
+        country = (request.form.get("country") or "").strip()
+        city = (request.form.get("city") or "").strip()
+        region_text = (request.form.get("region") or "").strip()
+        latitude_str  = (request.form.get("latitude")  or request.form.get("lat") or "").strip()
+        longitude_str = (request.form.get("longitude") or request.form.get("lon") or "").strip()
+        timezone_str  = (request.form.get("timezone") or "").strip()
+        with_hourly = request.form.get("hourly") == "1"
+
+        try:
+            start_date = datetime.strptime(start_date_str, "%Y-%m-%d").date()
+            end_date = datetime.strptime(end_date_str, "%Y-%m-%d").date()
+        except ValueError:
+            flash("Dates must be in YYYY-MM-DD format.", "error")
+            return redirect(url_for("index"))
+        if end_date < start_date:
+            flash("End date must not be before start date.", "error")
+            return redirect(url_for("index"))
+        if (end_date - start_date).days + 1 > app.config["MAX_RANGE_DAYS"]:
+            flash(f"Date ranges are limited to {app.config['MAX_RANGE_DAYS']} days.", "error")
+            return redirect(url_for("index"))
+
+        # Only days that are missing or hold a stale forecast need fetching
+        wanted = [start_date + timedelta(days=n) for n in range((end_date - start_date).days + 1)]
+        def pending_days(latitude=None, longitude=None):
+            stored = find_stored_days(city, country, wanted, latitude, longitude)
+            return [day for day in wanted
+                    if day not in stored or not is_fresh(stored[day], app.config["FORECAST_MAX_AGE"])]
+
+        latitude = longitude = None
+        if latitude_str and longitude_str and timezone_str:
             try:
+                latitude = float(latitude_str)
+                longitude = float(longitude_str)
+            except ValueError:
+                flash("Latitude/Longitude must be numeric.", "error")
+                return redirect(url_for("index"))
+
+        # As in /add, a region without coordinates is matched against stored rows only once geocoded
+        if latitude is not None or not region_text:
+            pending = pending_days(latitude, longitude)
+            if not pending and not with_hourly:
+                flash(f"All {len(wanted)} days already stored.", "success")
+                return redirect(url_for("index"))
+
+        if latitude is None:
+            candidates = weather_api.search_locations(
+                city=city, country=country, admin1=(region_text or None)
+            )
+            if not candidates:
+                flash("No matching locations found.", "error")
+                return redirect(url_for("index"))
+            if len(candidates) > 1:
                 return render_template(
                     "select_location.html",
                     candidates=candidates,
-                    requested_date=requested_date_str,
+                    form_action=url_for("add_range"),
+                    hidden_fields={"start_date": start_date_str, "end_date": end_date_str,
+                                   **({"hourly": "1"} if with_hourly else {})},
                     city=city,
                     country=country,
                 )
-            except TemplateNotFound:
-                options = "".join(
-                    f"<li>{c['name']}, {c.get('admin1','')} ({c['country']})</li>"
-                    for c in candidates
-                )
-                html = f"<h1>Choose a location</h1><ul>{options}</ul>"
-                return html, 200
-
-        # Single match
-        if len(candidates) == 1:
-            match = candidates[0]
-            latitude = match["latitude"]
-            longitude = match["longitude"]
-            timezone_str = match["timezone"]
-            daily = weather_api.fetch_weather_for_date(
-                city=city,
-                country=country,
-                target_date=requested_date,
-                latitude=latitude,          
-                longitude=longitude,        
-                timezone=timezone_str,      
-            )
+            latitude = candidates[0]["latitude"]
+            longitude = candidates[0]["longitude"]
+            timezone_str = candidates[0]["timezone"]
+            pending = pending_days(latitude, longitude)
+            if not pending and not with_hourly:
+                flash(f"All {len(wanted)} days already stored.", "success")
+                return redirect(url_for("index"))
 
-            record_fields = dict(
-                city=city,
-                country=country,
-                temp_max_c=daily.get("temp_max_c"),
-                temp_min_c=daily.get("temp_min_c"),
-                precip_mm=daily.get("precip_mm"),
-                wind_max_kmh=daily.get("wind_max_kmh"),
-                source=daily.get("source"),
+        inserted = updated = 0
+        if pending:
+            try:
+                result = weather_api.fetch_weather_for_range(latitude, longitude, timezone_str, pending[0], pending[-1])
+            except weather_api.CircuitOpenError as e:
+                flash(f"{e} Stored days are unchanged.", "error")
+                return redirect(url_for("index"))
+            pending = set(pending)
+            inserted, updated = upsert_days(
+                city, country, [day for day in result["days"] if day["date"] in pending],
+                latitude, longitude, timezone_str,
             )
-            record_fields.update(_coord_kwargs(latitude, longitude, timezone_str))
-            record_fields.update(_date_kwargs(requested_date))
-
-            record = WeatherRecord(**record_fields)
-            db.session.add(record)
-            db.session.commit()
+        message, warning = f"{inserted} records added, {updated} refreshed.", None
+        if with_hourly:
+            # The daily records are already committed; a failed hourly fetch only costs the hourly series
+            try:
+                days = hourly.ingest(city, country, latitude, longitude, timezone_str, start_date, end_date)
+            except (requests.RequestException, quota.QuotaExceededError, weather_api.CircuitOpenError, ValueError) as e:
+                db.session.rollback()
+                warning = f"Hourly series not stored: {e}"
+            else:
+                message += f" Hourly series stored for {days} days."
+
+        flash(message, "success")
+        if warning:
+            flash(warning, "warning")
+        return redirect(url_for("index"))
 
-            flash("Record added.", "success")
+    # Import route — bulk-loads an uploaded CSV of date, city, country[, region] rows and shows a per-row report.
+    @app.route("/import", methods=["POST"])
+    def import_csv():
+        upload = request.files.get("file")
+        if upload is None or not upload.filename:
+            flash("Choose a CSV file to import.", "error")
+            return redirect(url_for("index"))
+        try:
+            report = bulk_import.import_csv(
+                io.TextIOWrapper(upload.stream, encoding="utf-8-sig", newline=""),
+                max_workers=app.config["IMPORT_WORKERS"],
+                batch_size=app.config["IMPORT_BATCH_SIZE"],
+                max_wait=app.config["QUOTA_REQUEST_MAX_WAIT"],
+            )
+        except (ValueError, UnicodeDecodeError) as e:
+            flash(f"Import failed: {e}", "error")
             return redirect(url_for("index"))
+        return render_template("import_report.html", report=report.as_dict(), filename=upload.filename)
+
+    # CLI: flask --app app:create_app import-csv rows.csv
+    @app.cli.command("import-csv")
+    @click.argument("path", type=click.Path(exists=True, dir_okay=False))
+    @click.option("--workers", type=int, default=None, help="Concurrent upstream requests.")
+    @click.option("--batch-size", type=int, default=None, help="Rows per insert/commit.")
+    def import_csv_command(path, workers, batch_size):
+        """Bulk-import weather rows from a CSV file."""
+        def progress(stage, done, total):
+            click.echo(f"{stage}: {done}/{total}", err=True)
+
+        with open(path, encoding="utf-8-sig", newline="") as lines:
+            report = bulk_import.import_csv(
+                lines,
+                max_workers=workers or app.config["IMPORT_WORKERS"],
+                batch_size=batch_size or app.config["IMPORT_BATCH_SIZE"],
+                progress=progress,
+            )
+        summary = report.as_dict()
+        click.echo(
+            f"{summary['rows']} rows, {summary['inserted']} inserted, {summary['updated']} refreshed, "
+            f"{summary['skipped']} already stored, {summary['failed']} failed "
+            f"({summary['locations']} locations, {summary['fetch_groups']} range requests)"
+        )
+        for line, message in report.failures:
+            click.echo(f"  line {line}: {message}")
+
+    # Job status route — polled by the index page while queued /add requests are pending.
+    @app.route("/jobs/<int:job_id>", methods=["GET"])
+    def job_status(job_id):
+        job = db.session.get(Job, job_id)
+        if job is None:
+            return jsonify({"error": "Job not found."}), 404
+        return jsonify(jobs.describe(job))
+
+    # Lets the user pick a location for a queued /add whose search matched several places.
+    @app.route("/jobs/<int:job_id>/choose", methods=["GET"])
+    def job_choose(job_id):
+        job = db.session.get(Job, job_id)
+        if job is None or job.status != "ambiguous":
+            flash("That request no longer needs a location choice.", "error")
+            return redirect(url_for("index"))
+        return render_template(
+            "select_location.html",
+            candidates=jobs.describe(job)["result"]["candidates"],
+            hidden_fields={"requested_date": job.requested_date.isoformat()},
+            city=job.city,
+            country=job.country,
+        )
 
-        flash("No matching locations found.", "error")
-        return redirect(url_for("index"))
+    # Batch route — weather for many (location, date) tasks fetched concurrently (low-priority quota lane), for dashboards.
+    @app.route("/batch", methods=["POST"])
+    def batch():
+        payload = request.get_json(silent=True) or {}
+        tasks = payload.get("tasks")
+        if not isinstance(tasks, list) or not tasks:
+            return jsonify({"error": "Send {\"tasks\": [{\"city\", \"country\", \"date\"}, ...]}."}), 400
+        if len(tasks) > app.config["BATCH_MAX_TASKS"]:
+            return jsonify({"error": f"At most {app.config['BATCH_MAX_TASKS']} tasks per batch."}), 400
+        if not all(isinstance(task, dict) and task.get("date") and (
+            (task.get("city") and task.get("country")) or (task.get("latitude") is not None and task.get("longitude") is not None)
+        ) for task in tasks):
+            return jsonify({"error": "Every task needs a date and either city/country or latitude/longitude."}), 400
+        with quota.lane(quota.LOW, max_wait=app.config["QUOTA_REQUEST_MAX_WAIT"]):
+            return jsonify({"results": weather_api.fetch_many(tasks)})
+
+    # Hourly route — stored hourly series for a location and span, with daily aggregates derived from them.
+    @app.route("/hourly", methods=["GET"])
+    def hourly_series():
+        city = (request.args.get("city") or "").strip()
+        country = (request.args.get("country") or "").strip()
+        try:
+            start_date = datetime.strptime(request.args.get("start_date", ""), "%Y-%m-%d").date()
+            end_date = datetime.strptime(request.args.get("end_date") or start_date.isoformat(), "%Y-%m-%d").date()
+        except ValueError:
+            return jsonify({"error": "start_date (and optional end_date) must be YYYY-MM-DD."}), 400
+        if not city or not country:
+            return jsonify({"error": "city and country are required."}), 400
+        latitude = longitude = None
+        if request.args.get("lat") or request.args.get("lon"):
+            try:
+                latitude, longitude = float(request.args.get("lat", "")), float(request.args.get("lon", ""))
+            except ValueError:
+                return jsonify({"error": "lat and lon must both be numbers."}), 400
+        try:
+            return jsonify(hourly.describe(city, country, start_date, end_date, latitude, longitude))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    # Metrics route — upstream/DB/render timings, error and cache counters in Prometheus text format.
+    @app.route("/metrics", methods=["GET"])
+    def metrics_endpoint():
+        return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
+    # Stats route — per-location monthly aggregates served straight from the rollup table.
+    @app.route("/stats", methods=["GET"])
+    def stats():
+        query = MonthlyRollup.query
+        for name in ("city", "country"):
+            value = (request.args.get(name) or "").strip()
+            if value:
+                query = query.filter(getattr(MonthlyRollup, name) == value)
+        for name in ("year", "month"):
+            value = request.args.get(name, type=int)
+            if value is not None:
+                query = query.filter(getattr(MonthlyRollup, name) == value)
+        groups = query.order_by(
+            MonthlyRollup.city, MonthlyRollup.country, MonthlyRollup.year, MonthlyRollup.month
+        ).all()
+        return jsonify([rollups.summarize(group) for group in groups])
+
+    # Nearby route — stored rows within `km` of a point, nearest first (accepts the listing filters too).
+    @app.route("/nearby", methods=["GET"])
+    def nearby():
+        latitude = request.args.get("lat", type=float)
+        longitude = request.args.get("lon", type=float)
+        km = request.args.get("km", 25.0, type=float)
+        limit = request.args.get("limit", geo.DEFAULT_NEARBY_LIMIT, type=int)
+        if latitude is None or longitude is None or not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            return jsonify({"error": "lat and lon must be valid coordinates."}), 400
+        if not 0 < km <= geo.MAX_RADIUS_KM:
+            return jsonify({"error": f"km must be between 0 and {geo.MAX_RADIUS_KM:g}."}), 400
+        _, _, filters, _ = queries.parse_listing_args(request.args)
+        rows = geo.nearby_records(
+            latitude, longitude, km,
+            criteria=queries.filter_criteria(filters),
+            limit=max(1, min(limit, geo.MAX_NEARBY_LIMIT)),
+        )
+        return jsonify([{key: _export_value(value) for key, value in row.items()} for row in rows])
+
+    # Autocomplete route — location suggestions from the in-memory prefix index, geocoding only on a miss.
+    @app.route("/autocomplete", methods=["GET"])
+    def autocomplete_locations():
+        query = (request.args.get("q") or "").strip()
+        limit = max(1, min(request.args.get("limit", autocomplete.DEFAULT_LIMIT, type=int), 50))
+        autocomplete.ensure_loaded(app.config["AUTOCOMPLETE_MAX_ENTRIES"])
+        try:
+            results, source = autocomplete.suggest(query, limit, geocode=request.args.get("geocode", "1") != "0")
+        except RuntimeError as e:
+            return jsonify({"query": query, "source": "geocoding", "results": [], "error": str(e)}), 502
+        return jsonify({"query": query, "source": source, "results": results})
+
+    # CLI: flask --app app:create_app rebuild-rollups
+    @app.cli.command("rebuild-rollups")
+    def rebuild_rollups_command():
+        """Recompute every monthly rollup from weather_records."""
+        count = rollups.rebuild(db.session.connection())
+        db.session.commit()
+        click.echo(f"Rebuilt {count} monthly rollups.")
+
+    # CLI: flask --app app:create_app dedupe-records
+    @app.cli.command("dedupe-records")
+    def dedupe_records_command():
+        """Delete rows that keep a unique index from being created (the newest of each key stays), then create it."""
+        removed = drop_duplicates(db.engine)
+        for row in removed:
+            click.echo(f"  removed {row}")
+        click.echo(f"Removed {len(removed)} duplicate rows.")
+
+    # CLI: flask --app app:create_app export-snapshot backups/2024-06-01
+    @app.cli.command("export-snapshot")
+    @click.argument("directory", type=click.Path(file_okay=False))
+    def export_snapshot_command(directory):
+        """Write weather_records as a columnar snapshot (one .npy array per column + manifest.json)."""
+        rows = snapshot.export_snapshot(directory)
+        click.echo(f"Exported {rows} rows to {directory}.")
+
+    # CLI: flask --app app:create_app load-records backups/2024-06-01 --replace
+    @app.cli.command("load-records")
+    @click.argument("path", type=click.Path(exists=True))
+    @click.option("--replace", is_flag=True, help="Delete existing records first.")
+    @click.option("--batch-size", type=int, default=snapshot.LOAD_BATCH, show_default=True, help="Rows per executemany batch.")
+    def load_records_command(path, replace, batch_size):
+        """Bulk-load a snapshot directory or an /export.csv / /export.ndjson file into weather_records."""
+        def progress(stage, done, total):
+            click.echo(f"{stage}: {done}/{total}", err=True)
+
+        load = snapshot.load_snapshot if os.path.isdir(path) else snapshot.load_export
+        summary = load(path, replace=replace, batch_size=batch_size, progress=progress).as_dict()
+        click.echo(
+            f"{summary['inserted']} rows loaded, {summary['skipped']} already stored, "
+            f"{summary['duplicates']} repeated in the input, in {summary['seconds']}s "
+            f"({summary['rows_per_second']} rows/s overall, {summary['insert_rows_per_second']} rows/s inserting; "
+            f"{summary['deferred_indexes']} indexes rebuilt, {summary['rollups']} monthly rollups)"
+        )
 
+    # CLI: flask --app app:create_app refresh-forecasts
+    @app.cli.command("refresh-forecasts")
+    @click.option("--limit", type=int, default=None, help="Refresh at most this many rows.")
+    def refresh_forecasts_command(limit):
+        """Replace forecast rows that are now past the archive delay with archive values."""
+        def progress(stage, done, total):
+            click.echo(f"{stage}: {done}/{total}", err=True)
+
+        summary = refresher.refresh_stale(limit=limit, progress=progress).as_dict()
+        click.echo(
+            f"{summary['rows']} stale forecast rows, {summary['updated']} updated to historical "
+            f"({summary['merged']} merged into the stored row for their location-day), "
+            f"{summary['not_archived']} not archived yet, {summary['failed']} locations failed "
+            f"({summary['locations']} locations, {summary['fetch_groups']} range groups)"
+        )
+        for failure in summary["failures"]:
+            click.echo(f"  {failure['location']}: {failure['error']}")
 
     # Deletes the selected record.
     @app.route("/delete/<int:record_id>", methods=["POST"])
@@ -0,0 +1,159 @@
+import bisect
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+
+import storage
+import weather_api
+from models import db, WeatherRecord
+
+DEFAULT_LIMIT = 8
+MAX_ENTRIES = 50_000
+
+
+# Lower-cases, strips accents and collapses whitespace so "  São Paulo" matches "sao p".
+def normalize(text):
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return " ".join(stripped.lower().split())
+
+
+# Sorted-array prefix index over location names, bounded to `max_entries` locations.
+class PrefixIndex:
+    """
+    `_keys` is a sorted list of (normalized name, location key); a prefix query is one
+    bisect plus a scan over the matching run, so lookups cost O(log n + results).
+    Locations are kept in insertion/use order and the least recently seen one is evicted
+    once `max_entries` is exceeded, which bounds memory.
+    """
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._keys = []
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    @staticmethod
+    def location_key(entry):
+        return (normalize(entry["name"]), normalize(entry.get("admin1")), normalize(entry.get("country")),
+                round(float(entry["latitude"]), 2), round(float(entry["longitude"]), 2))
+
+    def add(self, entry):
+        if not entry.get("name") or entry.get("latitude") is None or entry.get("longitude") is None:
+            return
+        entry = {name: entry.get(name) for name in ("name", "admin1", "country", "latitude", "longitude", "timezone")}
+        key = self.location_key(entry)
+        with self._lock:
+            if key in self._entries:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = entry
+            bisect.insort(self._keys, (key[0], key))
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                position = bisect.bisect_left(self._keys, (evicted[0], evicted))
+                del self._keys[position]
+
+    def add_many(self, entries):
+        for entry in entries:
+            self.add(entry)
+
+    def search(self, prefix, limit=DEFAULT_LIMIT):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        results = []
+        with self._lock:
+            position = bisect.bisect_left(self._keys, (prefix,))
+            while position < len(self._keys) and len(results) < limit:
+                name, key = self._keys[position]
+                if not name.startswith(prefix):
+                    break
+                results.append(dict(self._entries[key]))
+                position += 1
+        return results
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+            self._entries.clear()
+            self.loaded = False
+
+    def __len__(self):
+        return len(self._entries)
+
+
+index = PrefixIndex()
+
+
+# Fills the index from stored records and cached geocoding results (once per process).
+def ensure_loaded(max_entries=None):
+    """Each distinct stored (city, country, latitude, longitude) is one place; the most recently stored are kept."""
+    if index.loaded:
+        return
+    if max_entries:
+        index.max_entries = max_entries
+    table = WeatherRecord.__table__
+    rows = db.session.execute(
+        select(table.c.city, table.c.country, table.c.latitude, table.c.longitude, func.max(table.c.timezone))
+        .where(table.c.latitude.is_not(None), table.c.longitude.is_not(None))
+        .group_by(table.c.city, table.c.country, table.c.latitude, table.c.longitude)
+        .order_by(func.max(table.c.id).desc())
+        .limit(index.max_entries)
+    ).all()
+    for city, country, latitude, longitude, timezone in reversed(rows):
+        index.add({"name": city, "admin1": None, "country": country,
+                   "latitude": latitude, "longitude": longitude, "timezone": timezone})
+    for candidates in weather_api.geocode_cache.values():
+        index.add_many(candidates)
+    index.loaded = True
+
+
+# Returns (results, source): index matches, or geocoding results when the index has none.
+def suggest(query, limit=DEFAULT_LIMIT, geocode=True):
+    ensure_loaded()
+    results = index.search(query, limit)
+    if results or not geocode or len(normalize(query)) < 3:
+        return results, "index"
+    candidates = weather_api.search_locations(city=query.strip(), country="", count=limit)
+    index.add_many(candidates)
+    return index.search(query, limit) or candidates[:limit], "geocoding"
+
+
+# Every fresh geocoding result extends the index.
+@weather_api.on_geocode
+def _index_geocoded(candidates):
+    index.add_many(candidates)
+
+
+# Newly committed records with coordinates extend the index (collected at flush, applied on commit).
+@event.listens_for(Session, "after_flush")
+def _collect_new_locations(session, flush_context):
+    for obj in session.new:
+        if isinstance(obj, WeatherRecord) and obj.latitude is not None:
+            session.info.setdefault("_autocomplete_new", []).append({
+                "name": obj.city, "admin1": None, "country": obj.country,
+                "latitude": obj.latitude, "longitude": obj.longitude, "timezone": obj.timezone,
+            })
+
+# Rows written by storage's upserts (Core, so no flush events) extend it the same way.
+@storage.on_write
+def _index_written(rows):
+    index.add_many([
+        {"name": row["city"], "admin1": None, "country": row["country"],
+         "latitude": row["latitude"], "longitude": row["longitude"], "timezone": row["timezone"]}
+        for row in rows if row.get("latitude") is not None
+    ])
+
+@event.listens_for(Session, "after_commit")
+def _index_new_locations(session):
+    index.add_many(session.info.pop("_autocomplete_new", []))
+
+@event.listens_for(Session, "after_rollback")
+def _discard_new_locations(session):
+    session.info.pop("_autocomplete_new", None)
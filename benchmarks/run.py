@@ -0,0 +1,205 @@
+"""
+Load benchmark for create_app() against a local Open-Meteo stand-in.
+
+    python -m benchmarks.run --sizes 1000,100000,1000000 --requests 200 --concurrency 8 \
+        --latency 0.05 --error-rate 0.01 --output bench.json
+
+For every table size a fresh SQLite database is seeded, then `/` (several sorts), `/nearby`, `/add`
+(new locations, so each one reaches the stand-in) and `/delete` are driven from a thread
+pool. Throughput and p50/p95/p99 latency per endpoint are written as JSON so runs can be
+compared across commits.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from sqlalchemy import insert
+
+import geo
+import rollups
+import versions
+import weather_api
+from app import create_app
+from benchmarks.stub_server import OpenMeteoStub
+from cache import GeocodeCache
+from models import db, WeatherRecord
+
+SEED_BATCH = 10_000
+
+
+# Nearest-rank percentile of an already sorted list.
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(endpoint, size, latencies, errors, wall_seconds):
+    latencies = sorted(latencies)
+    def ms(value):
+        return None if value is None else round(value * 1000, 3)
+    return {
+        "size": size,
+        "endpoint": endpoint,
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / wall_seconds, 2) if wall_seconds else None,
+        "p50_ms": ms(percentile(latencies, 0.50)),
+        "p95_ms": ms(percentile(latencies, 0.95)),
+        "p99_ms": ms(percentile(latencies, 0.99)),
+        "max_ms": ms(latencies[-1] if latencies else None),
+    }
+
+
+# Bulk-seeds weather_records with synthetic rows using Core executemany batches.
+def seed(app, size, batch_size=SEED_BATCH):
+    rng = random.Random(size)
+    cities = [f"Seed City {n}" for n in range(max(1, size // 365))]
+    coords = [(round(rng.uniform(-60, 70), 4), round(rng.uniform(-180, 180), 4)) for _ in cities]
+    start = date(2000, 1, 1)
+    with app.app_context():
+        table = WeatherRecord.__table__
+        batch = []
+        for n in range(size):
+            latitude, longitude = coords[n % len(cities)]
+            batch.append({
+                "requested_date": start + timedelta(days=n % 9000),
+                "city": cities[n % len(cities)],
+                "country": "Stubland",
+                "temp_max_c": round(rng.uniform(-10, 35), 1),
+                "temp_min_c": round(rng.uniform(-25, 20), 1),
+                "precip_mm": None if n % 17 == 0 else round(rng.uniform(0, 30), 1),
+                "wind_max_kmh": round(rng.uniform(0, 90), 1),
+                "source": "historical",
+                "latitude": latitude,
+                "longitude": longitude,
+                "timezone": "UTC",
+                "geo_cell": geo.cell_for(latitude, longitude),
+            })
+            if len(batch) == batch_size:
+                db.session.execute(insert(table), batch)
+                batch = []
+        if batch:
+            db.session.execute(insert(table), batch)
+        rollups.rebuild(db.session.connection())
+        versions.bump(db.session.connection())
+        db.session.commit()
+
+
+# Sends `requests` calls built by make_request(i, client) from `concurrency` threads; returns a summary.
+def drive(app, endpoint, size, requests, concurrency, make_request):
+    local = threading.local()
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = app.test_client()
+        started = time.perf_counter()
+        try:
+            response = make_request(i, client)
+            failed = response.status_code >= 400
+        except Exception:
+            failed = True
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            errors += failed
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    return summarize(endpoint, size, latencies, errors, time.perf_counter() - started)
+
+
+def run_size(size, args, workdir):
+    db_path = os.path.join(workdir, f"bench_{size}.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    app = create_app()
+    seeded_at = time.perf_counter()
+    seed(app, size)
+    seed_seconds = time.perf_counter() - seeded_at
+    weather_api.geocode_cache.clear()
+    weather_api.series_cache.clear()
+
+    with app.app_context():
+        ids = [row[0] for row in WeatherRecord.query.with_entities(WeatherRecord.id).limit(args.requests).all()]
+
+    sorts = ["requested_date", "city", "temp_max_c", "precip_mm"]
+    results = [
+        drive(app, "GET /", size, args.requests, args.concurrency,
+              lambda i, client: client.get(f"/?sort={sorts[i % len(sorts)]}&dir={'asc' if i % 2 else 'desc'}")),
+        drive(app, "GET /nearby", size, args.requests, args.concurrency,
+              lambda i, client: client.get(f"/nearby?lat={(i * 7) % 130 - 60}&lon={(i * 37) % 360 - 180}&km=100")),
+        drive(app, "POST /add", size, args.requests, args.concurrency,
+              lambda i, client: client.post("/add", data={
+                  "requested_date": (date.today() - timedelta(days=30 + i % 300)).isoformat(),
+                  "country": "Stubland",
+                  "city": f"Bench City {size}-{i}",
+              })),
+        drive(app, "POST /delete", size, len(ids), args.concurrency,
+              lambda i, client: client.post(f"/delete/{ids[i]}")),
+    ]
+    for result in results:
+        result["seed_seconds"] = round(seed_seconds, 2)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="1000,100000,1000000", help="Comma-separated table sizes to seed.")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint and size.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent client threads.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Stand-in response delay in seconds.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random delay of up to this many seconds.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of stand-in responses that are 503s.")
+    parser.add_argument("--output", help="Write JSON results here (default: stdout).")
+    args = parser.parse_args(argv)
+
+    weather_api.geocode_cache = GeocodeCache(path=None)
+
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    report = {
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "results": [],
+    }
+    with OpenMeteoStub(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate) as stub, \
+            tempfile.TemporaryDirectory() as workdir:
+        for size in sizes:
+            report["results"].extend(run_size(size, args, workdir))
+        report["upstream_requests"] = stub.requests
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as handle:
+            handle.write(text + "\n")
+    else:
+        print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
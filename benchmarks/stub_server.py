@@ -0,0 +1,140 @@
+"""
+Local stand-in for the Open-Meteo geocoding, forecast and archive endpoints.
+
+Responses are synthetic but shaped like the real API, and deterministic per request.
+Every request sleeps `latency` seconds (plus up to `jitter`) and fails with HTTP 503 at
+`error_rate`, so benchmarks can exercise retries and slow upstreams without the network.
+"""
+import json
+import random
+import threading
+import time
+import zlib
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import weather_api
+
+
+# Deterministic pseudo-coordinates for a place name, so each city maps to its own grid cell.
+def _coordinates(name):
+    seed = zlib.crc32(name.lower().encode())
+    return round((seed % 14000) / 100 - 70, 4), round((seed // 14000 % 36000) / 100 - 180, 4)
+
+def _daily(start, days, latitude):
+    times = [(start + timedelta(days=n)).isoformat() for n in range(days)]
+    base = 25 - abs(latitude) / 3
+    return {
+        "time": times,
+        "temperature_2m_max": [round(base + (n % 5), 1) for n in range(days)],
+        "temperature_2m_min": [round(base - 10 + (n % 3), 1) for n in range(days)],
+        "precipitation_sum": [round((n % 4) * 1.5, 1) for n in range(days)],
+        "wind_speed_10m_max": [round(10 + (n % 7) * 2.0, 1) for n in range(days)],
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "OpenMeteoStub/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        stub = self.server.stub
+        stub.count(self.path)
+        delay = stub.latency + (random.uniform(0, stub.jitter) if stub.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        if stub.error_rate and random.random() < stub.error_rate:
+            return self._send(503, {"error": True, "reason": "stub failure"})
+
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if url.path.endswith("/search"):
+            return self._send(200, self._search(params))
+        if url.path.endswith("/forecast"):
+            return self._send(200, self._forecast(params))
+        if url.path.endswith("/archive"):
+            return self._send(200, self._archive(params))
+        return self._send(404, {"error": True, "reason": "not found"})
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _search(self, params):
+        name = params.get("name", "").split(",")[0].strip()
+        if not name:
+            return {}
+        latitude, longitude = _coordinates(name)
+        return {"results": [{
+            "name": name, "admin1": "Stub Region", "country": "Stubland",
+            "latitude": latitude, "longitude": longitude, "timezone": "UTC",
+        }]}
+
+    def _forecast(self, params):
+        past_days = int(params.get("past_days", 0) or 0)
+        forecast_days = int(params.get("forecast_days", 7) or 7)
+        start = date.today() - timedelta(days=past_days)
+        return {"daily": _daily(start, past_days + forecast_days, float(params.get("latitude", 0)))}
+
+    def _archive(self, params):
+        start = date.fromisoformat(params["start_date"])
+        end = date.fromisoformat(params["end_date"])
+        return {"daily": _daily(start, (end - start).days + 1, float(params.get("latitude", 0)))}
+
+
+# Runs the stand-in on a background thread; use as a context manager.
+class OpenMeteoStub:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 host: str = "127.0.0.1", port: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, path):
+        endpoint = urlsplit(path).path.rsplit("/", 1)[-1]
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    # Points weather_api's endpoint URLs at this server; returns the previous values.
+    def install(self):
+        previous = (weather_api.GEO_URL, weather_api.FORECAST_URL, weather_api.HISTORICAL_URL)
+        weather_api.GEO_URL = f"{self.base_url}/v1/search"
+        weather_api.FORECAST_URL = f"{self.base_url}/v1/forecast"
+        weather_api.HISTORICAL_URL = f"{self.base_url}/v1/archive"
+        return previous
+
+    def __enter__(self):
+        self.start()
+        self._previous = self.install()
+        return self
+
+    def __exit__(self, *exc):
+        weather_api.GEO_URL, weather_api.FORECAST_URL, weather_api.HISTORICAL_URL = self._previous
+        self.stop()
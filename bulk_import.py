@@ -0,0 +1,240 @@
+import csv
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from models import db
+import quota
+import weather_api
+from storage import FORECAST_MAX_AGE, find_stored_days, is_fresh, upsert_days
+
+# Neighbouring dates closer than this share one range request; fetching the gap is cheaper than a new call.
+SPAN_GAP_DAYS = 7
+
+
+# Outcome of one CSV import; `failures` holds (line number, message) pairs.
+@dataclass
+class ImportReport:
+    rows: int = 0
+    inserted: int = 0
+    updated: int = 0
+    skipped: int = 0
+    locations: int = 0
+    fetch_groups: int = 0
+    failures: list = field(default_factory=list)
+
+    def fail(self, line, message):
+        self.failures.append((line, message))
+
+    def as_dict(self):
+        return {
+            "rows": self.rows,
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "skipped": self.skipped,
+            "failed": len(self.failures),
+            "locations": self.locations,
+            "fetch_groups": self.fetch_groups,
+            "failures": [{"line": line, "error": message} for line, message in self.failures],
+        }
+
+
+# Normalizes a location for de-duplication (case and whitespace insensitive).
+def _location_key(city, country, region):
+    def norm(value):
+        return " ".join((value or "").split()).lower()
+    return (norm(city), norm(country), norm(region))
+
+
+# Merges sorted dates into (start, end) spans, bridging gaps of up to `max_gap` days.
+def group_spans(dates, max_gap: int = SPAN_GAP_DAYS):
+    spans = []
+    for day in sorted(set(dates)):
+        if spans and (day - spans[-1][1]).days <= max_gap:
+            spans[-1][1] = day
+        else:
+            spans.append([day, day])
+    return [tuple(span) for span in spans]
+
+
+# Reads CSV rows one at a time; yields (line, date, city, country, region) and records bad rows on the report.
+def parse_rows(lines, report):
+    reader = csv.DictReader(lines)
+    fieldnames = {name.strip().lower() for name in (reader.fieldnames or [])}
+    if not {"city", "country"} <= fieldnames or not fieldnames & {"date", "requested_date"}:
+        raise ValueError("CSV header must include date (or requested_date), city and country columns.")
+
+    for row in reader:
+        line = reader.line_num
+        report.rows += 1
+        # DictReader collects fields beyond the header under the None key
+        extra = row.pop(None, None)
+        if extra:
+            report.fail(line, f"Too many fields: {len(row) + len(extra)} for a {len(row)}-column header.")
+            continue
+        row = {key.strip().lower(): (value or "").strip() for key, value in row.items()}
+        date_text = row.get("date") or row.get("requested_date") or ""
+        try:
+            requested_date = datetime.strptime(date_text, "%Y-%m-%d").date()
+        except ValueError:
+            report.fail(line, f"Invalid date '{date_text}' (expected YYYY-MM-DD).")
+            continue
+        if not row.get("city") or not row.get("country"):
+            report.fail(line, "City and country are required.")
+            continue
+        yield line, requested_date, row["city"], row["country"], row.get("region", "")
+
+
+# Imports (date, city, country, region) rows: skips rows already stored (and still fresh), geocodes
+# each distinct location once, fetches each location's dates as a few range requests on a thread
+# pool, then upserts in batches.
+def import_csv(lines, max_workers: int = 8, batch_size: int = 500, progress=None, max_age=FORECAST_MAX_AGE,
+               max_wait=None):
+    """
+    `lines` is any iterable of CSV text lines (an open file or a wrapped upload stream).
+    `progress`, if given, is called as progress(stage, done, total).
+    Returns an ImportReport; network and lookup errors are reported per row, not raised.
+    Upstream calls run in the low-priority quota lane, behind interactive requests; `max_wait`
+    bounds each call's wait for quota (a call that would wait longer fails its rows).
+    """
+    report = ImportReport()
+    parsed = []
+    locations = {}
+    for line, requested_date, city, country, region in parse_rows(lines, report):
+        key = _location_key(city, country, region)
+        locations.setdefault(key, (city, country, region))
+        parsed.append((line, requested_date, key))
+
+    # Read-through: rows already stored (and still fresh) or repeated in the file need no fetch.
+    # Rows with a region are matched once geocoded, since the region is what tells same-named places apart.
+    requested = {}
+    for line, requested_date, key in parsed:
+        requested.setdefault(key, set()).add(requested_date)
+    fresh = set()
+    for key, dates in requested.items():
+        city, country, region = locations[key]
+        if region:
+            continue
+        for day, record in find_stored_days(city, country, dates).items():
+            if is_fresh(record, max_age):
+                fresh.add((key, day))
+    rows, seen = [], set()
+    for line, requested_date, key in parsed:
+        if (key, requested_date) in fresh or (key, requested_date) in seen:
+            report.skipped += 1
+            continue
+        seen.add((key, requested_date))
+        rows.append((line, requested_date, key))
+    locations = {key: locations[key] for key in {key for _, _, key in rows}}
+    report.locations = len(locations)
+
+    def geocode(key):
+        city, country, region = locations[key]
+        try:
+            with quota.lane(quota.LOW, max_wait=max_wait):
+                candidates = weather_api.search_locations(city=city, country=country, admin1=(region or None))
+        except Exception as e:
+            return key, None, str(e)
+        if not candidates:
+            return key, None, "No matching locations found."
+        return key, candidates[0], None
+
+    dates_by_location = {}
+    for line, requested_date, key in rows:
+        dates_by_location.setdefault(key, []).append(requested_date)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        resolved, geocode_errors = {}, {}
+        for done, (key, match, error) in enumerate(pool.map(geocode, locations), start=1):
+            if match is None:
+                geocode_errors[key] = error
+            else:
+                resolved[key] = match
+            if progress:
+                progress("geocode", done, len(locations))
+
+        for key, match in resolved.items():
+            city, country, region = locations[key]
+            if not region:
+                continue
+            stored = find_stored_days(city, country, dates_by_location[key], match["latitude"], match["longitude"])
+            done = {day for day, record in stored.items() if is_fresh(record, max_age)}
+            if done:
+                dates_by_location[key] = [day for day in dates_by_location[key] if day not in done]
+                fresh.update((key, day) for day in done)
+        if fresh:
+            kept = [row for row in rows if (row[2], row[1]) not in fresh]
+            report.skipped += len(rows) - len(kept)
+            rows = kept
+
+        groups = [
+            (key, start, end)
+            for key in resolved
+            for start, end in group_spans(dates_by_location[key])
+        ]
+        report.fetch_groups = len(groups)
+
+        def fetch(group):
+            key, start, end = group
+            match = resolved[key]
+            try:
+                with quota.lane(quota.LOW, max_wait=max_wait):
+                    result = weather_api.fetch_weather_for_range(
+                        match["latitude"], match["longitude"], match["timezone"], start, end
+                    )
+            except Exception as e:
+                return group, None, str(e)
+            return group, {day["date"]: day for day in result["days"]}, None
+
+        days_by_location, fetch_errors = {}, {}
+        for done, (group, days, error) in enumerate(pool.map(fetch, groups), start=1):
+            key, start, end = group
+            if days is None:
+                fetch_errors[group] = error
+            else:
+                days_by_location.setdefault(key, {}).update(days)
+            if progress:
+                progress("fetch", done, len(groups))
+
+    batch = {}
+    pending = 0
+    for line, requested_date, key in rows:
+        if key in geocode_errors:
+            report.fail(line, geocode_errors[key])
+            continue
+        day = days_by_location.get(key, {}).get(requested_date)
+        if day is None:
+            error = next(
+                (message for (k, start, end), message in fetch_errors.items()
+                 if k == key and start <= requested_date <= end),
+                f"No weather data available for {requested_date.isoformat()}.",
+            )
+            report.fail(line, error)
+            continue
+        batch.setdefault(key, []).append(day)
+        pending += 1
+        if pending >= batch_size:
+            _write_batch(batch, locations, resolved, report)
+            batch, pending = {}, 0
+            if progress:
+                progress("insert", report.inserted + report.updated, len(rows))
+    if batch:
+        _write_batch(batch, locations, resolved, report)
+        if progress:
+            progress("insert", report.inserted + report.updated, len(rows))
+
+    report.failures.sort()
+    return report
+
+
+# Upserts one batch of fetched days (grouped by location) and commits it as a single transaction.
+def _write_batch(batch, locations, resolved, report):
+    for key, days in batch.items():
+        city, country, region = locations[key]
+        match = resolved[key]
+        inserted, updated = upsert_days(
+            city, country, days, match["latitude"], match["longitude"], match["timezone"], commit=False
+        )
+        report.inserted += inserted
+        report.updated += updated
+    db.session.commit()
@@ -0,0 +1,235 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Sentinel returned by cache lookups when nothing (not even a negative result) is stored.
+MISS = object()
+
+
+# Bounded in-process LRU with optional per-entry expiry; safe to share between threads.
+class LRUCache:
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, now: float | None = None, stale: bool = False):
+        """Expired entries read as MISS but stay until evicted, so `stale=True` can still return them."""
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return MISS
+            value, expires_at = entry
+            if not stale and expires_at is not None and expires_at <= now:
+                return MISS
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float | None = None, now: float | None = None):
+        now = time.time() if now is None else now
+        expires_at = None if ttl is None else now + ttl
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return MISS if entry is None else entry[0]
+
+    def values(self, now: float | None = None):
+        """Returns a snapshot of the unexpired values, least recently used first."""
+        now = time.time() if now is None else now
+        with self._lock:
+            return [value for value, expires_at in self._data.values() if expires_at is None or expires_at > now]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Two-tier cache for geocoding results: an LRU in front of a SQLite table with TTL expiry.
+class GeocodeCache:
+    """
+    Keys are normalized (city, country, admin1, count) tuples; values are the simplified
+    candidate lists returned by `weather_api.search_locations`. Empty lists are cached too
+    (with a shorter TTL) so a miss does not trigger the fallback query again.
+    Pass `path=None` to keep the cache in memory only.
+    """
+
+    def __init__(self, path: str | None = None, max_entries: int = 1024,
+                 ttl: float = 30 * 86400, negative_ttl: float = 86400):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.memory = LRUCache(max_entries)
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._conn = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(city: str, country: str, admin1: str | None = None, count: int = 6):
+        def norm(value):
+            return " ".join((value or "").split()).lower()
+        return (norm(city), norm(country), norm(admin1), int(count))
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS geocode_cache ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def get(self, key):
+        """Return the cached candidate list for `key`, or `MISS`."""
+        now = time.time()
+        value = self.memory.get(key, now)
+        if value is not MISS:
+            with self._lock:
+                self.hits += 1
+            return value
+
+        if self.path:
+            with self._lock:
+                row = self._connection().execute(
+                    "SELECT value, expires_at FROM geocode_cache WHERE key = ?",
+                    (json.dumps(key),),
+                ).fetchone()
+            if row is not None and row[1] > now:
+                value = json.loads(row[0])
+                self.memory.set(key, value, ttl=row[1] - now, now=now)
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return MISS
+
+    def set(self, key, value):
+        now = time.time()
+        ttl = self.ttl if value else self.negative_ttl
+        self.memory.set(key, value, ttl=ttl, now=now)
+        if self.path:
+            with self._lock:
+                conn = self._connection()
+                conn.execute(
+                    "INSERT OR REPLACE INTO geocode_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (json.dumps(key), json.dumps(value), now + ttl),
+                )
+                conn.execute("DELETE FROM geocode_cache WHERE expires_at <= ?", (now,))
+                conn.commit()
+
+    def values(self):
+        """Yields every unexpired candidate list on disk (or in memory when there is no disk store)."""
+        if not self.path:
+            yield from self.memory.values()
+            return
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT value FROM geocode_cache WHERE expires_at > ?", (time.time(),)
+            ).fetchall()
+        for (value,) in rows:
+            yield json.loads(value)
+
+    def clear(self):
+        self.memory.clear()
+        with self._lock:
+            self.hits = self.misses = self.disk_hits = 0
+            if self.path:
+                conn = self._connection()
+                conn.execute("DELETE FROM geocode_cache")
+                conn.commit()
+
+    def stats(self):
+        with self._lock:
+            hits, misses, disk_hits = self.hits, self.misses, self.disk_hits
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "disk_hits": disk_hits,
+            "hit_rate": (hits / total) if total else 0.0,
+            "entries": len(self.memory),
+        }
+
+
+# Per-day cache of Open-Meteo `daily` series, filled from whole responses.
+class SeriesCache:
+    """
+    Every response is split into one entry per day keyed by
+    (rounded latitude, rounded longitude, timezone, source, day), so a later request for
+    another day already covered by an earlier response is answered from memory.
+    Forecast days expire after a few hours; historical (archive) days never do.
+    """
+
+    DEFAULT_TTLS = {"forecast": 3 * 3600, "historical": None}
+
+    def __init__(self, max_entries: int = 8192, ttls: dict | None = None, precision: int = 4):
+        self.memory = LRUCache(max_entries)
+        self.ttls = dict(self.DEFAULT_TTLS, **(ttls or {}))
+        self.precision = precision
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def make_key(self, latitude: float, longitude: float, timezone: str, source: str, day):
+        day = day if isinstance(day, str) else day.isoformat()
+        return (round(float(latitude), self.precision), round(float(longitude), self.precision),
+                timezone or "UTC", source, day)
+
+    def store(self, latitude, longitude, timezone, source, daily: dict):
+        """Cache every day of an Open-Meteo `daily` block; returns how many days were stored."""
+        dates = daily.get("time") or []
+        ttl = self.ttls.get(source)
+        now = time.time()
+        for index, day in enumerate(dates):
+            values = {}
+            for name, series in daily.items():
+                if name == "time":
+                    continue
+                values[name] = series[index] if series is not None and index < len(series) else None
+            self.memory.set(self.make_key(latitude, longitude, timezone, source, day), values, ttl=ttl, now=now)
+        return len(dates)
+
+    def get(self, latitude, longitude, timezone, source, day, stale: bool = False):
+        """Return the cached daily values for one day, or `MISS`; `stale=True` also returns expired days."""
+        value = self.memory.get(self.make_key(latitude, longitude, timezone, source, day), stale=stale)
+        if stale:
+            return value
+        with self._lock:
+            if value is MISS:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def clear(self):
+        self.memory.clear()
+        with self._lock:
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": (hits / total) if total else 0.0,
+            "entries": len(self.memory),
+        }
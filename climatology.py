@@ -0,0 +1,179 @@
+import math
+import os
+from dataclasses import dataclass
+from datetime import date, timedelta
+
+import numpy as np
+from flask import has_app_context
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+import weather_api
+from cache import MISS, LRUCache
+from geo import cell_for
+from models import db, WeatherRecord
+from singleflight import SingleFlight
+import storage
+from storage import HAS_GEO_CELL
+
+MEASURES = ("temp_max_c", "temp_min_c", "precip_mm", "wind_max_kmh")
+# Annual harmonics in the seasonal cycle (1 = one sine/cosine pair per year).
+HARMONICS = 3
+# Years of archive history fetched when stored history is too short.
+HISTORY_YEARS = int(os.environ.get("CLIMATOLOGY_YEARS", "5"))
+# Stored historical days that make an archive request unnecessary.
+MIN_STORED_DAYS = 2 * 365
+# A linear trend is only fitted over at least this many years, so it cannot alias the seasonal cycle.
+MIN_TREND_YEARS = 2.0
+# Fewest observations a measure needs before it is fitted at all.
+MIN_SAMPLES = 60
+# Fitted models are reused for a day unless new history for the location is committed sooner.
+MODEL_TTL_SECONDS = 24 * 3600
+# Stored rows within this many degrees of the requested point count as the same location.
+MATCH_DEGREES = 0.01
+
+YEAR_DAYS = 365.2425
+EPOCH = date(2000, 1, 1).toordinal()
+
+models = LRUCache(max_entries=1024)
+_fits = SingleFlight()
+
+
+# Design matrix for `ordinals`: intercept, trend (years since 2000) and annual harmonics.
+def design_matrix(ordinals, harmonics=HARMONICS):
+    years = (np.asarray(ordinals, dtype=np.float64) - EPOCH) / YEAR_DAYS
+    phase = 2 * np.pi * years[:, None] * np.arange(1, harmonics + 1)
+    return np.column_stack([np.ones_like(years), years, np.cos(phase), np.sin(phase)])
+
+
+# Per-location coefficients; rows follow design_matrix() columns, columns follow MEASURES (NaN = not fitted).
+@dataclass
+class Model:
+    coefficients: np.ndarray
+    samples: int
+    first_day: date
+    last_day: date
+
+    def predict(self, days):
+        """Returns a (len(days), len(MEASURES)) array of predicted values."""
+        matrix = design_matrix([day.toordinal() for day in days], (self.coefficients.shape[0] - 2) // 2)
+        values = matrix @ np.nan_to_num(self.coefficients)
+        values[:, np.isnan(self.coefficients).all(axis=0)] = np.nan
+        values[:, 2:] = np.maximum(values[:, 2:], 0)  # precipitation and wind are never negative
+        values[:, 1] = np.fmin(values[:, 0], values[:, 1])  # an unfitted maximum must not blank the minimum
+        return values
+
+
+# Least-squares fit of every measure over the observed days; `values` is (days, MEASURES) with NaN gaps.
+def fit(days, values, harmonics=HARMONICS):
+    ordinals = np.array([day.toordinal() for day in days], dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    matrix = design_matrix(ordinals, harmonics)
+    with_trend = len(ordinals) > 0 and (ordinals.max() - ordinals.min()) / YEAR_DAYS >= MIN_TREND_YEARS
+    columns = np.ones(matrix.shape[1], dtype=bool)
+    columns[1] = with_trend
+
+    coefficients = np.full((matrix.shape[1], len(MEASURES)), np.nan)
+    observed = ~np.isnan(values)
+    for column in range(len(MEASURES)):
+        mask = observed[:, column]
+        if mask.sum() < MIN_SAMPLES:
+            continue
+        solution, *_ = np.linalg.lstsq(matrix[mask][:, columns], values[mask, column], rcond=None)
+        coefficients[:, column] = 0.0
+        coefficients[columns, column] = solution
+    return Model(coefficients, len(days), min(days, default=None), max(days, default=None))
+
+
+# Stored historical rows at the point, as {date: [values per measure]}.
+def _stored_history(latitude, longitude):
+    table = WeatherRecord.__table__
+    statement = select(table.c.requested_date, *(table.c[name] for name in MEASURES)).where(
+        table.c.source == "historical",
+        table.c.latitude.between(latitude - MATCH_DEGREES, latitude + MATCH_DEGREES),
+        table.c.longitude.between(longitude - MATCH_DEGREES, longitude + MATCH_DEGREES),
+    )
+    if HAS_GEO_CELL:
+        statement = statement.where(table.c.geo_cell == cell_for(latitude, longitude))
+    # Its own connection, so it is safe from fetch_many's worker threads
+    with db.engine.connect() as connection:
+        return {row[0]: list(row[1:]) for row in connection.execute(statement)}
+
+
+# Daily history for the location: stored rows first, topped up with one archive request when short.
+def history(latitude, longitude, timezone, today=None):
+    by_day = _stored_history(latitude, longitude) if has_app_context() else {}
+    if len(by_day) < MIN_STORED_DAYS:
+        end = (today or date.today()) - timedelta(days=weather_api.ARCHIVE_DELAY_DAYS + 1)
+        start = end - timedelta(days=math.ceil(HISTORY_YEARS * YEAR_DAYS) - 1)
+        archived = weather_api.fetch_archive_batch([(latitude, longitude, timezone)], start, end)[0]
+        for day, fields in archived.items():
+            by_day.setdefault(day, [fields[name] for name in MEASURES])
+    days = sorted(by_day)
+    values = np.array([[np.nan if v is None else v for v in by_day[day]] for day in days], dtype=np.float64)
+    return days, values.reshape(len(days), len(MEASURES))
+
+
+def _key(latitude, longitude):
+    return round(float(latitude), 2), round(float(longitude), 2)
+
+
+# Cached model for the location, fitted (once, even under concurrency) on a miss.
+def model_for(latitude, longitude, timezone):
+    key = _key(latitude, longitude)
+    model = models.get(key)
+    if model is MISS:
+        model, _ = _fits.do(key, _fit_location, key, latitude, longitude, timezone)
+    return model
+
+def _fit_location(key, latitude, longitude, timezone):
+    model = fit(*history(latitude, longitude, timezone or "UTC"))
+    models.set(key, model, ttl=MODEL_TTL_SECONDS)
+    return model
+
+
+# Predicted daily fields for each day: {date: {measure: value, "source": "predicted"}}; non-finite values become None.
+def predict(latitude, longitude, timezone, days):
+    days = list(days)
+    model = model_for(latitude, longitude, timezone)
+    if model.samples == 0 or np.isnan(model.coefficients).all():
+        raise ValueError("Not enough history to predict this location.")
+    with np.errstate(invalid="ignore", over="ignore"):
+        values = np.round(model.predict(days), 1)
+    return {
+        day: {
+            **{name: float(value) if np.isfinite(value) else None for name, value in zip(MEASURES, row)},
+            "source": "predicted",
+        }
+        for day, row in zip(days, values)
+    }
+
+weather_api.set_predictor(predict)
+
+
+# Drops cached models for locations that gained history.
+def invalidate(locations):
+    for latitude, longitude in locations:
+        models.pop(_key(latitude, longitude))
+
+
+# New or changed historical rows invalidate their location's model once the transaction commits.
+@event.listens_for(Session, "after_flush")
+def _collect_new_history(session, flush_context):
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, WeatherRecord) and obj.source == "historical" and obj.latitude is not None:
+            session.info.setdefault("_climatology_changed", set()).add((obj.latitude, obj.longitude))
+
+# Historical rows written by storage's upserts do the same.
+@storage.on_write
+def _invalidate_written(rows):
+    invalidate({(row["latitude"], row["longitude"]) for row in rows
+                if row.get("source") == "historical" and row.get("latitude") is not None})
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session):
+    invalidate(session.info.pop("_climatology_changed", ()))
+
+@event.listens_for(Session, "after_rollback")
+def _discard_on_rollback(session):
+    session.info.pop("_climatology_changed", None)
@@ -0,0 +1,100 @@
+import math
+
+from sqlalchemy import or_, select
+
+from models import db, WeatherRecord
+
+# Grid cell size in degrees. Stored geo_cell values depend on it, so changing it requires a backfill.
+CELL_DEGREES = 0.25
+ROWS = int(180 / CELL_DEGREES)
+COLS = int(360 / CELL_DEGREES)
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+DEFAULT_NEARBY_LIMIT = 100
+MAX_NEARBY_LIMIT = 1000
+MAX_RADIUS_KM = 2000.0
+
+
+def _row(latitude):
+    return min(ROWS - 1, max(0, int(math.floor((latitude + 90) / CELL_DEGREES))))
+
+def _col(longitude):
+    return int(math.floor((longitude + 180) / CELL_DEGREES)) % COLS
+
+
+# Returns the integer grid cell (row-major over latitude bands) containing a point.
+def cell_for(latitude, longitude):
+    if latitude is None or longitude is None:
+        return None
+    return _row(latitude) * COLS + _col(longitude)
+
+
+# Great-circle distance between two points in kilometres.
+def haversine_km(lat1, lon1, lat2, lon2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+# Returns inclusive (first, last) geo_cell ranges covering every point within `km` of a point.
+def cell_ranges(latitude, longitude, km):
+    """
+    Cells in one latitude band are consecutive integers, so each band contributes one range
+    (two where the circle crosses the antimeridian) and adjacent ranges are merged. The result
+    is a handful of BETWEEN clauses that the geo_cell index answers directly.
+    """
+    dlat = km / KM_PER_DEGREE
+    south, north = latitude - dlat, latitude + dlat
+    first_row, last_row = _row(south), _row(north)
+
+    if south <= -90 or north >= 90:
+        col_spans = [(0, COLS - 1)]
+    else:
+        widest = math.cos(math.radians(max(abs(south), abs(north))))
+        dlon = km / (KM_PER_DEGREE * widest)
+        first_col = int(math.floor((longitude - dlon + 180) / CELL_DEGREES))
+        last_col = int(math.floor((longitude + dlon + 180) / CELL_DEGREES))
+        if last_col - first_col + 1 >= COLS:
+            col_spans = [(0, COLS - 1)]
+        elif first_col < 0:
+            col_spans = [(0, last_col), (first_col % COLS, COLS - 1)]
+        elif last_col >= COLS:
+            col_spans = [(0, last_col % COLS), (first_col, COLS - 1)]
+        else:
+            col_spans = [(first_col, last_col)]
+
+    ranges = []
+    for row in range(first_row, last_row + 1):
+        for first, last in col_spans:
+            start, end = row * COLS + first, row * COLS + last
+            if ranges and ranges[-1][1] + 1 >= start:
+                ranges[-1] = (ranges[-1][0], max(ranges[-1][1], end))
+            else:
+                ranges.append((start, end))
+    return ranges
+
+
+# Returns stored rows within `km` of a point, nearest first, each with a "distance_km" key.
+def nearby_records(latitude, longitude, km, criteria=(), limit=DEFAULT_NEARBY_LIMIT):
+    """
+    Candidates are pruned in SQL by grid cell (and latitude band) before the exact
+    haversine check runs in Python, so only rows near the point are ever read.
+    `criteria` are extra WHERE clauses such as queries.filter_criteria(filters).
+    """
+    table = WeatherRecord.__table__
+    dlat = km / KM_PER_DEGREE
+    statement = select(*table.columns).where(
+        or_(*(table.c.geo_cell.between(first, last) for first, last in cell_ranges(latitude, longitude, km))),
+        table.c.latitude.between(latitude - dlat, latitude + dlat),
+        *criteria,
+    )
+    matches = []
+    for row in db.session.execute(statement).mappings():
+        distance = haversine_km(latitude, longitude, row["latitude"], row["longitude"])
+        if distance <= km:
+            matches.append({**row, "distance_km": round(distance, 3)})
+    matches.sort(key=lambda row: (row["distance_km"], row["requested_date"], row["id"]))
+    return matches[:limit]
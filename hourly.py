@@ -0,0 +1,164 @@
+from datetime import datetime, UTC
+
+import numpy as np
+from sqlalchemy import inspect, or_, select, text
+
+import weather_api
+from models import db, HourlySeries
+
+# Stored element type: 4-byte little-endian floats, NaN for missing hours.
+DTYPE = np.dtype("<f4")
+HOURS = 24
+# Unique key of weather_hourly files created before it included the coordinates.
+LEGACY_KEY = "uq_weather_hourly_day"
+# HourlySeries column -> Open-Meteo hourly variable.
+FIELDS = {
+    "temperature_c": "temperature_2m",
+    "precip_mm": "precipitation",
+    "wind_kmh": "wind_speed_10m",
+}
+
+
+# Packs a sequence of hourly values (None for missing) into float32 bytes.
+def pack(values):
+    return np.asarray(values, dtype=np.float64).astype(DTYPE).tobytes()
+
+# Decodes packed bytes back into a float32 array without copying.
+def unpack(blob):
+    return np.frombuffer(blob, dtype=DTYPE)
+
+
+# Stacks packed day series into one (days, hours) matrix, widened to the longest day; shorter days are padded with NaN.
+def stack(blobs, hours=HOURS):
+    """
+    Days follow local time, so DST days differ: spring-forward days have 23 hours and fall-back
+    days 25. No hour is dropped, so aggregates over the matrix include a 25th hour.
+    """
+    blobs = list(blobs)
+    hours = max([hours] + [len(blob) // DTYPE.itemsize for blob in blobs])
+    width = hours * DTYPE.itemsize
+    if all(len(blob) == width for blob in blobs):
+        return np.frombuffer(b"".join(blobs), dtype=DTYPE).reshape(len(blobs), hours)
+    matrix = np.full((len(blobs), hours), np.nan, dtype=DTYPE)
+    for row, blob in enumerate(blobs):
+        values = unpack(blob)
+        matrix[row, :len(values)] = values
+    return matrix
+
+
+# Per-day aggregates of hourly matrices, computed column-wise; days with no values give NaN.
+def daily_stats(temperature, precip, wind):
+    """Returns arrays matching the daily record fields (temp_max_c, temp_min_c, precip_mm, wind_max_kmh, temp_mean_c)."""
+    temp_count = np.count_nonzero(~np.isnan(temperature), axis=1)
+    precip_count = np.count_nonzero(~np.isnan(precip), axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        temp_mean = np.nansum(temperature, axis=1, dtype=np.float64) / temp_count
+    return {
+        "temp_max_c": np.fmax.reduce(temperature, axis=1),
+        "temp_min_c": np.fmin.reduce(temperature, axis=1),
+        "temp_mean_c": np.where(temp_count > 0, temp_mean, np.nan),
+        "precip_mm": np.where(precip_count > 0, np.nansum(precip, axis=1, dtype=np.float64), np.nan),
+        "wind_max_kmh": np.fmax.reduce(wind, axis=1),
+    }
+
+
+# Rebuilds weather_hourly when an older database file still keys it without coordinates.
+def upgrade_schema(engine):
+    """create_all() never alters an existing table, and SQLite cannot drop a constraint in place."""
+    table = HourlySeries.__table__
+    inspector = inspect(engine)
+    if LEGACY_KEY not in {constraint["name"] for constraint in inspector.get_unique_constraints(table.name)}:
+        return
+    indexes = [index["name"] for index in inspector.get_indexes(table.name)]
+    columns = ", ".join(column.name for column in table.columns)
+    with engine.begin() as connection:
+        for name in indexes:
+            connection.execute(text(f"DROP INDEX {name}"))
+        connection.execute(text(f"ALTER TABLE {table.name} RENAME TO {table.name}_legacy"))
+        table.create(connection)
+        connection.execute(text(f"INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {table.name}_legacy"))
+        connection.execute(text(f"DROP TABLE {table.name}_legacy"))
+
+# Fetches and stores hourly series for every day in the span; returns the number of days written.
+def ingest(city, country, latitude, longitude, timezone, start_date, end_date):
+    """Series are kept per location: a day stored for another place of the same name is left alone."""
+    fetched = weather_api.fetch_hourly_range(latitude, longitude, timezone, start_date, end_date)
+    stored = {}
+    for series in HourlySeries.query.filter(
+        HourlySeries.city == city,
+        HourlySeries.country == country,
+        HourlySeries.requested_date.between(start_date, end_date),
+        _at_location(HourlySeries.__table__, latitude, longitude),
+    ).order_by(HourlySeries.latitude.is_not(None)):
+        stored[series.requested_date] = series  # a row at these coordinates wins over one stored without any
+    now = datetime.now(UTC)
+    for day, (source, values) in fetched.items():
+        series = stored.get(day)
+        if series is None:
+            series = HourlySeries(city=city, country=country, requested_date=day)
+            db.session.add(series)
+        series.latitude, series.longitude, series.timezone = latitude, longitude, timezone
+        series.source = source
+        series.hours = len(values[FIELDS["temperature_c"]])
+        series.updated_at = now
+        for column, variable in FIELDS.items():
+            setattr(series, column, pack(values[variable]))
+    db.session.commit()
+    return len(fetched)
+
+
+# Rows at exactly these coordinates, or stored without any.
+def _at_location(table, latitude, longitude):
+    return or_(table.c.latitude.is_(None), (table.c.latitude == latitude) & (table.c.longitude == longitude))
+
+# Loads stored days as (dates, sources, hour counts, {column: (days, hours) float32 matrix}) without building ORM objects.
+def load(city, country, start_date, end_date, latitude=None, longitude=None):
+    """
+    Without coordinates, every stored series of the name must be at one place; otherwise
+    ValueError asks for the coordinates (as storage.find_stored, which declines to guess).
+    """
+    table = HourlySeries.__table__
+    statement = (
+        select(table.c.requested_date, table.c.source, table.c.hours, table.c.latitude, table.c.longitude,
+               *(table.c[column] for column in FIELDS))
+        .where(table.c.city == city, table.c.country == country,
+               table.c.requested_date.between(start_date, end_date))
+        .order_by(table.c.requested_date)
+    )
+    if latitude is not None and longitude is not None:
+        statement = statement.where(table.c.latitude == latitude, table.c.longitude == longitude)
+    rows = db.session.execute(statement).all()
+    if len({(row.latitude, row.longitude) for row in rows}) > 1:
+        raise ValueError(f"Hourly series are stored for several places named {city}, {country}; pass lat and lon.")
+    dates = [row.requested_date for row in rows]
+    sources = [row.source for row in rows]
+    counts = [row.hours for row in rows]
+    matrices = {column: stack(getattr(row, column) for row in rows) for column in FIELDS}
+    return dates, sources, counts, matrices
+
+
+# Converts a float array to a JSON-ready list, rounding and mapping NaN to None.
+def to_list(values, digits=2):
+    rounded = np.round(np.asarray(values, dtype=np.float64), digits).astype(object)
+    rounded[np.isnan(np.asarray(values, dtype=np.float64))] = None
+    return rounded.tolist()
+
+
+# Stored hourly days with their derived daily aggregates, ready for JSON.
+def describe(city, country, start_date, end_date, latitude=None, longitude=None):
+    dates, sources, counts, matrices = load(city, country, start_date, end_date, latitude, longitude)
+    if not dates:
+        return []
+    stats = daily_stats(matrices["temperature_c"], matrices["precip_mm"], matrices["wind_kmh"])
+    hours = {column: to_list(matrix) for column, matrix in matrices.items()}
+    daily = {name: to_list(values) for name, values in stats.items()}
+    return [
+        {
+            "date": day.isoformat(),
+            "source": sources[row],
+            "hours": counts[row],
+            "hourly": {column: hours[column][row][:counts[row]] for column in FIELDS},
+            "daily": {name: daily[name][row] for name in stats},
+        }
+        for row, day in enumerate(dates)
+    ]
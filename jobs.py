@@ -0,0 +1,227 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import date, datetime, timedelta, UTC
+
+from flask import current_app
+from sqlalchemy import update
+
+import metrics
+import weather_api
+from models import db, Job
+from storage import find_stored, is_fresh, upsert_record
+
+UNFINISHED = ("queued", "running")
+# How long finished jobs that need attention (failed / ambiguous) stay listed on the index page.
+RECENT_WINDOW = timedelta(minutes=10)
+# How long a "running" job may go without an update before resume() treats its worker as dead.
+JOB_LEASE = timedelta(minutes=10)
+
+
+# Job handler for /add: read-through check, geocode if needed, fetch and upsert; returns (status, result).
+def run_add(payload):
+    city, country = payload["city"], payload["country"]
+    requested_date = date.fromisoformat(payload["requested_date"])
+
+    latitude, longitude, timezone = payload.get("latitude"), payload.get("longitude"), payload.get("timezone")
+    if latitude is None or longitude is None or not timezone:
+        latitude = longitude = timezone = None
+
+    # Without coordinates a region is only matched against stored rows after geocoding (see /add)
+    if latitude is not None or not payload.get("region"):
+        stored = _fresh_record(city, country, requested_date, latitude, longitude)
+        if stored is not None:
+            return "done", {"record_id": stored.id, "created": False}
+
+    if latitude is None:
+        candidates = weather_api.search_locations(city=city, country=country, admin1=payload.get("region") or None)
+        if not candidates:
+            raise LookupError("No matching locations found.")
+        if len(candidates) > 1:
+            return "ambiguous", {"candidates": candidates}
+        latitude, longitude, timezone = candidates[0]["latitude"], candidates[0]["longitude"], candidates[0]["timezone"]
+        stored = _fresh_record(city, country, requested_date, latitude, longitude)
+        if stored is not None:
+            return "done", {"record_id": stored.id, "created": False}
+
+    daily = weather_api.fetch_weather_for_date(
+        city=city,
+        country=country,
+        target_date=requested_date,
+        latitude=latitude,
+        longitude=longitude,
+        timezone=timezone,
+    )
+    record, created = upsert_record(city, country, requested_date, daily, latitude, longitude, timezone)
+    return "done", {"record_id": record.id, "created": created}
+
+# The stored record for the location's day if it is still fresh, else None.
+def _fresh_record(city, country, requested_date, latitude, longitude):
+    stored = find_stored(city, country, requested_date, latitude, longitude)
+    return stored if stored is not None and is_fresh(stored, current_app.config["FORECAST_MAX_AGE"]) else None
+
+HANDLERS = {"add": run_add}
+
+
+# Background worker pool that runs queued jobs inside their own app context.
+class JobQueue:
+    """
+    Jobs are persisted in weather_jobs before they are handed to a worker, so their status
+    survives restarts: resume() resubmits queued jobs, and running jobs whose lease (`lease`
+    since their last update) has run out, since another live process may still be running them.
+    A worker claims a job by flipping it from "queued" to "running" in one UPDATE, so a
+    job is never run twice even if several processes resume the same table.
+    A job that hits an open upstream circuit goes back to "queued" and is retried once the
+    circuit allows a trial call.
+    """
+
+    def __init__(self, app, workers: int = 4, lease: timedelta = JOB_LEASE):
+        self.app = app
+        self.lease = lease
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="weather-job")
+        self._futures = set()
+        self._timers = set()
+        self._lock = threading.Lock()
+
+    def submit(self, kind, payload, city, country, requested_date=None, delay=None):
+        """Persists and queues a job; with `delay` (seconds) it is only handed to a worker after that."""
+        job = Job(kind=kind, status="queued", city=city, country=country,
+                  requested_date=requested_date, payload=json.dumps(payload))
+        db.session.add(job)
+        db.session.commit()
+        if delay:
+            self._dispatch_later(job.id, delay)
+        else:
+            self._dispatch(job.id)
+        return job
+
+    def resume(self, now=None):
+        """
+        Resubmits queued jobs and reclaims running jobs whose lease has expired; returns how many
+        were resubmitted. A stale job is reclaimed with a conditional UPDATE, so when several
+        processes resume at once only one of them takes it back.
+        """
+        now = now or datetime.now(UTC)
+        expired = now - self.lease
+        job_ids = [job_id for (job_id,) in db.session.query(Job.id).filter(Job.status == "queued")]
+        stale = [job_id for (job_id,) in db.session.query(Job.id).filter(Job.status == "running", Job.updated_at < expired)]
+        for job_id in stale:
+            reclaimed = db.session.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.status == "running", Job.updated_at < expired)
+                .values(status="queued", updated_at=now)
+            ).rowcount
+            if reclaimed:
+                job_ids.append(job_id)
+        db.session.commit()
+        for job_id in job_ids:
+            self._dispatch(job_id)
+        return len(job_ids)
+
+    def wait(self, timeout=None):
+        """Blocks until every job submitted so far has finished."""
+        with self._lock:
+            pending = list(self._futures)
+        wait(pending, timeout=timeout)
+
+    def shutdown(self):
+        with self._lock:
+            timers, self._timers = self._timers, set()
+        for timer in timers:
+            timer.cancel()
+        self._executor.shutdown(wait=True)
+
+    def _dispatch(self, job_id):
+        future = self._executor.submit(self._run, job_id)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._forget)
+
+    def _forget(self, future):
+        with self._lock:
+            self._futures.discard(future)
+
+    def _dispatch_later(self, job_id, delay):
+        def fire():
+            with self._lock:
+                self._timers.discard(timer)
+            self._dispatch(job_id)
+        timer = threading.Timer(delay, fire)
+        timer.daemon = True
+        with self._lock:
+            self._timers.add(timer)
+        timer.start()
+
+    def _run(self, job_id):
+        with self.app.app_context():
+            claimed = db.session.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.status == "queued")
+                .values(status="running", updated_at=datetime.now(UTC))
+            ).rowcount
+            db.session.commit()
+            if not claimed:
+                return
+
+            job = db.session.get(Job, job_id)
+            try:
+                status, result = HANDLERS[job.kind](json.loads(job.payload))
+                error = None
+            except weather_api.CircuitOpenError as e:
+                # Upstream outage: keep the job queued and retry when the circuit allows a trial call
+                db.session.rollback()
+                job = db.session.get(Job, job_id)
+                job.status, job.error = "queued", str(e)
+                db.session.commit()
+                self._dispatch_later(job_id, e.retry_after)
+                return
+            except Exception as e:
+                db.session.rollback()
+                job = db.session.get(Job, job_id)
+                status, result, error = "failed", None, str(e) or e.__class__.__name__
+            job.status = status
+            job.result = json.dumps(result) if result is not None else None
+            job.error = error
+            db.session.commit()
+            metrics.inc("weather_jobs_total", kind=job.kind, status=status)
+
+
+# Returns the app's job queue, starting its workers on first use.
+def get_queue(app):
+    queue = app.extensions.get("weather_jobs")
+    if queue is None:
+        queue = app.extensions["weather_jobs"] = JobQueue(
+            app, workers=app.config.get("JOB_WORKERS", 4), lease=app.config.get("JOB_LEASE", JOB_LEASE)
+        )
+    return queue
+
+
+# Jobs the index page lists: everything unfinished plus recent failures and location choices.
+def recent_jobs(limit=20, now=None):
+    cutoff = (now or datetime.now(UTC)) - RECENT_WINDOW
+    return (
+        Job.query
+        .filter(db.or_(
+            Job.status.in_(UNFINISHED),
+            db.and_(Job.status.in_(("failed", "ambiguous")), Job.updated_at >= cutoff),
+        ))
+        .order_by(Job.id.desc())
+        .limit(limit)
+        .all()
+    )
+
+
+# JSON view of a job for the /jobs/<id> status endpoint.
+def describe(job):
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "city": job.city,
+        "country": job.country,
+        "requested_date": job.requested_date.isoformat() if job.requested_date else None,
+        "result": json.loads(job.result) if job.result else None,
+        "error": job.error,
+        "created_at": job.created_at.isoformat(),
+        "updated_at": job.updated_at.isoformat(),
+    }
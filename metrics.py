@@ -0,0 +1,237 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# Latency buckets (seconds) shared by every histogram.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HELP = {
+    "weather_upstream_request_seconds": "Time spent in Open-Meteo requests, including retries.",
+    "weather_upstream_errors_total": "Open-Meteo requests that failed after retries.",
+    "weather_upstream_rows_total": "Result rows (candidates or days) returned by Open-Meteo.",
+    "weather_db_flush_seconds": "Time spent flushing the SQLAlchemy session.",
+    "weather_db_commit_seconds": "Time spent committing database transactions.",
+    "weather_template_render_seconds": "Time spent rendering Jinja templates.",
+    "weather_http_request_seconds": "Time spent handling HTTP requests.",
+    "weather_cache_hits_total": "Cache lookups answered from a cache.",
+    "weather_cache_misses_total": "Cache lookups that missed.",
+    "weather_upstream_calls_total": "Upstream lookups started (coalescing leaders).",
+    "weather_upstream_coalesced_total": "Lookups that waited for an identical in-flight call instead of calling upstream.",
+    "weather_jobs_total": "Background jobs finished, by outcome.",
+    "weather_quota_wait_seconds": "Time upstream calls waited for an Open-Meteo quota token.",
+    "weather_quota_queue_depth": "Upstream calls currently waiting for a quota token.",
+    "weather_quota_rejected_total": "Upstream calls refused because the quota wait would exceed the lane's limit.",
+    "weather_circuit_state": "Upstream circuit state: 0 closed, 1 half-open, 2 open.",
+    "weather_circuit_opened_total": "Times an upstream circuit opened.",
+    "weather_circuit_rejected_total": "Upstream calls failed fast because the circuit was open.",
+}
+# Collector series that are point-in-time values rather than counters.
+GAUGES = {"weather_quota_queue_depth", "weather_circuit_state"}
+
+# Spans recorded during the current request, for the Server-Timing header (None outside requests).
+_request_spans = contextvars.ContextVar("request_spans", default=None)
+# Start times of templates currently being rendered (renders can nest).
+_render_starts = contextvars.ContextVar("render_starts", default=())
+_NULL_SPAN = nullcontext()
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+
+# In-process counters and histograms rendered in Prometheus text format.
+class Registry:
+    """
+    When `enabled` is False every recording call returns immediately, so instrumentation
+    left in hot paths costs one attribute check.
+    Collectors are callables returning (name, labels, value) triples for counters that are
+    tracked elsewhere (e.g. cache statistics) and read only when /metrics is scraped.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.server_timing = False
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, timing_name=None, **labels):
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(BUCKETS), 0.0, 0]
+            index = bisect.bisect_left(BUCKETS, seconds)
+            if index < len(BUCKETS):
+                histogram[0][index] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+        spans = _request_spans.get()
+        if spans is not None and timing_name:
+            spans.append((timing_name, seconds))
+
+    def span(self, name, timing_name=None, **labels):
+        """Context manager timing its block into histogram `name`."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return self._span(name, timing_name, labels)
+
+    @contextmanager
+    def _span(self, name, timing_name, labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, timing_name=timing_name, **labels)
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(h[0]), h[1], h[2]) for key, h in self._histograms.items()}
+        for collector in self._collectors:
+            for name, labels, value in collector():
+                counters[(name, _label_key(labels))] = value
+
+        lines = []
+        for kind, series in (("counter", counters), ("histogram", histograms)):
+            for name in sorted({name for name, _ in series}):
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} {'gauge' if name in GAUGES else kind}")
+                for (series_name, key), value in sorted(series.items(), key=lambda item: item[0]):
+                    if series_name != name:
+                        continue
+                    if kind == "counter":
+                        lines.append(f"{name}{_format_labels(key)} {value}")
+                        continue
+                    buckets, total, count = value
+                    cumulative = 0
+                    for bound, hits in zip(BUCKETS, buckets):
+                        cumulative += hits
+                        lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {total}")
+                    lines.append(f"{name}_count{_format_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# Module-level shortcuts used by instrumented code.
+inc = registry.inc
+span = registry.span
+observe = registry.observe
+
+
+# Starts collecting Server-Timing spans for the current request.
+def begin_request():
+    return _request_spans.set([])
+
+# Returns the Server-Timing header value for the spans recorded since begin_request().
+def end_request(token):
+    spans = _request_spans.get() or []
+    _request_spans.reset(token)
+    totals = {}
+    for name, seconds in spans:
+        totals[name] = totals.get(name, 0.0) + seconds
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items())
+
+
+_db_hooks_installed = False
+
+# Hooks Flask request/template signals and SQLAlchemy flush/commit events into `registry`.
+def init_app(app):
+    global _db_hooks_installed
+    from flask import before_render_template, g, request, template_rendered
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+
+    registry.enabled = app.config.get("METRICS_ENABLED", True)
+    registry.server_timing = app.config.get("METRICS_SERVER_TIMING", False)
+
+    @app.before_request
+    def _start_request_timer():
+        if registry.enabled:
+            g._metrics_started = time.perf_counter()
+            g._metrics_token = begin_request()
+
+    @app.after_request
+    def _finish_request_timer(response):
+        started = g.pop("_metrics_started", None)
+        token = g.pop("_metrics_token", None)
+        if started is None:
+            return response
+        registry.observe("weather_http_request_seconds", time.perf_counter() - started,
+                         endpoint=request.endpoint or "unknown", method=request.method)
+        header = end_request(token)
+        if registry.server_timing and header:
+            response.headers["Server-Timing"] = header
+        return response
+
+    def _render_started(sender, template, context, **extra):
+        if registry.enabled:
+            _render_starts.set(_render_starts.get() + (time.perf_counter(),))
+
+    def _render_finished(sender, template, context, **extra):
+        starts = _render_starts.get()
+        if starts:
+            _render_starts.set(starts[:-1])
+            registry.observe("weather_template_render_seconds", time.perf_counter() - starts[-1],
+                             timing_name="render", template=template.name or "string")
+
+    before_render_template.connect(_render_started, app, weak=False)
+    template_rendered.connect(_render_finished, app, weak=False)
+
+    if _db_hooks_installed:
+        return
+    _db_hooks_installed = True
+
+    @event.listens_for(Session, "before_flush")
+    def _flush_started(session, flush_context, instances):
+        if registry.enabled:
+            session.info["_metrics_flush_started"] = time.perf_counter()
+
+    @event.listens_for(Session, "after_flush_postexec")
+    def _flush_finished(session, flush_context):
+        started = session.info.pop("_metrics_flush_started", None)
+        if started is not None:
+            registry.observe("weather_db_flush_seconds", time.perf_counter() - started, timing_name="db-flush")
+
+    @event.listens_for(Session, "before_commit")
+    def _commit_started(session):
+        if registry.enabled:
+            session.info["_metrics_commit_started"] = time.perf_counter()
+
+    @event.listens_for(Session, "after_commit")
+    def _commit_finished(session):
+        started = session.info.pop("_metrics_commit_started", None)
+        if started is not None:
+            registry.observe("weather_db_commit_seconds", time.perf_counter() - started, timing_name="db-commit")
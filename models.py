@@ -1,24 +1,134 @@
 from datetime import datetime, UTC
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects import postgresql, sqlite
 
 db = SQLAlchemy()
 
+# INSERT for `table` with the dialect's on_conflict_do_update()/on_conflict_do_nothing() (SQLite or PostgreSQL).
+def upsert_insert(connection, table):
+    dialect = postgresql if connection.dialect.name == "postgresql" else sqlite
+    return dialect.insert(table)
+
 class WeatherRecord(db.Model):
     __tablename__ = "weather_records"
+    # Composite indexes for the filtered listing paths (filter column + date order, id as tiebreaker).
+    # SQLite single-column indexes also carry the rowid, so they serve ORDER BY <column>, id directly.
+    __table_args__ = (
+        db.Index("ix_weather_records_city_requested_date", "city", "requested_date", "id"),
+        db.Index("ix_weather_records_country_requested_date", "country", "requested_date", "id"),
+        db.Index("ix_weather_records_source_requested_date", "source", "requested_date", "id"),
+        # Spatial lookups: cell ranges first, then the latitude band inside each cell.
+        db.Index("ix_weather_records_geo_cell_latitude", "geo_cell", "latitude"),
+        # One row per location and day; the conflict target of storage's upserts. Rows without coordinates never collide.
+        db.Index("uq_weather_records_location_day", "city", "country", "requested_date", "latitude", "longitude", unique=True),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     requested_date = db.Column(db.Date, nullable=False, index=True)
     city = db.Column(db.String(120), nullable=False, index=True)
     country = db.Column(db.String(120), nullable=False, index=True)
 
-    temp_max_c = db.Column(db.Float, nullable=True)
-    temp_min_c = db.Column(db.Float, nullable=True)
-    precip_mm = db.Column(db.Float, nullable=True)
-    wind_max_kmh = db.Column(db.Float, nullable=True)
+    temp_max_c = db.Column(db.Float, nullable=True, index=True)
+    temp_min_c = db.Column(db.Float, nullable=True, index=True)
+    precip_mm = db.Column(db.Float, nullable=True, index=True)
+    wind_max_kmh = db.Column(db.Float, nullable=True, index=True)
+
+    source = db.Column(db.String(32), nullable=False, index=True)  # "historical" or "forecast"
 
-    source = db.Column(db.String(32), nullable=False)  # "historical" or "forecast"
+    # Resolved location of the row; geo_cell is geo.cell_for(latitude, longitude), None when unknown.
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    timezone = db.Column(db.String(64), nullable=True)
+    geo_cell = db.Column(db.Integer, nullable=True)
 
     created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(UTC), index=True)
+    # When the weather values were last fetched; drives forecast freshness for read-through /add.
+    updated_at = db.Column(db.DateTime, nullable=True, default=lambda: datetime.now(UTC))
 
     def __repr__(self):
         return f"<WeatherRecord {self.id} {self.city}, {self.country} {self.requested_date}>"
+
+class MonthlyRollup(db.Model):
+    """Running per-location, per-month aggregates of weather_records (maintained by rollups.py)."""
+    __tablename__ = "weather_rollups"
+    __table_args__ = (
+        db.UniqueConstraint("city", "country", "year", "month", name="uq_weather_rollups_group"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    city = db.Column(db.String(120), nullable=False)
+    country = db.Column(db.String(120), nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    month = db.Column(db.Integer, nullable=False)
+
+    row_count = db.Column(db.Integer, nullable=False, default=0)
+    temp_max_sum = db.Column(db.Float, nullable=False, default=0.0)
+    temp_max_count = db.Column(db.Integer, nullable=False, default=0)
+    temp_max_peak = db.Column(db.Float, nullable=True)
+    temp_min_sum = db.Column(db.Float, nullable=False, default=0.0)
+    temp_min_count = db.Column(db.Integer, nullable=False, default=0)
+    temp_min_low = db.Column(db.Float, nullable=True)
+    precip_sum = db.Column(db.Float, nullable=False, default=0.0)
+    precip_count = db.Column(db.Integer, nullable=False, default=0)
+    wind_max_peak = db.Column(db.Float, nullable=True)
+
+    def __repr__(self):
+        return f"<MonthlyRollup {self.city}, {self.country} {self.year}-{self.month:02d}>"
+
+class Job(db.Model):
+    """A queued /add request processed by a background worker (see jobs.py)."""
+    __tablename__ = "weather_jobs"
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(32), nullable=False, default="add")
+    # "queued" -> "running" -> "done" | "failed" | "ambiguous" (several locations matched)
+    status = db.Column(db.String(16), nullable=False, default="queued", index=True)
+    city = db.Column(db.String(120), nullable=False)
+    country = db.Column(db.String(120), nullable=False)
+    requested_date = db.Column(db.Date, nullable=True)
+    payload = db.Column(db.Text, nullable=False)  # JSON of the submitted form fields
+    result = db.Column(db.Text, nullable=True)  # JSON: {"record_id", "created"} or {"candidates"}
+    error = db.Column(db.Text, nullable=True)
+
+    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(UTC))
+    updated_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(UTC),
+                           onupdate=lambda: datetime.now(UTC))
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.kind} {self.status}>"
+
+class HourlySeries(db.Model):
+    """One location-day of hourly values, each variable packed as little-endian float32 (NaN = missing)."""
+    __tablename__ = "weather_hourly"
+    __table_args__ = (
+        # Keyed like weather_records (storage.LOCATION_DAY), so same-named places keep separate series
+        db.UniqueConstraint("city", "country", "requested_date", "latitude", "longitude",
+                            name="uq_weather_hourly_location_day"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    city = db.Column(db.String(120), nullable=False)
+    country = db.Column(db.String(120), nullable=False)
+    requested_date = db.Column(db.Date, nullable=False, index=True)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    timezone = db.Column(db.String(64), nullable=True)
+    source = db.Column(db.String(32), nullable=False)
+    hours = db.Column(db.Integer, nullable=False, default=24)
+
+    temperature_c = db.Column(db.LargeBinary, nullable=False)
+    precip_mm = db.Column(db.LargeBinary, nullable=False)
+    wind_kmh = db.Column(db.LargeBinary, nullable=False)
+
+    updated_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(UTC),
+                           onupdate=lambda: datetime.now(UTC))
+
+    def __repr__(self):
+        return f"<HourlySeries {self.city}, {self.country} {self.requested_date}>"
+
+class TableVersion(db.Model):
+    """Change counter per table; bumped in the same transaction as every write (see versions.py)."""
+    __tablename__ = "weather_table_versions"
+
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
@@ -0,0 +1,152 @@
+import base64
+import json
+from datetime import date, datetime
+
+from sqlalchemy import and_, or_, select
+
+from models import db, WeatherRecord
+
+DEFAULT_PER_PAGE = 50
+MAX_PER_PAGE = 500
+
+# Columns the records table can be sorted by (query-string name -> column).
+SORTABLE = {
+    "id": WeatherRecord.id,
+    "requested_date": WeatherRecord.requested_date,
+    "city": WeatherRecord.city,
+    "country": WeatherRecord.country,
+    "temp_max_c": WeatherRecord.temp_max_c,
+    "temp_min_c": WeatherRecord.temp_min_c,
+    "precip_mm": WeatherRecord.precip_mm,
+    "wind_max_kmh": WeatherRecord.wind_max_kmh,
+    "source": WeatherRecord.source,
+    "created_at": WeatherRecord.created_at,
+}
+
+FILTER_FIELDS = ("date_from", "date_to", "city", "country", "source")
+
+
+# Reads sort, direction, filters and page size from request args, falling back to defaults on bad input.
+def parse_listing_args(args):
+    sort = args.get("sort", "requested_date")
+    if sort not in SORTABLE:
+        sort = "requested_date"
+    direction = "asc" if args.get("dir") == "asc" else "desc"
+
+    filters = {}
+    for name in FILTER_FIELDS:
+        value = (args.get(name) or "").strip()
+        if not value:
+            continue
+        if name in ("date_from", "date_to"):
+            try:
+                value = datetime.strptime(value, "%Y-%m-%d").date()
+            except ValueError:
+                continue
+        filters[name] = value
+
+    try:
+        per_page = int(args.get("per_page", DEFAULT_PER_PAGE))
+    except ValueError:
+        per_page = DEFAULT_PER_PAGE
+    per_page = max(1, min(per_page, MAX_PER_PAGE))
+
+    return sort, direction, filters, per_page
+
+
+# Returns WHERE criteria for the given filters; city/country/source match exactly so indexes apply.
+def filter_criteria(filters):
+    criteria = []
+    if "date_from" in filters:
+        criteria.append(WeatherRecord.requested_date >= filters["date_from"])
+    if "date_to" in filters:
+        criteria.append(WeatherRecord.requested_date <= filters["date_to"])
+    for name in ("city", "country", "source"):
+        if name in filters:
+            criteria.append(getattr(WeatherRecord, name) == filters[name])
+    return criteria
+
+
+# ORDER BY for a sort column with `id` as the tiebreaker; NULLs sort as the smallest value.
+def order_by(sort, direction):
+    column = SORTABLE[sort]
+    if direction == "asc":
+        ordering = [column.asc().nulls_first() if column.nullable else column.asc()]
+        tiebreak = WeatherRecord.id.asc()
+    else:
+        ordering = [column.desc().nulls_last() if column.nullable else column.desc()]
+        tiebreak = WeatherRecord.id.desc()
+    if column is not WeatherRecord.id:
+        ordering.append(tiebreak)
+    return ordering
+
+
+# Returns the criterion selecting rows strictly after (value, last_id) in the given order.
+def seek_criterion(sort, direction, value, last_id):
+    column = SORTABLE[sort]
+    id_column = WeatherRecord.id
+    if column is id_column:
+        return id_column > last_id if direction == "asc" else id_column < last_id
+    if direction == "asc":
+        if value is None:
+            return or_(and_(column.is_(None), id_column > last_id), column.is_not(None))
+        return or_(column > value, and_(column == value, id_column > last_id))
+    if value is None:
+        return and_(column.is_(None), id_column < last_id)
+    return or_(column < value, and_(column == value, id_column < last_id), column.is_(None))
+
+
+# Encodes the sort value and id of the last row on a page into an opaque URL-safe token.
+def encode_cursor(record, sort):
+    value = getattr(record, sort)
+    if isinstance(value, (date, datetime)):
+        value = value.isoformat()
+    raw = json.dumps([value, record.id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+# Decodes a cursor token back into (value, id); returns None for anything malformed.
+def decode_cursor(token, sort):
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        value, last_id = json.loads(raw)
+        last_id = int(last_id)
+        if value is not None:
+            python_type = SORTABLE[sort].type.python_type
+            if python_type is datetime:
+                value = datetime.fromisoformat(value)
+            elif python_type is date:
+                value = date.fromisoformat(value)
+            elif python_type is float:
+                value = float(value)
+    except (ValueError, TypeError):
+        return None
+    return value, last_id
+
+
+# Fetches one page of records after `cursor`; returns (records, next_cursor or None).
+def keyset_page(sort, direction, filters, cursor=None, per_page=DEFAULT_PER_PAGE):
+    query = WeatherRecord.query.filter(*filter_criteria(filters))
+    position = decode_cursor(cursor, sort) if cursor else None
+    if position is not None:
+        query = query.filter(seek_criterion(sort, direction, *position))
+    records = query.order_by(*order_by(sort, direction)).limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(records) > per_page:
+        records = records[:per_page]
+        next_cursor = encode_cursor(records[-1], sort)
+    return records, next_cursor
+
+
+# Streams every matching row as a plain mapping, fetched from a server-side cursor in batches.
+def iter_rows(sort, direction, filters, batch_size=1000):
+    """Yields dict-like rows without building ORM objects, so memory stays flat for any result size."""
+    statement = (
+        select(*WeatherRecord.__table__.columns)
+        .where(*filter_criteria(filters))
+        .order_by(*order_by(sort, direction))
+        .execution_options(yield_per=batch_size)
+    )
+    for row in db.session.execute(statement).mappings():
+        yield row
@@ -0,0 +1,214 @@
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+HIGH = "high"
+LOW = "low"
+LANES = (HIGH, LOW)
+ENDPOINTS = ("geocoding", "forecast", "archive")
+# Default per-endpoint limits (requests per minute, per day); Open-Meteo's free tier allows 600/min and 10000/day.
+DEFAULT_LIMITS = "600,10000"
+
+# Lane of upstream calls made in the current context; interactive by default.
+_lane = contextvars.ContextVar("weather_quota_lane", default=HIGH)
+# Cap (seconds) on any wait for a token in the current context, on top of the lane's own limit.
+_max_wait = contextvars.ContextVar("weather_quota_max_wait", default=None)
+
+
+# Raised when a call would have to wait longer than its lane allows (e.g. the daily quota is spent).
+class QuotaExceededError(RuntimeError):
+    def __init__(self, endpoint, wait):
+        super().__init__(f"Open-Meteo {endpoint} quota exhausted; next request possible in {wait:.0f}s.")
+        self.endpoint = endpoint
+        self.wait = wait
+
+
+# Runs the block's upstream calls in `name` lane (HIGH or LOW), including threads started with a copied context.
+@contextmanager
+def lane(name, max_wait=None):
+    """`max_wait` bounds each call's wait for a token, e.g. for low-priority work done inside a request."""
+    token = _lane.set(name)
+    cap = _max_wait.set(max_wait) if max_wait is not None else None
+    try:
+        yield
+    finally:
+        if cap is not None:
+            _max_wait.reset(cap)
+        _lane.reset(token)
+
+def current_lane():
+    return _lane.get()
+
+def current_max_wait():
+    return _max_wait.get()
+
+
+# Classic token bucket: holds up to `capacity` tokens, refilled continuously at `rate` per second.
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, needed, now):
+        self.refill(now)
+        return max(0.0, (needed - self.tokens) / self.rate)
+
+
+class _Endpoint:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.condition = threading.Condition()
+        self.blocked_until = 0.0
+        self.high_seen = float("-inf")
+        self.waiting = dict.fromkeys(LANES, 0)
+        self.acquired = dict.fromkeys(LANES, 0)
+        self.rejected = dict.fromkeys(LANES, 0)
+        self.wait_seconds = dict.fromkeys(LANES, 0.0)
+        self.max_wait = dict.fromkeys(LANES, 0.0)
+
+
+# Per-endpoint token buckets shared by two priority lanes.
+class QuotaScheduler:
+    """
+    Every upstream attempt takes one token from each of its endpoint's buckets (per minute and
+    per day). High-priority (interactive) callers are served first: a low-priority caller only
+    proceeds while no high-priority caller is waiting and while at least `reserve` of each
+    bucket would remain, so batch work uses the spare quota without starving users. Once no
+    high-priority call has been made for `reserve_idle` seconds (None = never), the reserve is
+    released to low-priority callers until the next one arrives.
+    A caller whose wait would exceed its lane's limit (`high_max_wait`, `low_max_wait`; None =
+    unbounded), or the cap set with lane(..., max_wait=...), gets QuotaExceededError straight
+    away instead of blocking.
+    Endpoints without configured limits are not scheduled.
+    """
+
+    def __init__(self, limits: dict, reserve: float = 0.2, high_max_wait: float | None = 10.0,
+                 low_max_wait: float | None = None, reserve_idle: float | None = 300.0, clock=time.monotonic):
+        self.reserve = reserve
+        self.reserve_idle = reserve_idle
+        self.max_waits = {HIGH: high_max_wait, LOW: low_max_wait}
+        self._clock = clock
+        now = clock()
+        self._endpoints = {}
+        for endpoint, (per_minute, per_day) in limits.items():
+            buckets = []
+            if per_minute:
+                buckets.append(TokenBucket(per_minute / 60.0, float(per_minute), now))
+            if per_day:
+                buckets.append(TokenBucket(per_day / 86400.0, float(per_day), now))
+            if buckets:
+                self._endpoints[endpoint] = _Endpoint(buckets)
+
+    @classmethod
+    def from_env(cls):
+        limits = {}
+        for endpoint in ENDPOINTS:
+            values = os.environ.get(f"WEATHER_QUOTA_{endpoint.upper()}", DEFAULT_LIMITS).split(",")
+            per_minute = float(values[0] or 0)
+            per_day = float(values[1] or 0) if len(values) > 1 else 0.0
+            limits[endpoint] = (per_minute, per_day)
+        high_max_wait = float(os.environ.get("WEATHER_QUOTA_HIGH_MAX_WAIT", "10"))
+        reserve_idle = float(os.environ.get("WEATHER_QUOTA_RESERVE_IDLE", "300"))
+        return cls(limits, reserve=float(os.environ.get("WEATHER_QUOTA_RESERVE", "0.2")),
+                   high_max_wait=high_max_wait, reserve_idle=reserve_idle if reserve_idle > 0 else None)
+
+    def _delay(self, state, lane_name, now):
+        delay = max(0.0, state.blocked_until - now)
+        reserved_for = 0.0
+        if lane_name == LOW:
+            reserved_for = float("inf") if self.reserve_idle is None else state.high_seen + self.reserve_idle - now
+        for bucket in state.buckets:
+            wait = bucket.wait_time(1.0, now)
+            if reserved_for > 0:
+                # Waiting for the reserve to refill ends early if the high lane goes idle meanwhile
+                wait = max(wait, min(bucket.wait_time(1.0 + bucket.capacity * self.reserve, now), reserved_for))
+            delay = max(delay, wait)
+        if lane_name == LOW and state.waiting[HIGH]:
+            # Woken when a high-priority caller is served or gives up; the timeout only bounds the nap
+            delay = max(delay, 0.05)
+        return delay
+
+    def acquire(self, endpoint, lane_name=None):
+        """Blocks until `endpoint` may be called; returns the seconds spent waiting."""
+        state = self._endpoints.get(endpoint)
+        if state is None:
+            return 0.0
+        lane_name = lane_name or current_lane()
+        max_wait, cap = self.max_waits[lane_name], current_max_wait()
+        if cap is not None:
+            max_wait = cap if max_wait is None else min(max_wait, cap)
+        started = self._clock()
+        with state.condition:
+            if lane_name == HIGH:
+                state.high_seen = started
+            state.waiting[lane_name] += 1
+            try:
+                while True:
+                    now = self._clock()
+                    delay = self._delay(state, lane_name, now)
+                    if delay <= 0:
+                        for bucket in state.buckets:
+                            bucket.tokens -= 1
+                        break
+                    if max_wait is not None and (now - started) + delay > max_wait:
+                        state.rejected[lane_name] += 1
+                        raise QuotaExceededError(endpoint, delay)
+                    state.condition.wait(delay)
+            finally:
+                state.waiting[lane_name] -= 1
+                state.condition.notify_all()
+            waited = self._clock() - started
+            state.acquired[lane_name] += 1
+            state.wait_seconds[lane_name] += waited
+            state.max_wait[lane_name] = max(state.max_wait[lane_name], waited)
+        metrics.observe("weather_quota_wait_seconds", waited, timing_name=f"quota-{endpoint}",
+                        endpoint=endpoint, lane=lane_name)
+        return waited
+
+    def throttle(self, endpoint, seconds):
+        """Holds every caller of `endpoint` back for `seconds` (e.g. after a 429 with Retry-After)."""
+        state = self._endpoints.get(endpoint)
+        if state is None:
+            return
+        with state.condition:
+            state.blocked_until = max(state.blocked_until, self._clock() + seconds)
+
+    def stats(self):
+        """Per endpoint: queue depth, calls, rejections and waits by lane, plus the tokens left in each bucket."""
+        now = self._clock()
+        result = {}
+        for endpoint, state in self._endpoints.items():
+            with state.condition:
+                for bucket in state.buckets:
+                    bucket.refill(now)
+                result[endpoint] = {
+                    "tokens": [round(bucket.tokens, 2) for bucket in state.buckets],
+                    "lanes": {
+                        lane_name: {
+                            "waiting": state.waiting[lane_name],
+                            "acquired": state.acquired[lane_name],
+                            "rejected": state.rejected[lane_name],
+                            "wait_seconds": round(state.wait_seconds[lane_name], 6),
+                            "max_wait_seconds": round(state.max_wait[lane_name], 6),
+                        }
+                        for lane_name in LANES
+                    },
+                }
+        return result
+
+    def collect(self):
+        """Metrics collector: queue depth and rejections per endpoint and lane."""
+        for endpoint, stats in self.stats().items():
+            for lane_name, lane_stats in stats["lanes"].items():
+                yield "weather_quota_queue_depth", {"endpoint": endpoint, "lane": lane_name}, lane_stats["waiting"]
+                yield "weather_quota_rejected_total", {"endpoint": endpoint, "lane": lane_name}, lane_stats["rejected"]
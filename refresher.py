@@ -0,0 +1,299 @@
+import threading
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta, UTC
+
+from sqlalchemy import delete, select, tuple_, update
+
+import climatology
+import quota
+import rollups
+import storage
+import versions
+import weather_api
+from bulk_import import group_spans
+from geo import cell_for
+from models import db, WeatherRecord
+from storage import LOOKUP_CHUNK, upsert_record
+
+# Rows per bulk UPDATE; each batch is committed together with its rollup recomputation.
+UPDATE_BATCH = 1000
+MEASURES = ("temp_max_c", "temp_min_c", "precip_mm", "wind_max_kmh")
+
+
+# Outcome of one refresh run; `failures` holds (location, message) pairs.
+@dataclass
+class RefreshReport:
+    rows: int = 0
+    updated: int = 0
+    merged: int = 0
+    not_archived: int = 0
+    locations: int = 0
+    fetch_groups: int = 0
+    failures: list = field(default_factory=list)
+
+    def as_dict(self):
+        return {
+            "rows": self.rows,
+            "updated": self.updated,
+            "merged": self.merged,
+            "not_archived": self.not_archived,
+            "failed": len(self.failures),
+            "locations": self.locations,
+            "fetch_groups": self.fetch_groups,
+            "failures": [{"location": location, "error": message} for location, message in self.failures],
+        }
+
+
+# Returns forecast (and locally predicted) rows whose date is old enough for the archive to have real values.
+def find_stale(today=None, limit=None):
+    cutoff = (today or date.today()) - timedelta(days=weather_api.ARCHIVE_DELAY_DAYS + 1)
+    table = WeatherRecord.__table__
+    statement = (
+        select(table.c.id, table.c.city, table.c.country, table.c.requested_date,
+               table.c.latitude, table.c.longitude, table.c.timezone)
+        .where(table.c.source.in_(("forecast", "predicted")), table.c.requested_date <= cutoff)
+        .order_by(table.c.id)
+        .limit(limit)
+    )
+    return db.session.execute(statement).all()
+
+
+# Groups stale rows by coordinates; rows stored without coordinates are geocoded by city and country.
+def _group_by_location(rows, report):
+    by_location, resolved = {}, {}
+    for row in rows:
+        if row.latitude is not None and row.longitude is not None:
+            key = (row.latitude, row.longitude, row.timezone or "UTC")
+        else:
+            place = (row.city, row.country)
+            if place not in resolved:
+                try:
+                    candidates = weather_api.search_locations(city=row.city, country=row.country)
+                except Exception as e:
+                    candidates, error = [], str(e)
+                else:
+                    error = "No matching locations found." if not candidates else "Several locations match; re-add it with a chosen location."
+                if len(candidates) == 1:
+                    resolved[place] = (candidates[0]["latitude"], candidates[0]["longitude"], candidates[0]["timezone"])
+                else:
+                    resolved[place] = None
+                    report.failures.append((f"{row.city}, {row.country}", error))
+            key = resolved[place]
+            if key is None:
+                continue
+        by_location.setdefault(key, []).append(row)
+    return by_location
+
+
+# Re-fetches stale forecast rows from the archive and rewrites them as historical rows.
+def refresh_stale(today=None, limit=None, batch_size=UPDATE_BATCH, progress=None):
+    """
+    Each location's stale dates are merged into contiguous spans; locations that share an
+    identical span are fetched together through multi-location archive requests. Values are
+    written with ORM bulk UPDATEs by primary key (no per-row objects), and the monthly
+    rollups of the touched groups are recomputed in the same transaction.
+    Days the archive cannot provide yet stay forecast rows and are retried on the next run.
+    A geocoded row whose location-day is already stored is merged into that row (see _merge_adopted).
+    Upstream calls run in the low-priority quota lane, behind interactive requests.
+    """
+    report = RefreshReport()
+    rows = find_stale(today, limit)
+    report.rows = len(rows)
+    with quota.lane(quota.LOW):
+        by_location = _group_by_location(rows, report)
+    report.locations = len(by_location)
+
+    locations_by_span = {}
+    for location, location_rows in by_location.items():
+        for span in group_spans([row.requested_date for row in location_rows]):
+            locations_by_span.setdefault(span, []).append(location)
+    report.fetch_groups = len(locations_by_span)
+
+    updates, groups, adopted = [], set(), {}
+    for done, ((start, end), locations) in enumerate(sorted(locations_by_span.items()), start=1):
+        try:
+            with quota.lane(quota.LOW):
+                results = weather_api.fetch_archive_batch(locations, start, end)
+        except Exception as e:
+            report.failures.extend((f"{lat}, {lon}", str(e)) for lat, lon, tz in locations)
+            continue
+
+        now = datetime.now(UTC)
+        for location, days in zip(locations, results):
+            latitude, longitude, timezone = location
+            for row in by_location[location]:
+                if not start <= row.requested_date <= end:
+                    continue
+                day = days.get(row.requested_date)
+                if day is None or all(day[name] is None for name in MEASURES):
+                    report.not_archived += 1
+                    continue
+                updates.append({
+                    "id": row.id,
+                    **{name: day[name] for name in MEASURES},
+                    "source": "historical",
+                    "updated_at": now,
+                    "latitude": latitude,
+                    "longitude": longitude,
+                    "timezone": timezone,
+                    "geo_cell": cell_for(latitude, longitude),
+                })
+                groups.add(rollups.group_key(row.city, row.country, row.requested_date))
+                if row.latitude is None:
+                    adopted[row.id] = (row.city, row.country, row.requested_date)
+                if len(updates) >= batch_size:
+                    _write(updates, groups, adopted, report)
+                    updates, groups, adopted = [], set(), {}
+        if progress:
+            progress("refresh", done, len(locations_by_span))
+
+    if updates:
+        _write(updates, groups, adopted, report)
+    return report
+
+
+# Applies one batch of bulk updates plus the rollup groups and table version they touch, commits, and drops the touched locations' climatology models.
+def _write(updates, groups, adopted, report):
+    duplicates = _merge_adopted(updates, adopted)
+    if duplicates:
+        db.session.execute(delete(WeatherRecord).where(WeatherRecord.id.in_(duplicates)))
+    db.session.execute(update(WeatherRecord), updates)
+    rollups.recompute_groups(db.session.connection(), groups)
+    versions.bump(db.session.connection())
+    db.session.commit()
+    climatology.invalidate({(row["latitude"], row["longitude"]) for row in updates})
+    report.updated += len(updates)
+    report.merged += len(duplicates)
+
+# Points the updates of geocoded rows (`adopted`: {id: (city, country, date)}) at the row already stored for their location-day.
+def _merge_adopted(updates, adopted):
+    """
+    A row stored without coordinates takes the geocoded ones, as storage._write_days adopts it,
+    unless uq_weather_records_location_day already has a row for that place and day (or an
+    earlier row of the batch took it): then that row gets the archive values and the
+    coordinate-less one is deleted. Returns the ids to delete.
+    """
+    keys = {}
+    for row in updates:
+        if row["id"] in adopted:
+            keys[row["id"]] = (*adopted[row["id"]], row["latitude"], row["longitude"])
+    if not keys:
+        return []
+    table = WeatherRecord.__table__
+    places = sorted({key[:3] for key in keys.values()})
+    stored = {}
+    for start in range(0, len(places), LOOKUP_CHUNK):
+        statement = select(table.c.id, *(table.c[name] for name in storage.LOCATION_DAY)).where(
+            table.c.latitude.is_not(None),
+            tuple_(table.c.city, table.c.country, table.c.requested_date).in_(places[start:start + LOOKUP_CHUNK]),
+        )
+        for row_id, *key in db.session.execute(statement):
+            stored.setdefault(tuple(key), row_id)
+
+    duplicates = []
+    for row in updates:
+        key = keys.get(row["id"])
+        if key is None:
+            continue
+        if key in stored:
+            duplicates.append(row["id"])
+            row["id"] = stored[key]
+        else:
+            stored[key] = row["id"]
+    return duplicates
+
+
+# Runs refresh_stale() every `interval` seconds on a daemon thread.
+class RefreshScheduler:
+    def __init__(self, app, interval: float):
+        self.app = app
+        self.interval = interval
+        self.last_report = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="forecast-refresher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def run_once(self):
+        with self.app.app_context():
+            try:
+                self.last_report = refresh_stale()
+            except Exception:
+                db.session.rollback()
+                self.app.logger.exception("Scheduled forecast refresh failed")
+        return self.last_report
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+
+# Refetches days /add served stale during an outage, once their circuit allows a trial call, without a job pool.
+class Revalidator:
+    """
+    schedule() starts one daemon timer per location and day; a day that is already scheduled
+    is not scheduled again. A revalidation that still finds the circuit open reschedules itself
+    after the error's retry_after, up to `max_attempts` tries in all.
+    """
+
+    def __init__(self, app, max_attempts: int = 5):
+        self.app = app
+        self.max_attempts = max_attempts
+        self.revalidated = 0
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def schedule(self, city, country, requested_date, latitude, longitude, timezone, delay, attempt=1):
+        """Returns False when the location's day is already scheduled."""
+        key = (city, country, requested_date, latitude, longitude)
+        with self._lock:
+            if attempt == 1 and key in self._timers:
+                return False
+            timer = threading.Timer(delay, self._run, args=(key, timezone, attempt))
+            timer.daemon = True
+            self._timers[key] = timer
+        timer.start()
+        return True
+
+    def pending(self):
+        with self._lock:
+            return len(self._timers)
+
+    def cancel(self):
+        with self._lock:
+            timers, self._timers = list(self._timers.values()), {}
+        for timer in timers:
+            timer.cancel()
+
+    def _run(self, key, timezone, attempt):
+        city, country, requested_date, latitude, longitude = key
+        with self.app.app_context():
+            try:
+                with quota.lane(quota.LOW):
+                    daily = weather_api.fetch_weather_for_date(
+                        city=city, country=country, target_date=requested_date,
+                        latitude=latitude, longitude=longitude, timezone=timezone,
+                    )
+                upsert_record(city, country, requested_date, daily, latitude, longitude, timezone)
+            except weather_api.CircuitOpenError as e:
+                if attempt < self.max_attempts:
+                    self.schedule(*key, timezone, e.retry_after, attempt=attempt + 1)
+                    return
+                self.app.logger.warning("Gave up revalidating %s, %s on %s: %s", city, country, requested_date, e)
+            except Exception:
+                db.session.rollback()
+                self.app.logger.exception("Revalidating %s, %s on %s failed", city, country, requested_date)
+            else:
+                self.revalidated += 1
+        with self._lock:
+            self._timers.pop(key, None)
@@ -0,0 +1,194 @@
+import calendar
+from datetime import date
+
+from sqlalchemy import case, delete, event, extract, func, insert, select
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history
+
+from models import WeatherRecord, MonthlyRollup, upsert_insert
+
+records = WeatherRecord.__table__
+rollups = MonthlyRollup.__table__
+
+MEASURES = ("temp_max_c", "temp_min_c", "precip_mm", "wind_max_kmh")
+# Columns of uq_weather_rollups_group, the conflict target of every rollup upsert.
+GROUP_COLUMNS = ("city", "country", "year", "month")
+
+# Aggregate columns of an empty group.
+EMPTY = {
+    "row_count": 0,
+    "temp_max_sum": 0.0, "temp_max_count": 0, "temp_max_peak": None,
+    "temp_min_sum": 0.0, "temp_min_count": 0, "temp_min_low": None,
+    "precip_sum": 0.0, "precip_count": 0,
+    "wind_max_peak": None,
+}
+
+
+# Returns the (city, country, year, month) rollup group a record belongs to.
+def group_key(city, country, requested_date):
+    return (city, country, requested_date.year, requested_date.month)
+
+def _group_criteria(key):
+    city, country, year, month = key
+    return (rollups.c.city == city, rollups.c.country == country,
+            rollups.c.year == year, rollups.c.month == month)
+
+def _peak(a, b):
+    return b if a is None else a if b is None else max(a, b)
+
+def _low(a, b):
+    return b if a is None else a if b is None else min(a, b)
+
+
+# Folds a single record's measurements into a group's running totals.
+def _accumulate(totals, temp_max_c, temp_min_c, precip_mm, wind_max_kmh):
+    totals["row_count"] += 1
+    if temp_max_c is not None:
+        totals["temp_max_sum"] += temp_max_c
+        totals["temp_max_count"] += 1
+        totals["temp_max_peak"] = _peak(totals["temp_max_peak"], temp_max_c)
+    if temp_min_c is not None:
+        totals["temp_min_sum"] += temp_min_c
+        totals["temp_min_count"] += 1
+        totals["temp_min_low"] = _low(totals["temp_min_low"], temp_min_c)
+    if precip_mm is not None:
+        totals["precip_sum"] += precip_mm
+        totals["precip_count"] += 1
+    if wind_max_kmh is not None:
+        totals["wind_max_peak"] = _peak(totals["wind_max_peak"], wind_max_kmh)
+
+
+# Adds newly inserted rows to their groups: one INSERT ... ON CONFLICT DO UPDATE per touched group.
+def apply_inserts(connection, rows):
+    """
+    `rows` are WeatherRecord objects or mappings with the same field names. The merge runs
+    in the database, so concurrent writers creating the same group add up instead of
+    colliding on uq_weather_rollups_group.
+    """
+    groups = {}
+    for row in rows:
+        if not isinstance(row, dict):
+            row = {name: getattr(row, name) for name in ("city", "country", "requested_date", *MEASURES)}
+        key = group_key(row["city"], row["country"], row["requested_date"])
+        _accumulate(groups.setdefault(key, dict(EMPTY)), *(row[name] for name in MEASURES))
+    if not groups:
+        return
+
+    statement = upsert_insert(connection, rollups)
+    new = statement.excluded
+    merged = {
+        name: rollups.c[name] + new[name]
+        for name in ("row_count", "temp_max_sum", "temp_max_count", "temp_min_sum",
+                     "temp_min_count", "precip_sum", "precip_count")
+    }
+    merged.update(
+        temp_max_peak=_merge_extreme(rollups.c.temp_max_peak, new.temp_max_peak, higher=True),
+        temp_min_low=_merge_extreme(rollups.c.temp_min_low, new.temp_min_low, higher=False),
+        wind_max_peak=_merge_extreme(rollups.c.wind_max_peak, new.wind_max_peak, higher=True),
+    )
+    statement = statement.on_conflict_do_update(index_elements=GROUP_COLUMNS, set_=merged)
+    connection.execute(statement, [
+        {"city": city, "country": country, "year": year, "month": month, **totals}
+        for (city, country, year, month), totals in groups.items()
+    ])
+
+# SQL for the higher (or lower) of two nullable values, ignoring NULLs like _peak/_low.
+def _merge_extreme(current, new, higher):
+    better = new > current if higher else new < current
+    return case((new.is_(None), current), (current.is_(None), new), (better, new), else_=current)
+
+
+def _aggregate_columns():
+    return (
+        func.count().label("row_count"),
+        func.coalesce(func.sum(records.c.temp_max_c), 0.0).label("temp_max_sum"),
+        func.count(records.c.temp_max_c).label("temp_max_count"),
+        func.max(records.c.temp_max_c).label("temp_max_peak"),
+        func.coalesce(func.sum(records.c.temp_min_c), 0.0).label("temp_min_sum"),
+        func.count(records.c.temp_min_c).label("temp_min_count"),
+        func.min(records.c.temp_min_c).label("temp_min_low"),
+        func.coalesce(func.sum(records.c.precip_mm), 0.0).label("precip_sum"),
+        func.count(records.c.precip_mm).label("precip_count"),
+        func.max(records.c.wind_max_kmh).label("wind_max_peak"),
+    )
+
+
+# Recomputes whole groups from weather_records; used after deletes/updates, where extremes cannot be undone.
+def recompute_groups(connection, keys):
+    for key in keys:
+        city, country, year, month = key
+        first_day = date(year, month, 1)
+        last_day = date(year, month, calendar.monthrange(year, month)[1])
+        totals = connection.execute(
+            select(*_aggregate_columns()).where(
+                records.c.city == city,
+                records.c.country == country,
+                records.c.requested_date.between(first_day, last_day),
+            )
+        ).mappings().one()
+        if not totals["row_count"]:
+            connection.execute(delete(rollups).where(*_group_criteria(key)))
+            continue
+        statement = upsert_insert(connection, rollups).values(city=city, country=country, year=year, month=month, **totals)
+        connection.execute(statement.on_conflict_do_update(index_elements=GROUP_COLUMNS, set_=dict(totals)))
+
+
+# Drops and rebuilds every rollup from weather_records; returns the number of groups written.
+def rebuild(connection):
+    year = extract("year", records.c.requested_date)
+    month = extract("month", records.c.requested_date)
+    rows = connection.execute(
+        select(records.c.city, records.c.country, year.label("year"), month.label("month"), *_aggregate_columns())
+        .group_by(records.c.city, records.c.country, year, month)
+    ).mappings().all()
+    connection.execute(delete(rollups))
+    if rows:
+        connection.execute(insert(rollups), [dict(row) for row in rows])
+    return len(rows)
+
+
+# Keeps rollups in step with every ORM flush (adds, deletes and edits) inside the same transaction.
+@event.listens_for(Session, "after_flush")
+def _maintain_rollups(session, flush_context):
+    added = [obj for obj in session.new if isinstance(obj, WeatherRecord)]
+    stale = set()
+    for obj in session.deleted:
+        if isinstance(obj, WeatherRecord):
+            stale.add(group_key(obj.city, obj.country, obj.requested_date))
+    for obj in session.dirty:
+        if isinstance(obj, WeatherRecord) and session.is_modified(obj):
+            stale.add(group_key(obj.city, obj.country, obj.requested_date))
+            old = {name: get_history(obj, name).deleted for name in ("city", "country", "requested_date")}
+            if any(old.values()):
+                stale.add(group_key(
+                    (old["city"] or [obj.city])[0],
+                    (old["country"] or [obj.country])[0],
+                    (old["requested_date"] or [obj.requested_date])[0],
+                ))
+    if not added and not stale:
+        return
+
+    connection = session.connection()
+    apply_inserts(connection, [obj for obj in added
+                               if group_key(obj.city, obj.country, obj.requested_date) not in stale])
+    recompute_groups(connection, stale)
+
+
+# Per-group statistics served by /stats, derived from the running totals in O(1).
+def summarize(rollup):
+    mean_max = rollup.temp_max_sum / rollup.temp_max_count if rollup.temp_max_count else None
+    mean_min = rollup.temp_min_sum / rollup.temp_min_count if rollup.temp_min_count else None
+    return {
+        "city": rollup.city,
+        "country": rollup.country,
+        "year": rollup.year,
+        "month": rollup.month,
+        "days": rollup.row_count,
+        "mean_temp_c": (mean_max + mean_min) / 2 if mean_max is not None and mean_min is not None else None,
+        "mean_temp_max_c": mean_max,
+        "mean_temp_min_c": mean_min,
+        "max_temp_c": rollup.temp_max_peak,
+        "min_temp_c": rollup.temp_min_low,
+        "total_precip_mm": rollup.precip_sum if rollup.precip_count else None,
+        "peak_wind_kmh": rollup.wind_max_peak,
+    }
@@ -0,0 +1,322 @@
+import csv
+import json
+import os
+import time
+from dataclasses import dataclass
+from datetime import date, datetime, UTC
+
+import numpy as np
+from sqlalchemy import Date, DateTime, Float, Integer, delete, func, insert, inspect, select
+
+import autocomplete
+import climatology
+import rollups
+import storage
+import versions
+from models import db, WeatherRecord
+
+FORMAT = "weather-records-snapshot"
+VERSION = 1
+MANIFEST = "manifest.json"
+# Rows per executemany batch.
+LOAD_BATCH = 50_000
+# SQLite page cache (KiB) used while loading.
+SQLITE_LOAD_CACHE_KIB = 256 * 1024
+# Integer columns store NULL as this sentinel (NaN for floats, NaT for dates, code -1 for strings).
+NULL_INT = np.iinfo(np.int64).min
+# On-disk dtype of each column kind; dates are days and timestamps microseconds since the epoch.
+DTYPES = {
+    "float": np.dtype("<f8"),
+    "int": np.dtype("<i8"),
+    "date": np.dtype("<M8[D]"),
+    "datetime": np.dtype("<M8[us]"),
+    "string": np.dtype("<i4"),
+}
+
+records = WeatherRecord.__table__
+
+
+# Outcome of one bulk load.
+@dataclass
+class LoadReport:
+    rows: int = 0
+    inserted: int = 0
+    skipped: int = 0
+    duplicates: int = 0
+    seconds: float = 0.0
+    insert_seconds: float = 0.0
+    deferred_indexes: int = 0
+    rollups: int = 0
+
+    @property
+    def rows_per_second(self):
+        return self.inserted / self.seconds if self.seconds else 0.0
+
+    @property
+    def insert_rows_per_second(self):
+        return self.inserted / self.insert_seconds if self.insert_seconds else 0.0
+
+    def as_dict(self):
+        return {
+            "rows": self.rows,
+            "inserted": self.inserted,
+            "skipped": self.skipped,
+            "duplicates": self.duplicates,
+            "seconds": round(self.seconds, 3),
+            "rows_per_second": round(self.rows_per_second),
+            "insert_rows_per_second": round(self.insert_rows_per_second),
+            "deferred_indexes": self.deferred_indexes,
+            "rollups": self.rollups,
+        }
+
+
+# Snapshot column kind of a weather_records column, from its SQL type.
+def column_kind(column):
+    if isinstance(column.type, DateTime):
+        return "datetime"
+    if isinstance(column.type, Date):
+        return "date"
+    if isinstance(column.type, Float):
+        return "float"
+    if isinstance(column.type, Integer):
+        return "int"
+    return "string"
+
+
+# Encodes one column's Python values as its typed array; strings become codes into `dictionary`.
+def _encode(kind, values, dictionary):
+    if kind == "int":
+        return np.fromiter((NULL_INT if v is None else v for v in values), dtype=DTYPES[kind], count=len(values))
+    if kind == "string":
+        codes = {value: code for code, value in enumerate(dictionary)}
+        for value in values:
+            if value is not None and value not in codes:
+                codes[value] = len(dictionary)
+                dictionary.append(value)
+        return np.fromiter((-1 if v is None else codes[v] for v in values), dtype=DTYPES[kind], count=len(values))
+    if kind == "datetime":
+        values = [v.astimezone(UTC).replace(tzinfo=None) if v is not None and v.tzinfo else v for v in values]
+    return np.array(values, dtype=DTYPES[kind])
+
+
+# Writes every weather_records row as one .npy array per column plus a JSON manifest; returns the row count.
+def export_snapshot(directory, chunk_rows=100_000):
+    """
+    Arrays are little-endian and fixed-width (see DTYPES), so np.load(..., mmap_mode="r") maps
+    them without parsing. Strings are dictionary-encoded: int32 codes plus a JSON list of values.
+    Timestamps are stored as naive UTC.
+    """
+    os.makedirs(directory, exist_ok=True)
+    columns = list(records.columns)
+    kinds = {column.name: column_kind(column) for column in columns}
+    dictionaries = {name: [] for name, kind in kinds.items() if kind == "string"}
+    parts = {column.name: [] for column in columns}
+
+    result = db.session.execute(
+        select(records).order_by(records.c.id).execution_options(yield_per=chunk_rows)
+    )
+    for chunk in result.partitions(chunk_rows):
+        for column, values in zip(columns, zip(*chunk)):
+            parts[column.name].append(_encode(kinds[column.name], values, dictionaries.get(column.name)))
+
+    rows = 0
+    manifest_columns = []
+    for column in columns:
+        name, kind = column.name, kinds[column.name]
+        array = np.concatenate(parts[name]) if parts[name] else np.empty(0, dtype=DTYPES[kind])
+        rows = len(array)
+        np.save(os.path.join(directory, f"{name}.npy"), array)
+        entry = {"name": name, "kind": kind, "dtype": array.dtype.str, "file": f"{name}.npy"}
+        if kind == "string":
+            entry["dictionary"] = f"{name}.dict.json"
+            with open(os.path.join(directory, entry["dictionary"]), "w", encoding="utf-8") as handle:
+                json.dump(dictionaries[name], handle, ensure_ascii=False)
+        manifest_columns.append(entry)
+
+    manifest = {
+        "format": FORMAT,
+        "version": VERSION,
+        "table": records.name,
+        "rows": rows,
+        "created_at": datetime.now(UTC).isoformat(),
+        "columns": manifest_columns,
+    }
+    with open(os.path.join(directory, MANIFEST), "w", encoding="utf-8") as handle:
+        json.dump(manifest, handle, indent=2)
+    return rows
+
+
+# Opens a snapshot: returns (manifest, {column: memory-mapped array}, {column: string dictionary}).
+def read_snapshot(directory, mmap=True):
+    with open(os.path.join(directory, MANIFEST), encoding="utf-8") as handle:
+        manifest = json.load(handle)
+    if manifest.get("format") != FORMAT or manifest.get("version") != VERSION:
+        raise ValueError(f"{directory} is not a version {VERSION} weather records snapshot.")
+    arrays, dictionaries = {}, {}
+    for entry in manifest["columns"]:
+        array = np.load(os.path.join(directory, entry["file"]), mmap_mode="r" if mmap else None, allow_pickle=False)
+        if len(array) != manifest["rows"]:
+            raise ValueError(f"Column {entry['name']} has {len(array)} rows; the manifest says {manifest['rows']}.")
+        arrays[entry["name"]] = array
+        if entry.get("dictionary"):
+            with open(os.path.join(directory, entry["dictionary"]), encoding="utf-8") as handle:
+                dictionaries[entry["name"]] = json.load(handle)
+    return manifest, arrays, dictionaries
+
+
+# Decodes a slice of a typed column into bind values (ISO text for SQLite dates, which skips per-value conversion).
+def _decode(kind, array, dictionary, iso_text):
+    array = np.asarray(array)
+    if kind == "string":
+        lookup = np.array(list(dictionary) + [None], dtype=object)
+        return lookup[array].tolist()  # code -1 picks the trailing None
+    if kind == "float":
+        values, missing = array.astype(object), np.isnan(array)
+    elif kind == "int":
+        values, missing = array.astype(object), array == NULL_INT
+    elif iso_text:
+        missing = np.isnat(array)
+        if kind == "date":
+            values = array.astype(str).astype(object)
+        else:
+            values = np.char.replace(np.datetime_as_string(array, unit="us"), "T", " ").astype(object)
+    else:
+        values, missing = array.astype(object), np.isnat(array)
+    values[missing] = None
+    return values.tolist()
+
+
+# Secondary indexes of weather_records that exist in the database.
+def _existing_indexes(connection):
+    names = {index["name"] for index in inspect(connection).get_indexes(records.name)}
+    return [index for index in records.indexes if index.name in names]
+
+
+# Inserts column-oriented rows into weather_records with batched executemany calls.
+def bulk_load(columns, replace=False, batch_size=LOAD_BATCH, defer_indexes=True, progress=None):
+    """
+    `columns` maps column names to equal-length sequences of bind values (see _decode).
+    With `replace`, existing rows are deleted first. Rows are matched on storage.LOCATION_DAY
+    (the unique location-and-day key): when the file holds a day twice, its last copy is
+    loaded, and when appending, days already stored are skipped. Loading into an empty table
+    keeps the given ids (on PostgreSQL the id sequence is moved past them); appending drops
+    them. When the table starts empty, secondary indexes are dropped for the load and rebuilt
+    once at the end, all inside one transaction, so a failure restores them.
+    SQLite binds go straight to the driver's executemany; other databases use Core insert().
+    Monthly rollups are rebuilt and the records version bumped before the single commit;
+    climatology models and the autocomplete index are reset after it.
+    """
+    started = time.perf_counter()
+    report = LoadReport()
+    connection = db.session.connection()
+    if replace:
+        connection.execute(delete(records))
+    empty = connection.execute(select(func.count()).select_from(records)).scalar() == 0
+
+    names = [name for name in columns if name in records.c and (empty or name != "id")]
+    report.rows = count = len(columns[names[0]]) if names else 0
+    keys = zip(*(columns.get(name) or [None] * count for name in storage.LOCATION_DAY))
+    latest = {(city, country, _as_date(day), lat, lon): n for n, (city, country, day, lat, lon) in enumerate(keys)}
+    stored = set() if empty else {
+        tuple(row) for row in connection.execute(select(*(records.c[name] for name in storage.LOCATION_DAY)))
+    }
+    keep = sorted(n for key, n in latest.items() if key not in stored)
+    report.duplicates, report.skipped = count - len(latest), len(latest) - len(keep)
+    if len(keep) < count:
+        columns = {name: [columns[name][n] for n in keep] for name in names}
+        count = len(keep)
+
+    deferred = _existing_indexes(connection) if empty and defer_indexes else []
+    for index in deferred:
+        index.drop(connection)
+    report.deferred_indexes = len(deferred)
+
+    sqlite = connection.dialect.name == "sqlite"
+    if sqlite:
+        # A larger page cache for this connection speeds up the index rebuild's sorts
+        cache_size = connection.exec_driver_sql("PRAGMA cache_size").scalar()
+        connection.exec_driver_sql(f"PRAGMA cache_size = -{SQLITE_LOAD_CACHE_KIB}")
+    statement = f"INSERT INTO {records.name} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})"
+    insert_started = time.perf_counter()
+    for offset in range(0, count, batch_size):
+        rows = list(zip(*(columns[name][offset:offset + batch_size] for name in names)))
+        if sqlite:
+            connection.exec_driver_sql(statement, rows)
+        else:
+            connection.execute(insert(records), [dict(zip(names, row)) for row in rows])
+        report.inserted += len(rows)
+        if progress:
+            progress("insert", report.inserted, count)
+    report.insert_seconds = time.perf_counter() - insert_started
+    if "id" in names and connection.dialect.name == "postgresql":
+        connection.execute(_advance_id_sequence())
+
+    for index in deferred:
+        index.create(connection)
+    report.rollups = rollups.rebuild(connection)
+    versions.bump(connection)
+    db.session.commit()
+    if sqlite:
+        db.session.connection().exec_driver_sql(f"PRAGMA cache_size = {cache_size}")
+    # Core inserts bypass the session listeners, so drop what they would have refreshed
+    climatology.models.clear()
+    autocomplete.index.clear()
+    report.seconds = time.perf_counter() - started
+    return report
+
+
+# Moves the PostgreSQL id sequence past the largest id, so later inserts do not reuse loaded ids.
+def _advance_id_sequence():
+    sequence = func.pg_get_serial_sequence(records.name, records.c.id.name)
+    return select(func.setval(sequence, func.coalesce(func.max(records.c.id), 0) + 1, False))
+
+
+def _as_date(value):
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+# Loads a snapshot directory, decoding each typed column in one vectorized pass.
+def load_snapshot(directory, replace=False, batch_size=LOAD_BATCH, progress=None):
+    manifest, arrays, dictionaries = read_snapshot(directory)
+    iso_text = db.session.connection().dialect.name == "sqlite"
+    kinds = {entry["name"]: entry["kind"] for entry in manifest["columns"]}
+    columns = {
+        name: _decode(kinds[name], arrays[name], dictionaries.get(name), iso_text)
+        for name in arrays if name in records.c
+    }
+    return bulk_load(columns, replace=replace, batch_size=batch_size, progress=progress)
+
+
+# Loads a /export.csv or /export.ndjson file (e.g. from another instance) through the same bulk path.
+def load_export(path, replace=False, batch_size=LOAD_BATCH, progress=None):
+    with open(path, encoding="utf-8-sig", newline="") as handle:
+        if path.endswith(".ndjson"):
+            rows = [json.loads(line) for line in handle if line.strip()]
+        else:
+            rows = list(csv.DictReader(handle))
+    iso_text = db.session.connection().dialect.name == "sqlite"
+    names = [column.name for column in records.columns if rows and column.name in rows[0]]
+    columns = {}
+    for name in names:
+        kind = column_kind(records.c[name])
+        columns[name] = [_parse(kind, row[name], iso_text) for row in rows]
+    return bulk_load(columns, replace=replace, batch_size=batch_size, progress=progress)
+
+
+# Converts one exported value (CSV text or JSON) into a bind value of `kind`.
+def _parse(kind, value, iso_text):
+    if value is None or value == "":
+        return None
+    if kind == "float":
+        return float(value)
+    if kind == "int":
+        return int(value)
+    if kind == "date":
+        day = date.fromisoformat(value)
+        return day.isoformat() if iso_text else day
+    if kind == "datetime":
+        moment = datetime.fromisoformat(value)
+        if moment.tzinfo:
+            moment = moment.astimezone(UTC).replace(tzinfo=None)
+        return moment.strftime("%Y-%m-%d %H:%M:%S.%f") if iso_text else moment
+    return value
@@ -0,0 +1,292 @@
+from datetime import datetime, timedelta, UTC
+
+from flask import current_app
+from sqlalchemy import and_, delete, event, func, inspect, or_, select, text, update
+from sqlalchemy.orm import Session
+
+import rollups
+import versions
+from geo import cell_for
+from models import db, upsert_insert, WeatherRecord
+
+records = WeatherRecord.__table__
+# A stored day is one location on one date: the columns of the unique uq_weather_records_location_day index.
+LOCATION_DAY = ("city", "country", "requested_date", "latitude", "longitude")
+# Columns an upsert overwrites on the row it collides with.
+REFRESHED_COLUMNS = ("temp_max_c", "temp_min_c", "precip_mm", "wind_max_kmh", "source", "timezone", "geo_cell", "updated_at")
+# How long a stored forecast row is reused before /add fetches it again; historical rows are final.
+FORECAST_MAX_AGE = timedelta(hours=3)
+# Dates per IN (...) lookup when matching many days against stored rows.
+LOOKUP_CHUNK = 500
+# Duplicate rows spelled out in one log line by upgrade_schema / drop_duplicates.
+DUPLICATES_LOGGED = 50
+
+# Resolves which WeatherRecord columns receive coordinates and the requested date.
+def _resolve_columns(cols):
+    """Returns ({"latitude"|"longitude"|"timezone": column name}, date column name or None)."""
+    cols = set(cols)
+    coord_columns = {}
+    for field, candidates in (("latitude", ("lat", "latitude")), ("longitude", ("lon", "longitude")),
+                              ("timezone", ("timezone",))):
+        name = next((c for c in candidates if c in cols), None)
+        if name:
+            coord_columns[field] = name
+
+    for candidate in ('requested_date', 'date', 'record_date', 'day', 'observation_date', 'observed_date'):
+        if candidate in cols:
+            return coord_columns, candidate
+    # Any column that contains 'date'
+    return coord_columns, next((col for col in sorted(cols) if 'date' in col), None)
+
+# Resolved once at import; the model's columns do not change while the app runs.
+COORD_COLUMNS, DATE_COLUMN = _resolve_columns(WeatherRecord.__table__.columns.keys())
+HAS_GEO_CELL = "geo_cell" in WeatherRecord.__table__.columns
+
+# Helper: build keyword-args that match the actual column names
+def _coord_kwargs(latitude, longitude, timezone):
+    """Return coord fields keyed to whatever columns your model actually has."""
+    values = {"latitude": latitude, "longitude": longitude, "timezone": timezone}
+    coord_fields = {name: values[field] for field, name in COORD_COLUMNS.items()}
+    if HAS_GEO_CELL:
+        coord_fields["geo_cell"] = cell_for(latitude, longitude)
+    return coord_fields
+
+def _date_kwargs(date_value):
+    """Return a dict mapping the given date_value to the model's actual date column."""
+    return {DATE_COLUMN: date_value} if DATE_COLUMN else {}
+
+# Adds nullable WeatherRecord columns and indexes that an older database file is missing.
+def upgrade_schema(engine):
+    """
+    create_all() never alters existing tables; this covers columns added since the file was created.
+    Rows are never deleted here: a unique index that existing rows would violate is not created, and
+    the duplicate keys are logged so they can be removed with drop_duplicates (flask dedupe-records).
+    """
+    table = WeatherRecord.__table__
+    existing = {column["name"] for column in inspect(engine).get_columns(table.name)}
+    indexes = {index["name"] for index in inspect(engine).get_indexes(table.name)}
+    with engine.begin() as connection:
+        for column in table.columns:
+            if column.name not in existing and column.nullable:
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}'))
+        for index in table.indexes:
+            if index.unique and index.name not in indexes:
+                duplicates = _duplicate_rows(connection, index)
+                if duplicates:
+                    _log_duplicates(index, duplicates, "Not creating %s: %d rows duplicate a kept row; "
+                                    "run `flask dedupe-records` to remove them. Keys: %s")
+                    continue
+            index.create(connection, checkfirst=True)
+
+# Deletes all but the newest row of every group a unique index would reject, then creates the index.
+def drop_duplicates(engine):
+    """Returns the removed rows as {"id", *key columns} dicts; each is logged before it is deleted."""
+    table = WeatherRecord.__table__
+    indexes = {index["name"] for index in inspect(engine).get_indexes(table.name)}
+    removed = []
+    with engine.begin() as connection:
+        for index in table.indexes:
+            if not index.unique or index.name in indexes:
+                continue
+            duplicates = _duplicate_rows(connection, index)
+            if duplicates:
+                _log_duplicates(index, duplicates, "Removing duplicates before creating %s: %d rows, keeping the newest "
+                                "of each key. Removed: %s")
+                ids = [row["id"] for row in duplicates]
+                for start in range(0, len(ids), LOOKUP_CHUNK):
+                    connection.execute(delete(table).where(table.c.id.in_(ids[start:start + LOOKUP_CHUNK])))
+                removed.extend(duplicates)
+            index.create(connection)
+        if removed:
+            rollups.rebuild(connection)
+            versions.bump(connection)
+    return removed
+
+# Every row but the newest of each group a unique index would reject (rows with NULLs never collide), oldest first.
+def _duplicate_rows(connection, index):
+    table, columns = index.table, list(index.columns)
+    complete = [column.is_not(None) for column in columns]
+    newest = select(func.max(table.c.id)).where(*complete).group_by(*columns)
+    statement = select(table.c.id, *columns).where(*complete, table.c.id.not_in(newest)).order_by(table.c.id)
+    return [dict(row._mapping) for row in connection.execute(statement)]
+
+# Logs `message` (index name, row count, rows) with at most DUPLICATES_LOGGED rows spelled out.
+def _log_duplicates(index, duplicates, message):
+    shown = ", ".join(str(row) for row in duplicates[:DUPLICATES_LOGGED])
+    if len(duplicates) > DUPLICATES_LOGGED:
+        shown += f" and {len(duplicates) - DUPLICATES_LOGGED} more"
+    current_app.logger.warning(message, index.name, len(duplicates), shown)
+
+# Applies concurrency pragmas to every new SQLite connection of `engine`.
+def configure_sqlite(engine, journal_mode="WAL", synchronous="NORMAL", busy_timeout_ms=5000):
+    """
+    WAL lets readers run alongside the single writer; synchronous=NORMAL syncs at checkpoints
+    instead of on every commit (a power loss can drop the last commits, never corrupt the file);
+    busy_timeout makes a blocked writer wait instead of failing with "database is locked".
+    """
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA busy_timeout = {int(busy_timeout_ms)}")
+        cursor.execute(f"PRAGMA journal_mode = {journal_mode}")
+        cursor.execute(f"PRAGMA synchronous = {synchronous}")
+        cursor.close()
+
+# Column values of one stored day, keyed to the model's actual column names.
+def _row_values(city, country, requested_date, daily, latitude=None, longitude=None, timezone=None):
+    values = dict(
+        city=city,
+        country=country,
+        temp_max_c=daily.get("temp_max_c"),
+        temp_min_c=daily.get("temp_min_c"),
+        precip_mm=daily.get("precip_mm"),
+        wind_max_kmh=daily.get("wind_max_kmh"),
+        source=daily.get("source"),
+    )
+    values.update(_coord_kwargs(latitude, longitude, timezone))
+    values.update(_date_kwargs(requested_date))
+    return values
+
+# Builds an unsaved WeatherRecord from a normalized daily weather dict.
+def build_record(city, country, requested_date, daily, latitude=None, longitude=None, timezone=None):
+    return WeatherRecord(**_row_values(city, country, requested_date, daily, latitude, longitude, timezone))
+
+# Returns the stored record for a location and date, or None.
+def find_stored(city, country, requested_date, latitude=None, longitude=None):
+    """
+    One row is kept per location and date (see find_stored_days for how the location is matched).
+    """
+    return find_stored_days(city, country, [requested_date], latitude, longitude).get(requested_date)
+
+# Returns {date: record} for the stored rows of one location among the given dates.
+def find_stored_days(city, country, dates, latitude=None, longitude=None):
+    """
+    With coordinates, the row stored at them is returned, or else a row stored before coordinates
+    were kept. Without coordinates, a day is returned only when every row stored for it is at one
+    location; when several places share the name, the caller has to resolve the place first.
+    """
+    located = latitude is not None and longitude is not None
+    dates = sorted(set(dates))
+    candidates = {}
+    for start in range(0, len(dates), LOOKUP_CHUNK):
+        chunk = dates[start:start + LOOKUP_CHUNK]
+        query = WeatherRecord.query.filter(
+            WeatherRecord.city == city,
+            WeatherRecord.country == country,
+            WeatherRecord.requested_date.in_(chunk),
+        )
+        if located:
+            query = query.filter(_at_location(WeatherRecord.__table__, latitude, longitude))
+        for record in query.order_by(WeatherRecord.id):
+            candidates.setdefault(record.requested_date, []).append(record)
+
+    stored = {}
+    for day, rows in candidates.items():
+        placed = [record for record in rows if record.latitude is not None]
+        if located or len({(record.latitude, record.longitude) for record in placed}) <= 1:
+            stored[day] = (placed or rows)[-1]
+    return stored
+
+# Rows at exactly these coordinates, or stored before coordinates were kept.
+def _at_location(table, latitude, longitude):
+    return or_(table.c.latitude.is_(None), and_(table.c.latitude == latitude, table.c.longitude == longitude))
+
+# Historical rows never change; forecast rows are reusable for `max_age` after they were fetched.
+def is_fresh(record, max_age=FORECAST_MAX_AGE, now=None):
+    if record.source == "historical":
+        return True
+    fetched_at = record.updated_at or record.created_at
+    if fetched_at is None:
+        return False
+    if fetched_at.tzinfo is None:
+        fetched_at = fetched_at.replace(tzinfo=UTC)
+    return (now or datetime.now(UTC)) - fetched_at <= max_age
+
+# Inserts or refreshes the single row for a location and date; returns (record, created).
+def upsert_record(city, country, requested_date, daily, latitude=None, longitude=None, timezone=None):
+    ids, inserted, _ = _write_days(city, country, [{**daily, "date": requested_date}], latitude, longitude, timezone)
+    db.session.commit()
+    return db.session.get(WeatherRecord, ids[requested_date]), bool(inserted)
+
+# Upserts many days for one location in a single transaction; `days` carry "date" plus daily fields.
+def upsert_days(city, country, days, latitude=None, longitude=None, timezone=None, commit=True):
+    """Returns (inserted, updated) counts. Pass commit=False to leave the transaction open for batching."""
+    _, inserted, updated = _write_days(city, country, days, latitude, longitude, timezone)
+    if commit:
+        db.session.commit()
+    return inserted, updated
+
+# Writes the days with INSERT ... ON CONFLICT DO UPDATE; returns ({date: id}, inserted, updated).
+def _write_days(city, country, days, latitude, longitude, timezone):
+    """
+    Concurrent writers of the same location and day refresh one row instead of adding two: the
+    upsert targets uq_weather_records_location_day. A row stored before coordinates were kept
+    is adopted (updated in place, coordinates filled in) by the first write that knows them.
+    These are Core writes, so the rollups, the records version and on_write() listeners are
+    updated here rather than by ORM flush events. Insert/update counts come from the rows
+    seen just before the write.
+    """
+    now = datetime.now(UTC)
+    rows = {
+        day["date"]: {**_row_values(city, country, day["date"], day, latitude, longitude, timezone),
+                      "created_at": now, "updated_at": now}
+        for day in days
+    }
+    if not rows:
+        return {}, 0, 0
+    connection = db.session.connection()
+    located = latitude is not None and longitude is not None
+
+    placed, unplaced = {}, {}
+    dates = sorted(rows)
+    for start in range(0, len(dates), LOOKUP_CHUNK):
+        statement = select(records.c.id, records.c.requested_date, records.c.latitude).where(
+            records.c.city == city, records.c.country == country,
+            records.c.requested_date.in_(dates[start:start + LOOKUP_CHUNK]),
+            _at_location(records, latitude, longitude) if located else records.c.latitude.is_(None),
+        ).order_by(records.c.id)
+        for row_id, day, row_latitude in connection.execute(statement):
+            (placed if row_latitude is not None else unplaced)[day] = row_id
+
+    ids = {day: unplaced[day] for day in rows if day in unplaced and day not in placed}
+    if ids:
+        db.session.execute(update(WeatherRecord), [
+            {"id": row_id, **{name: value for name, value in rows[day].items() if name != "created_at"}}
+            for day, row_id in ids.items()
+        ])
+    fresh = [values for day, values in rows.items() if day not in ids]
+    if fresh:
+        statement = upsert_insert(connection, records)
+        if located:
+            statement = statement.on_conflict_do_update(
+                index_elements=LOCATION_DAY,
+                set_={name: statement.excluded[name] for name in REFRESHED_COLUMNS},
+            )
+        statement = statement.returning(records.c.id, records.c.requested_date, sort_by_parameter_order=True)
+        ids.update({day: row_id for row_id, day in connection.execute(statement, fresh)})
+
+    rollups.recompute_groups(connection, {rollups.group_key(city, country, day) for day in rows})
+    versions.bump(connection)
+    db.session.info.setdefault("_storage_written", []).extend(rows.values())
+    updated = len(rows.keys() & (placed.keys() | unplaced.keys()))
+    return ids, len(rows) - updated, updated
+
+
+_write_listeners = []
+
+# Registers `listener(rows)`, called after each commit with the column values upsert_days/upsert_record wrote.
+def on_write(listener):
+    _write_listeners.append(listener)
+    return listener
+
+@event.listens_for(Session, "after_commit")
+def _notify_writes(session):
+    rows = session.info.pop("_storage_written", None)
+    if rows:
+        for listener in _write_listeners:
+            listener(rows)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_writes(session):
+    session.info.pop("_storage_written", None)
@@ -2,6 +2,23 @@ import os
 import pytest
 from app import create_app
 from models import db
+import autocomplete
+import climatology
+import weather_api
+from autocomplete import PrefixIndex
+from cache import GeocodeCache, LRUCache, SeriesCache
+from singleflight import SingleFlight
+
+# Gives every test its own empty caches, HTTP client, in-flight tables, autocomplete index and climatology models so state never leaks between tests.
+@pytest.fixture(autouse=True)
+def isolated_caches(tmp_path, monkeypatch):
+    monkeypatch.setattr(weather_api, "geocode_cache", GeocodeCache(path=str(tmp_path / "geocode.db")))
+    monkeypatch.setattr(weather_api, "series_cache", SeriesCache())
+    monkeypatch.setattr(weather_api, "http_client", weather_api.HttpClient(sleep=lambda seconds: None))
+    monkeypatch.setattr(weather_api, "geocode_flight", SingleFlight())
+    monkeypatch.setattr(weather_api, "weather_flight", SingleFlight())
+    monkeypatch.setattr(autocomplete, "index", PrefixIndex())
+    monkeypatch.setattr(climatology, "models", LRUCache())
 
 # Creates a Flask app with a temporary SQLite database for tests.
 @pytest.fixture()
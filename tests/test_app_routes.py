@@ -1,4 +1,5 @@
-from datetime import date
+import re
+from datetime import date, timedelta
 from models import db, WeatherRecord
 
 def test_index_loads(client):
@@ -46,6 +47,8 @@ def test_add_with_selected_coordinates_creates_record(app, client, monkeypatch):
         rec = WeatherRecord.query.first()
         assert rec.city == "Chicago"
         assert rec.temp_max_c == 20.0
+        assert (rec.latitude, rec.longitude, rec.timezone) == (41.8781, -87.6298, "America/Chicago")
+        assert rec.geo_cell is not None
 
 def test_delete_record(app, client, monkeypatch):
     import weather_api as wa
@@ -92,3 +95,206 @@ def test_sorting_by_city(app, client, monkeypatch):
     r = client.get("/?sort=city&dir=asc")
     body = r.data.decode("utf-8")
     assert body.find("Alpha") < body.find("Zulu")
+
+def test_add_range_inserts_all_days(app, client, monkeypatch):
+    import weather_api as wa
+    from datetime import timedelta
+    def fake_range(latitude, longitude, timezone, start_date, end_date):
+        days = []
+        day = start_date
+        while day <= end_date:
+            days.append({"date": day, "temp_max_c": 5.0, "temp_min_c": 1.0, "precip_mm": 0.0, "wind_max_kmh": 3.0, "source": "historical"})
+            day += timedelta(days=1)
+        return {"geo": {"latitude": latitude, "longitude": longitude, "timezone": timezone}, "days": days}
+    monkeypatch.setattr(wa, "fetch_weather_for_range", fake_range)
+
+    r = client.post("/add_range", data={
+        "start_date": "2020-01-01",
+        "end_date": "2020-01-31",
+        "country": "Norway",
+        "city": "Oslo",
+        "lat": "59.91",
+        "lon": "10.75",
+        "timezone": "Europe/Oslo"
+    }, follow_redirects=True)
+    assert r.status_code == 200
+    assert b"31 records added" in r.data
+    with app.app_context():
+        assert WeatherRecord.query.filter_by(city="Oslo").count() == 31
+
+def test_add_range_rejects_reversed_dates(app, client):
+    r = client.post("/add_range", data={
+        "start_date": "2020-02-01",
+        "end_date": "2020-01-01",
+        "country": "Norway",
+        "city": "Oslo",
+    }, follow_redirects=True)
+    assert b"End date must not be before start date" in r.data
+
+def test_index_paginates_and_keeps_filters(app, client):
+    with app.app_context():
+        for i in range(5):
+            db.session.add(WeatherRecord(city=f"City{i}", country="X", requested_date=date(2024, 1, i + 1),
+                                         temp_max_c=float(i), source="historical"))
+        db.session.commit()
+
+    r = client.get("/?sort=city&dir=asc&per_page=2&country=X")
+    body = r.data.decode("utf-8")
+    assert "City0" in body and "City1" in body and "City2" not in body
+    assert "Next page" in body
+    next_link = re.search(r'href="(\?[^"]*after=[^"]*)"', body).group(1).replace("&amp;", "&")
+    assert "country=X" in next_link
+
+    body = client.get("/" + next_link).data.decode("utf-8")
+    assert "City2" in body and "City3" in body and "City1" not in body
+    assert "First page" in body
+
+def test_export_streams_filtered_rows(app, client):
+    import json
+    with app.app_context():
+        for i, city in enumerate(["Oslo", "Bergen", "Oslo"]):
+            db.session.add(WeatherRecord(city=city, country="Norway", requested_date=date(2024, 1, i + 1),
+                                         temp_max_c=None if i == 2 else 1.5, source="historical"))
+        db.session.commit()
+
+    r = client.get("/export.csv?city=Oslo&sort=requested_date&dir=asc")
+    assert r.status_code == 200
+    assert r.mimetype == "text/csv"
+    lines = r.data.decode("utf-8").strip().splitlines()
+    assert lines[0].startswith("id,requested_date,city")
+    assert len(lines) == 3
+    assert ",2024-01-01,Oslo,Norway,1.5," in lines[1]
+
+    r = client.get("/export.ndjson?city=Oslo&sort=requested_date&dir=desc")
+    rows = [json.loads(line) for line in r.data.decode("utf-8").splitlines()]
+    assert [row["requested_date"] for row in rows] == ["2024-01-03", "2024-01-01"]
+    assert rows[0]["temp_max_c"] is None
+
+def test_add_reuses_stored_row_without_network(app, client, monkeypatch):
+    import weather_api as wa
+    calls = []
+    def fake_fetch(city, country, target_date, latitude=None, longitude=None, timezone=None):
+        calls.append(target_date)
+        return {"temp_max_c": 20.0 + len(calls), "temp_min_c": 10.0, "precip_mm": 1.0, "wind_max_kmh": 15.0, "source": "forecast"}
+    def no_search(*args, **kwargs):
+        raise AssertionError("geocoding should not be called for a stored row")
+    monkeypatch.setattr(wa, "fetch_weather_for_date", fake_fetch)
+    monkeypatch.setattr(wa, "search_locations", no_search)
+    form = {"requested_date": date.today().isoformat(), "country": "US", "city": "Chicago",
+            "lat": "41.88", "lon": "-87.63", "timezone": "America/Chicago"}
+
+    client.post("/add", data=form)
+    r = client.post("/add", data={k: v for k, v in form.items() if k not in ("lat", "lon", "timezone")},
+                    follow_redirects=True)
+    assert b"Record already stored" in r.data
+    assert len(calls) == 1
+
+    app.config["FORECAST_MAX_AGE"] = timedelta(seconds=-1)
+    r = client.post("/add", data=form, follow_redirects=True)
+    assert b"Record refreshed" in r.data
+    assert len(calls) == 2
+    assert WeatherRecord.query.count() == 1
+    assert WeatherRecord.query.one().temp_max_c == 22.0
+
+def test_index_serves_cached_table_and_304_until_records_change(app, client, monkeypatch):
+    import queries
+    import versions
+    pages = []
+    keyset_page = queries.keyset_page
+    monkeypatch.setattr(queries, "keyset_page", lambda *a, **kw: pages.append(1) or keyset_page(*a, **kw))
+
+    first = client.get("/?sort=city")
+    etag = first.headers["ETag"]
+    assert first.headers["Cache-Control"] == "no-cache"
+    assert client.get("/?sort=city").data == first.data
+    assert len(pages) == 1
+    assert client.get("/?sort=city", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/?sort=country", headers={"If-None-Match": etag}).status_code == 200
+
+    db.session.add(WeatherRecord(city="Oslo", country="Norway", requested_date=date(2024, 1, 1), source="historical"))
+    db.session.commit()
+    assert versions.current() == 1
+    changed = client.get("/?sort=city", headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and b"Oslo" in changed.data
+    assert changed.headers["ETag"] != etag
+
+    # Pages carrying a flash message are never answered with 304
+    r = client.post(f"/delete/{WeatherRecord.query.one().id}", follow_redirects=True)
+    assert b"Record deleted" in r.data and "ETag" not in r.headers
+    assert versions.current() == 2
+
+def test_batch_returns_per_task_results(app, client, monkeypatch):
+    import weather_api as wa
+    def fake_fetch(city, country, target_date, latitude=None, longitude=None, timezone=None):
+        if city == "Nowhere":
+            raise ValueError("No geocoding results for 'Nowhere, Y'.")
+        return {"temp_max_c": 1.0, "source": "historical", "geo": {"latitude": latitude}}
+    monkeypatch.setattr(wa, "fetch_weather_for_date", fake_fetch)
+    tasks = [{"city": "A", "country": "Y", "date": "2020-01-01", "latitude": 1.0, "longitude": 2.0},
+             {"city": "Nowhere", "country": "Y", "date": "2020-01-01", "latitude": 0.0, "longitude": 0.0}]
+
+    results = client.post("/batch", json={"tasks": tasks}).get_json()["results"]
+    assert results[0] == {"ok": True, "weather": {"temp_max_c": 1.0, "source": "historical", "geo": {"latitude": 1.0}}}
+    assert results[1] == {"ok": False, "error": "No geocoding results for 'Nowhere, Y'."}
+    assert client.post("/batch", json={"tasks": [{"city": "A"}]}).status_code == 400
+    assert client.post("/batch", json={}).status_code == 400
+
+def test_add_serves_stale_data_while_the_circuit_is_open(app, client, monkeypatch):
+    import jobs
+    import weather_api as wa
+    from cache import SeriesCache
+    breaker = wa.CircuitBreaker("forecast", failure_threshold=1, reset_timeout=60)
+    breaker.record(elapsed=0.0, ok=False)
+    monkeypatch.setattr(wa, "http_client", wa.HttpClient(sleep=lambda s: None, breakers={"forecast": breaker}))
+    monkeypatch.setattr(wa, "series_cache", SeriesCache(ttls={"forecast": -1}))
+    today = date.today()
+    wa.series_cache.store(41.88, -87.63, "America/Chicago", "forecast", {
+        "time": [today.isoformat()], "temperature_2m_max": [25.0], "temperature_2m_min": [15.0],
+        "precipitation_sum": [2.0], "wind_speed_10m_max": [30.0]})
+    form = {"requested_date": today.isoformat(), "country": "US", "city": "Chicago",
+            "lat": "41.88", "lon": "-87.63", "timezone": "America/Chicago"}
+
+    r = client.post("/add", data=form, follow_redirects=True)
+    assert b"last known forecast values (stale): max 25.0" in r.data and b"The record is saved once" in r.data
+    assert WeatherRecord.query.count() == 0
+
+    db.session.add(WeatherRecord(city="Chicago", country="US", requested_date=today, source="forecast", temp_max_c=20.0))
+    db.session.commit()
+    app.config["FORECAST_MAX_AGE"] = timedelta(seconds=-1)
+    r = client.post("/add", data=form, follow_redirects=True)
+    assert b"showing the stored forecast values" in r.data and b"(stale). They are refreshed once" in r.data
+    revalidator = app.extensions["weather_revalidator"]
+    assert revalidator.pending() == 1  # one timer per location and day, however often it is asked for
+    revalidator.cancel()
+    assert jobs.recent_jobs() == [] and "weather_jobs" not in app.extensions  # sync mode starts no job workers
+
+def test_stale_row_is_revalidated_once_the_circuit_closes(app, client, monkeypatch):
+    import time
+    import weather_api as wa
+    outage, refetches = [True], []
+    def fetch(**kwargs):
+        if outage[0]:
+            raise wa.CircuitOpenError("forecast", 0.1)
+        refetches.append(kwargs["target_date"])
+        return {"temp_max_c": 22.0, "source": "forecast"}
+    monkeypatch.setattr(wa, "fetch_weather_for_date", fetch)
+    today = date.today()
+    db.session.add(WeatherRecord(city="Chicago", country="US", requested_date=today, source="forecast", temp_max_c=20.0,
+                                 latitude=41.88, longitude=-87.63, timezone="America/Chicago"))
+    db.session.commit()
+    app.config["FORECAST_MAX_AGE"] = timedelta(seconds=-1)
+    form = {"requested_date": today.isoformat(), "country": "US", "city": "Chicago",
+            "lat": "41.88", "lon": "-87.63", "timezone": "America/Chicago"}
+
+    for _ in range(2):
+        assert b"(stale). They are refreshed once" in client.post("/add", data=form, follow_redirects=True).data
+    revalidator = app.extensions["weather_revalidator"]
+    assert revalidator.pending() == 1
+
+    outage[0] = False  # the circuit closes; the next timer's trial call succeeds
+    deadline = time.monotonic() + 5
+    while revalidator.pending() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    db.session.expire_all()
+    assert WeatherRecord.query.one().temp_max_c == 22.0
+    assert (refetches, revalidator.revalidated) == ([today], 1)
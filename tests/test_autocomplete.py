@@ -0,0 +1,56 @@
+from datetime import date
+
+import autocomplete
+from autocomplete import PrefixIndex
+from models import db, WeatherRecord
+from tests.test_weather_api import make_requests_get_stub, use_stub
+
+def place(name, country="Brazil", lat=-23.55, lon=-46.63):
+    return {"name": name, "admin1": None, "country": country, "latitude": lat, "longitude": lon, "timezone": "UTC"}
+
+def test_prefix_index_normalizes_and_bounds_memory():
+    index = PrefixIndex(max_entries=2)
+    index.add(place("São Paulo"))
+    index.add(place("Salvador", lat=-12.97, lon=-38.5))
+    index.add(place("São Paulo"))  # refreshes recency instead of duplicating
+    assert [r["name"] for r in index.search("  SAO ")] == ["São Paulo"]
+    assert [r["name"] for r in index.search("sa")] == ["Salvador", "São Paulo"]
+
+    index.add(place("Santos", lat=-23.96, lon=-46.33))
+    assert len(index) == 2
+    assert [r["name"] for r in index.search("sa")] == ["Santos", "São Paulo"]  # Salvador was least recent
+    assert index.search("") == [] and index.search("x") == []
+
+def test_autocomplete_serves_stored_locations_and_learns_new_ones(app, client, monkeypatch):
+    calls = []
+    use_stub(monkeypatch, make_requests_get_stub(calls))
+    db.session.add(WeatherRecord(city="Oslo", country="Norway", requested_date=date(2020, 1, 1),
+                                 latitude=59.91, longitude=10.75, timezone="Europe/Oslo", source="historical"))
+    db.session.commit()
+
+    data = client.get("/autocomplete?q=os").get_json()
+    assert data["source"] == "index" and data["results"][0]["latitude"] == 59.91
+
+    db.session.add(WeatherRecord(city="Osaka", country="Japan", requested_date=date(2020, 1, 1),
+                                 latitude=34.69, longitude=135.5, timezone="Asia/Tokyo", source="historical"))
+    db.session.commit()
+    assert [r["name"] for r in client.get("/autocomplete?q=os").get_json()["results"]] == ["Osaka", "Oslo"]
+    assert calls == []
+
+    assert client.get("/autocomplete?q=spring&geocode=0").get_json()["results"] == []
+    data = client.get("/autocomplete?q=spring").get_json()
+    assert data["source"] == "geocoding" and {r["admin1"] for r in data["results"]} == {"Illinois", "Missouri"}
+    assert client.get("/autocomplete?q=springf").get_json()["source"] == "index"
+    assert len(calls) == 1
+
+def test_index_loads_each_stored_place_with_its_own_coordinates(app):
+    for latitude, longitude in ((39.78, -89.64), (37.2, -93.29)):
+        db.session.add(WeatherRecord(city="Springfield", country="United States", requested_date=date(2020, 1, 1),
+                                     latitude=latitude, longitude=longitude, timezone="America/Chicago",
+                                     source="historical"))
+    db.session.commit()
+    autocomplete.index.clear()
+
+    autocomplete.ensure_loaded()
+    places = {(r["latitude"], r["longitude"]) for r in autocomplete.index.search("spring")}
+    assert places == {(39.78, -89.64), (37.2, -93.29)}  # one suggestion per stored place
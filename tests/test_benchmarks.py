@@ -0,0 +1,44 @@
+import json
+from datetime import date, timedelta
+
+import pytest
+
+import weather_api as wa
+from benchmarks import run
+from benchmarks.stub_server import OpenMeteoStub
+
+def test_stub_serves_all_endpoints_through_weather_api():
+    with OpenMeteoStub() as stub:
+        candidates = wa.search_locations("Springfield", "Stubland")
+        assert candidates[0]["name"] == "Springfield"
+        loc = candidates[0]
+        recent = wa.fetch_weather_for_date("Springfield", "Stubland", date.today() - timedelta(days=2),
+                                           latitude=loc["latitude"], longitude=loc["longitude"], timezone="UTC")
+        old = wa.fetch_weather_for_range(loc["latitude"], loc["longitude"], "UTC", date(2001, 1, 1), date(2001, 1, 10))
+        assert recent["source"] == "forecast"
+        assert len(old["days"]) == 10
+        assert stub.requests == {"search": 1, "forecast": 1, "archive": 1}
+
+def test_stub_error_rate_is_retried(monkeypatch):
+    monkeypatch.setattr(wa, "http_client", wa.HttpClient(retries=2, sleep=lambda s: None))
+    with OpenMeteoStub(error_rate=1.0) as stub:
+        with pytest.raises(RuntimeError, match="503"):
+            wa.search_locations("Springfield", "Stubland")
+        assert stub.requests == {"search": 3}
+
+def test_percentile_nearest_rank():
+    values = list(range(1, 101))
+    assert run.percentile(values, 0.5) == 50
+    assert run.percentile(values, 0.99) == 99
+    assert run.percentile([], 0.5) is None
+
+def test_benchmark_run_writes_json(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", "sqlite://")
+    output = tmp_path / "bench.json"
+    run.main(["--sizes", "50", "--requests", "6", "--concurrency", "2", "--latency", "0", "--output", str(output)])
+    report = json.loads(output.read_text())
+    endpoints = {r["endpoint"]: r for r in report["results"]}
+    assert set(endpoints) == {"GET /", "GET /nearby", "POST /add", "POST /delete"}
+    assert endpoints["POST /add"]["errors"] == 0
+    assert endpoints["GET /"]["p99_ms"] >= endpoints["GET /"]["p50_ms"]
+    assert report["upstream_requests"]["search"] == 6
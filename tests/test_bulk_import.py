@@ -0,0 +1,98 @@
+import io
+from datetime import date, timedelta
+
+import bulk_import
+from models import WeatherRecord
+
+CSV = """date,city,country,region
+2020-01-01,Oslo,Norway,
+2020-01-02, oslo ,NORWAY,
+2020-03-01,Oslo,Norway,
+not-a-date,Oslo,Norway,
+2020-01-01,Atlantis,Nowhere,
+2020-01-05,Bergen,Norway,Vestland
+"""
+
+def install_fakes(monkeypatch, geocode_calls, range_calls):
+    import weather_api as wa
+    def fake_search(city, country, admin1=None, count=6):
+        geocode_calls.append((city, country, admin1))
+        if city.strip().lower() == "atlantis":
+            return []
+        return [{"name": city, "admin1": admin1, "country": country, "latitude": 60.0, "longitude": 10.0, "timezone": "Europe/Oslo"}]
+    def fake_range(latitude, longitude, timezone, start_date, end_date):
+        range_calls.append((start_date, end_date))
+        days = []
+        day = start_date
+        while day <= end_date:
+            days.append({"date": day, "temp_max_c": 1.0, "temp_min_c": -1.0, "precip_mm": 0.0, "wind_max_kmh": 5.0, "source": "historical"})
+            day += timedelta(days=1)
+        return {"geo": {}, "days": days}
+    monkeypatch.setattr(wa, "search_locations", fake_search)
+    monkeypatch.setattr(wa, "fetch_weather_for_range", fake_range)
+
+def test_group_spans_bridges_small_gaps():
+    days = [date(2020, 1, 1), date(2020, 1, 3), date(2020, 1, 1), date(2020, 2, 1)]
+    assert bulk_import.group_spans(days) == [
+        (date(2020, 1, 1), date(2020, 1, 3)),
+        (date(2020, 2, 1), date(2020, 2, 1)),
+    ]
+
+def test_import_dedupes_geocoding_and_groups_fetches(app, monkeypatch):
+    geocode_calls, range_calls = [], []
+    install_fakes(monkeypatch, geocode_calls, range_calls)
+
+    report = bulk_import.import_csv(io.StringIO(CSV), max_workers=4, batch_size=2)
+
+    assert len(geocode_calls) == 3  # Oslo, Atlantis, Bergen
+    assert sorted(range_calls) == [
+        (date(2020, 1, 1), date(2020, 1, 2)),
+        (date(2020, 1, 5), date(2020, 1, 5)),
+        (date(2020, 3, 1), date(2020, 3, 1)),
+    ]
+    assert report.rows == 6
+    assert report.inserted == 4 and report.skipped == 0
+    assert [line for line, _ in report.failures] == [5, 6]
+    assert WeatherRecord.query.count() == 4
+
+def test_import_rejects_missing_columns(app):
+    try:
+        bulk_import.import_csv(io.StringIO("when,where\n2020-01-01,Oslo\n"))
+    except ValueError as e:
+        assert "header" in str(e)
+    else:
+        raise AssertionError("expected ValueError")
+
+def test_import_reports_rows_with_extra_fields(app, monkeypatch):
+    install_fakes(monkeypatch, [], [])
+    report = bulk_import.import_csv(io.StringIO(
+        "date,city,country\n2020-01-01,Oslo,Norway,oops\n2020-01-02,Oslo,Norway\n"
+    ))
+    assert report.inserted == 1
+    assert report.failures == [(2, "Too many fields: 4 for a 3-column header.")]
+
+def test_import_route_and_cli(app, client, monkeypatch, tmp_path):
+    install_fakes(monkeypatch, [], [])
+    r = client.post("/import", data={"file": (io.BytesIO(CSV.encode()), "rows.csv")},
+                    content_type="multipart/form-data")
+    assert r.status_code == 200
+    assert b"4 inserted" in r.data
+
+    path = tmp_path / "rows.csv"
+    path.write_text(CSV)
+    result = app.test_cli_runner().invoke(args=["import-csv", str(path)])
+    assert result.exit_code == 0
+    assert "0 inserted, 0 refreshed, 4 already stored, 2 failed" in result.output
+    assert WeatherRecord.query.count() == 4
+
+def test_import_skips_stored_and_duplicate_rows(app, monkeypatch):
+    geocode_calls, range_calls = [], []
+    install_fakes(monkeypatch, geocode_calls, range_calls)
+    bulk_import.import_csv(io.StringIO("date,city,country\n2020-01-01,Oslo,Norway\n"))
+
+    report = bulk_import.import_csv(io.StringIO(
+        "date,city,country\n2020-01-01,Oslo,Norway\n2020-01-02,Oslo,Norway\n2020-01-02,Oslo,Norway\n"
+    ))
+    assert report.skipped == 2 and report.inserted == 1
+    assert range_calls[-1] == (date(2020, 1, 2), date(2020, 1, 2))
+    assert WeatherRecord.query.count() == 2
@@ -0,0 +1,59 @@
+from cache import MISS, GeocodeCache, LRUCache, SeriesCache
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is MISS
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+def test_lru_expires_entries():
+    cache = LRUCache()
+    cache.set("a", 1, ttl=10, now=100)
+    assert cache.get("a", now=105) == 1
+    assert cache.get("a", now=111) is MISS
+    assert cache.get("a", now=111, stale=True) == 1  # kept for stale fallbacks until evicted
+
+def test_geocode_cache_persists_across_instances(tmp_path):
+    path = str(tmp_path / "geo.db")
+    key = GeocodeCache.make_key("Paris", "France")
+    GeocodeCache(path=path).set(key, [{"name": "Paris"}])
+
+    fresh = GeocodeCache(path=path)
+    assert fresh.get(key) == [{"name": "Paris"}]
+    assert fresh.stats()["disk_hits"] == 1
+    assert fresh.get(GeocodeCache.make_key("Lyon", "France")) is MISS
+    assert fresh.stats()["misses"] == 1
+
+def test_geocode_cache_counts_every_lookup_across_threads():
+    from concurrent.futures import ThreadPoolExecutor
+    cache = GeocodeCache()
+    key = GeocodeCache.make_key("Paris", "France")
+    cache.set(key, [{"name": "Paris"}])
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda n: cache.get(key if n % 2 else ("x", str(n), "", 6)), range(4000)))
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (2000, 2000)
+
+def test_geocode_cache_respects_ttl(tmp_path):
+    cache = GeocodeCache(path=str(tmp_path / "geo.db"), ttl=-1)
+    key = GeocodeCache.make_key("Paris", "France")
+    cache.set(key, [{"name": "Paris"}])
+    assert cache.get(key) is MISS
+
+def test_series_cache_expires_forecast_but_not_historical():
+    cache = SeriesCache(ttls={"forecast": -1})
+    daily = {"time": ["2024-01-01", "2024-01-02"], "temperature_2m_max": [1.0, 2.0]}
+    assert cache.store(10.0, 20.0, "UTC", "historical", daily) == 2
+    cache.store(10.0, 20.0, "UTC", "forecast", daily)
+    assert cache.get(10.0, 20.0, "UTC", "historical", "2024-01-02") == {"temperature_2m_max": 2.0}
+    assert cache.get(10.0, 20.0, "UTC", "forecast", "2024-01-02") is MISS
+
+def test_series_cache_counts_every_lookup_across_threads():
+    from concurrent.futures import ThreadPoolExecutor
+    cache = SeriesCache()
+    cache.store(10.0, 20.0, "UTC", "historical", {"time": ["2024-01-01"], "temperature_2m_max": [1.0]})
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda n: cache.get(10.0, 20.0, "UTC", "historical", "2024-01-0%d" % (1 + n % 2)), range(4000)))
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (2000, 2000)
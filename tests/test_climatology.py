@@ -0,0 +1,89 @@
+import math
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+import climatology
+import weather_api as wa
+from models import db, WeatherRecord
+from tests.test_weather_api import FakeResponse, make_requests_get_stub, use_stub
+
+# Seasonal temperature with a warming trend of 0.5 °C per year since 2000.
+def seasonal(day):
+    years = (day.toordinal() - climatology.EPOCH) / climatology.YEAR_DAYS
+    return 10 + 0.5 * years + 8 * math.cos(2 * math.pi * years)
+
+def archive_stub(calls):
+    def _get(url, params=None, timeout=30, **kwargs):
+        calls.append((url, dict(params)))
+        start, end = date.fromisoformat(params["start_date"]), date.fromisoformat(params["end_date"])
+        days = [start + timedelta(days=n) for n in range((end - start).days + 1)]
+        return FakeResponse({"daily": {
+            "time": [day.isoformat() for day in days],
+            "temperature_2m_max": [seasonal(day) + 5 for day in days],
+            "temperature_2m_min": [seasonal(day) - 5 for day in days],
+            "precipitation_sum": [None] * len(days),
+            "wind_speed_10m_max": [12.0] * len(days),
+        }})
+    return _get
+
+def test_fit_recovers_seasonal_cycle_and_trend():
+    days = [date(2015, 1, 1) + timedelta(days=n) for n in range(4 * 365)]
+    values = np.array([[seasonal(day), seasonal(day) - 10, np.nan, 3.0] for day in days])
+    model = climatology.fit(days, values)
+    predicted = model.predict([date(2030, 1, 1), date(2030, 7, 2)])
+    assert predicted[:, 0] == pytest.approx([seasonal(date(2030, 1, 1)), seasonal(date(2030, 7, 2))], abs=0.01)
+    assert np.isnan(predicted[:, 2]).all() and predicted[:, 3] == pytest.approx([3.0, 3.0])
+
+    short = climatology.fit(days[:365], values[:365])
+    assert short.coefficients[1, 0] == 0  # under two years no trend is extrapolated
+
+def test_far_future_dates_are_predicted_locally(app, monkeypatch):
+    calls = []
+    use_stub(monkeypatch, archive_stub(calls))
+    target = wa.last_forecast_day() + timedelta(days=30)
+
+    out = wa.fetch_weather_for_date("Oslo", "Norway", target, latitude=59.91, longitude=10.75, timezone="UTC")
+    assert out["source"] == "predicted" and out["precip_mm"] is None
+    assert out["temp_max_c"] == pytest.approx(seasonal(target) + 5, abs=0.2)
+    assert len(calls) == 1 and "archive-api" in calls[0][0]
+
+    days = wa.fetch_weather_for_range(59.91, 10.75, "UTC", target, target + timedelta(days=2))["days"]
+    assert [day["source"] for day in days] == ["predicted"] * 3 and len(calls) == 1  # coefficients are cached
+
+    db.session.add(WeatherRecord(city="Oslo", country="Norway", requested_date=date(2020, 1, 1), source="historical",
+                                 latitude=59.91, longitude=10.75, timezone="UTC"))
+    assert len(climatology.models) == 1
+    db.session.commit()
+    assert len(climatology.models) == 0  # new history invalidated the model
+
+def test_unfitted_and_non_finite_predictions_become_none():
+    days = [date(2015, 1, 1) + timedelta(days=n) for n in range(365)]
+    values = np.array([[np.nan, seasonal(day), 1.0, 3.0] for day in days])
+    model = climatology.fit(days, values)
+    model.coefficients[0, 2] = np.inf
+    climatology.models.set(climatology._key(1.0, 2.0), model)
+
+    out = climatology.predict(1.0, 2.0, "UTC", [date(2030, 1, 1)])[date(2030, 1, 1)]
+    assert out["temp_max_c"] is None and out["precip_mm"] is None
+    assert isinstance(out["temp_min_c"], float) and out["wind_max_kmh"] == 3.0
+
+def test_horizon_boundary_switches_from_forecast_to_prediction(app, monkeypatch):
+    calls = []
+    archive = archive_stub(calls)
+    forecast = make_requests_get_stub(calls)
+    use_stub(monkeypatch, lambda url, **kwargs: (archive if "archive-api" in url else forecast)(url, **kwargs))
+    last = wa.last_forecast_day()
+
+    assert wa.fetch_weather_for_date("Oslo", "Norway", last, latitude=59.91, longitude=10.75)["source"] == "forecast"
+    out = wa.fetch_weather_for_date("Oslo", "Norway", last + timedelta(days=1), latitude=59.91, longitude=10.75)
+    assert out["source"] == "predicted"
+    assert out["temp_max_c"] == pytest.approx(seasonal(last + timedelta(days=1)) + 5, abs=0.2)
+
+def test_missing_day_in_upstream_series_is_an_error(monkeypatch):
+    def _get(url, params=None, timeout=30, **kwargs):
+        return FakeResponse({"daily": {"time": ["2000-01-01"], "temperature_2m_max": [1.0]}})
+    use_stub(monkeypatch, _get)
+    with pytest.raises(ValueError, match="No daily data"):
+        wa.fetch_weather_for_date("X", "Y", date.today() + timedelta(days=3), latitude=1.0, longitude=2.0)
@@ -0,0 +1,59 @@
+import random
+import sqlite3
+from datetime import date
+
+import geo
+from app import create_app
+from models import db, WeatherRecord
+from storage import build_record
+
+def covered(cell, ranges):
+    return any(first <= cell <= last for first, last in ranges)
+
+def test_cell_ranges_cover_every_point_in_radius():
+    rng = random.Random(7)
+    for lat, lon, km in [(0, 0, 50), (51.5, -0.1, 300), (10, 179.9, 80), (-33.9, -179.95, 120), (89.5, 20, 100)]:
+        ranges = geo.cell_ranges(lat, lon, km)
+        for _ in range(500):
+            plat = max(-90, min(90, lat + rng.uniform(-3, 3)))
+            plon = (lon + rng.uniform(-6, 6) + 180) % 360 - 180
+            if geo.haversine_km(lat, lon, plat, plon) <= km:
+                assert covered(geo.cell_for(plat, plon), ranges), (lat, lon, plat, plon)
+
+def test_nearby_records_prunes_and_orders_by_distance(app):
+    points = {"Here": (48.85, 2.35), "Close": (48.90, 2.40), "Across": (48.85, 2.35 + 0.7), "Far": (45.76, 4.84)}
+    for city, (lat, lon) in points.items():
+        db.session.add(build_record(city, "France", date(2024, 5, 1), {"source": "historical"}, lat, lon, "Europe/Paris"))
+    db.session.add(build_record("Unknown", "France", date(2024, 5, 1), {"source": "historical"}))
+    db.session.commit()
+
+    rows = geo.nearby_records(48.85, 2.35, 60)
+    assert [row["city"] for row in rows] == ["Here", "Close", "Across"]
+    assert rows[0]["distance_km"] == 0
+    assert WeatherRecord.query.filter_by(city="Close").one().geo_cell == geo.cell_for(48.90, 2.40)
+
+def test_nearby_route_validates_and_filters(app, client):
+    db.session.add(build_record("Oslo", "Norway", date(2024, 1, 1), {"source": "historical"}, 59.91, 10.75, "Europe/Oslo"))
+    db.session.add(build_record("Oslo", "Norway", date(2024, 1, 2), {"source": "forecast"}, 59.91, 10.75, "Europe/Oslo"))
+    db.session.commit()
+
+    assert client.get("/nearby?lat=95&lon=0").status_code == 400
+    assert client.get("/nearby?lat=59.9&lon=10.7&km=0").status_code == 400
+    rows = client.get("/nearby?lat=59.9&lon=10.7&km=10&source=forecast").get_json()
+    assert [(row["city"], row["requested_date"]) for row in rows] == [("Oslo", "2024-01-02")]
+
+def test_create_app_adds_missing_columns_to_old_database(tmp_path, monkeypatch):
+    db_path = tmp_path / "old.db"
+    with sqlite3.connect(db_path) as connection:
+        connection.execute(
+            "CREATE TABLE weather_records (id INTEGER PRIMARY KEY, requested_date DATE NOT NULL, "
+            "city VARCHAR(120) NOT NULL, country VARCHAR(120) NOT NULL, temp_max_c FLOAT, temp_min_c FLOAT, "
+            "precip_mm FLOAT, wind_max_kmh FLOAT, source VARCHAR(32) NOT NULL, created_at DATETIME NOT NULL)"
+        )
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{db_path}")
+    create_app()
+    with sqlite3.connect(db_path) as connection:
+        columns = {row[1] for row in connection.execute("PRAGMA table_info(weather_records)")}
+        indexes = {row[1] for row in connection.execute("PRAGMA index_list(weather_records)")}
+    assert {"latitude", "longitude", "timezone", "geo_cell", "updated_at"} <= columns
+    assert "ix_weather_records_geo_cell_latitude" in indexes
@@ -0,0 +1,151 @@
+import math
+from datetime import date, timedelta
+
+import numpy as np
+
+import hourly
+import weather_api as wa
+from models import HourlySeries, WeatherRecord
+from tests.test_weather_api import FakeResponse, use_stub
+
+def hourly_stub(calls):
+    def _get(url, params=None, timeout=30, **kwargs):
+        calls.append((url, dict(params)))
+        start, end = date.fromisoformat(params["start_date"]), date.fromisoformat(params["end_date"])
+        times, temps = [], []
+        day = start
+        while day <= end:
+            times += [f"{day.isoformat()}T{hour:02d}:00" for hour in range(24)]
+            temps += [None if hour == 0 else float(hour) for hour in range(24)]
+            day += timedelta(days=1)
+        return FakeResponse({"hourly": {"time": times, "temperature_2m": temps,
+                                        "precipitation": [0.5] * len(times), "wind_speed_10m": [10.0] * len(times)}})
+    return _get
+
+def test_pack_stack_and_daily_stats():
+    blob = hourly.pack([1.5, None, -3.25])
+    assert len(blob) == 12
+    assert np.isnan(hourly.unpack(blob)[1]) and hourly.unpack(blob)[2] == -3.25
+
+    full = hourly.pack([float(h) for h in range(24)])
+    short = hourly.pack([1.0] * 23)
+    empty = hourly.pack([None] * 24)
+    matrix = hourly.stack([full, short, empty])
+    assert matrix.shape == (3, 24) and np.isnan(matrix[1, 23])
+
+    stats = hourly.daily_stats(matrix, matrix, matrix)
+    assert stats["temp_max_c"][0] == 23 and stats["temp_min_c"][1] == 1
+    assert stats["precip_mm"][0] == sum(range(24)) and stats["temp_mean_c"][1] == 1
+    assert all(math.isnan(stats[name][2]) for name in stats)
+
+def test_ingest_stores_one_row_per_day_and_describes_it(app, client, monkeypatch):
+    calls = []
+    use_stub(monkeypatch, hourly_stub(calls))
+    old = date.today() - timedelta(days=30)
+    assert hourly.ingest("Oslo", "Norway", 59.91, 10.75, "Europe/Oslo", old, old + timedelta(days=2)) == 3
+    assert hourly.ingest("Oslo", "Norway", 59.91, 10.75, "Europe/Oslo", old, old) == 1
+    assert HourlySeries.query.count() == 3
+    assert "archive-api" in calls[0][0] and calls[0][1]["hourly"] == ",".join(wa.HOURLY_PARAMS)
+
+    days = client.get(f"/hourly?city=Oslo&country=Norway&start_date={old.isoformat()}&end_date={(old + timedelta(days=5)).isoformat()}").get_json()
+    assert len(days) == 3
+    assert days[0]["hourly"]["temperature_c"][:2] == [None, 1.0]
+    assert days[0]["daily"] == {"temp_max_c": 23.0, "temp_min_c": 1.0, "temp_mean_c": 12.0, "precip_mm": 12.0, "wind_max_kmh": 10.0}
+    assert days[0]["source"] == "historical"
+    assert client.get("/hourly?city=Oslo&country=Norway").status_code == 400
+
+def test_add_range_can_store_hourly_series(app, client, monkeypatch):
+    use_stub(monkeypatch, hourly_stub([]))
+    def fake_range(latitude, longitude, timezone, start_date, end_date):
+        return {"geo": {}, "days": [{"date": start_date, "temp_max_c": 5.0, "temp_min_c": 1.0,
+                                     "precip_mm": 0.0, "wind_max_kmh": 3.0, "source": "historical"}]}
+    monkeypatch.setattr(wa, "fetch_weather_for_range", fake_range)
+    form = {"start_date": "2020-01-01", "end_date": "2020-01-01", "country": "Norway", "city": "Oslo",
+            "lat": "59.91", "lon": "10.75", "timezone": "Europe/Oslo", "hourly": "1"}
+
+    r = client.post("/add_range", data=form, follow_redirects=True)
+    assert b"1 records added, 0 refreshed. Hourly series stored for 1 days." in r.data
+    r = client.post("/add_range", data=form, follow_redirects=True)
+    assert b"0 records added" in r.data
+    assert (WeatherRecord.query.count(), HourlySeries.query.count()) == (1, 1)
+
+def test_add_range_keeps_the_daily_records_when_the_hourly_fetch_fails(app, client, monkeypatch):
+    def fake_range(latitude, longitude, timezone, start_date, end_date):
+        return {"geo": {}, "days": [{"date": start_date, "temp_max_c": 5.0, "source": "historical"}]}
+    def failing_hourly(*args):
+        raise wa.CircuitOpenError("archive", 30)
+    monkeypatch.setattr(wa, "fetch_weather_for_range", fake_range)
+    monkeypatch.setattr(wa, "fetch_hourly_range", failing_hourly)
+    form = {"start_date": "2020-01-01", "end_date": "2020-01-01", "country": "Norway", "city": "Oslo",
+            "lat": "59.91", "lon": "10.75", "timezone": "Europe/Oslo", "hourly": "1"}
+
+    r = client.post("/add_range", data=form, follow_redirects=True)
+    assert r.status_code == 200
+    assert b"1 records added, 0 refreshed." in r.data and b"Hourly series not stored" in r.data
+    assert (WeatherRecord.query.count(), HourlySeries.query.count()) == (1, 0)
+
+def test_dst_days_keep_their_real_hour_count(app, client):
+    from models import db
+    spring, fall = date(2024, 3, 31), date(2024, 10, 27)  # Europe/Oslo: 23 and 25 local hours
+    for day, hours in ((spring, 23), (fall, 25), (fall + timedelta(days=1), 24)):
+        values = [float(hour) for hour in range(hours)]
+        db.session.add(HourlySeries(city="Oslo", country="Norway", requested_date=day, source="historical",
+                                    hours=hours, temperature_c=hourly.pack(values), precip_mm=hourly.pack(values),
+                                    wind_kmh=hourly.pack(values)))
+    db.session.commit()
+
+    matrix = hourly.stack(hourly.pack([1.0] * n) for n in (23, 25, 24))
+    assert matrix.shape == (3, 25) and np.isnan(matrix[0, 23:]).all() and matrix[1, 24] == 1.0
+
+    days = {d["date"]: d for d in hourly.describe("Oslo", "Norway", spring, fall + timedelta(days=1))}
+    assert [len(d["hourly"]["temperature_c"]) for d in days.values()] == [d["hours"] for d in days.values()] == [23, 25, 24]
+    assert days[fall.isoformat()]["daily"]["temp_max_c"] == 24.0  # the repeated hour is not dropped
+    assert days[spring.isoformat()]["daily"]["temp_max_c"] == 22.0
+
+def test_same_named_places_keep_separate_hourly_series(app, client, monkeypatch):
+    from sqlalchemy import inspect, text
+    from sqlalchemy.schema import CreateTable
+    from models import db
+    use_stub(monkeypatch, hourly_stub([]))
+    old = date.today() - timedelta(days=30)
+    for latitude, longitude in ((39.78, -89.64), (37.2, -93.29)):
+        assert hourly.ingest("Springfield", "United States", latitude, longitude, "America/Chicago", old, old) == 1
+    assert {(s.latitude, s.longitude) for s in HourlySeries.query} == {(39.78, -89.64), (37.2, -93.29)}
+
+    url = f"/hourly?city=Springfield&country=United+States&start_date={old.isoformat()}"
+    assert client.get(url).status_code == 400  # ambiguous without coordinates
+    assert len(client.get(url + "&lat=37.2&lon=-93.29").get_json()) == 1
+
+    # A file created with the old coordinate-blind key is rebuilt with its rows kept
+    table = HourlySeries.__table__
+    legacy = str(CreateTable(table).compile(db.engine)).replace(
+        "uq_weather_hourly_location_day UNIQUE (city, country, requested_date, latitude, longitude)",
+        "uq_weather_hourly_day UNIQUE (city, country, requested_date)")
+    db.session.execute(text("DELETE FROM weather_hourly WHERE latitude = 37.2"))
+    rows = db.session.execute(table.select()).mappings().all()
+    db.session.execute(text("DROP TABLE weather_hourly"))
+    db.session.execute(text(legacy))
+    db.session.execute(table.insert(), [dict(row) for row in rows])
+    db.session.commit()
+    db.session.remove()
+    assert {c["name"] for c in inspect(db.engine).get_unique_constraints("weather_hourly")} == {hourly.LEGACY_KEY}
+
+    hourly.upgrade_schema(db.engine)
+    assert {c["name"] for c in inspect(db.engine).get_unique_constraints("weather_hourly")} == {"uq_weather_hourly_location_day"}
+    assert {i["name"] for i in inspect(db.engine).get_indexes("weather_hourly")} == {i.name for i in table.indexes}
+    assert hourly.ingest("Springfield", "United States", 37.2, -93.29, "America/Chicago", old, old) == 1
+    assert HourlySeries.query.count() == 2
+
+def test_hourly_range_stops_at_the_forecast_horizon(monkeypatch):
+    calls = []
+    use_stub(monkeypatch, hourly_stub(calls))
+    today = date.today()
+    days = wa.fetch_hourly_range(1.0, 2.0, "UTC", today - timedelta(days=30), today + timedelta(days=40))
+    archive, forecast = (params for _, params in calls)
+    assert archive["end_date"] == (today - timedelta(days=wa.ARCHIVE_DELAY_DAYS + 1)).isoformat()
+    assert forecast["end_date"] == wa.last_forecast_day(today).isoformat()
+    assert max(days) == wa.last_forecast_day(today)
+
+    calls.clear()
+    assert wa.fetch_hourly_range(1.0, 2.0, "UTC", today + timedelta(days=30), today + timedelta(days=40)) == {}
+    assert calls == []
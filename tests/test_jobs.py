@@ -0,0 +1,98 @@
+import json
+import time
+from datetime import date, datetime, timedelta, UTC
+
+import jobs
+import metrics
+import weather_api as wa
+from models import db, Job, WeatherRecord
+
+CANDIDATES = [
+    {"name": "Springfield", "admin1": "Illinois", "country": "United States", "latitude": 39.78, "longitude": -89.64, "timezone": "America/Chicago"},
+    {"name": "Springfield", "admin1": "Missouri", "country": "United States", "latitude": 37.20, "longitude": -93.29, "timezone": "America/Chicago"},
+]
+
+def fake_fetch(city, country, target_date, latitude=None, longitude=None, timezone=None):
+    return {"temp_max_c": 20.0, "temp_min_c": 10.0, "precip_mm": 1.0, "wind_max_kmh": 15.0, "source": "forecast"}
+
+def post_async(app, client, **form):
+    app.config["ADD_MODE"] = "async"
+    data = {"requested_date": date.today().isoformat(), "country": "United States", "city": "Springfield", **form}
+    response = client.post("/add", data=data, follow_redirects=True)
+    jobs.get_queue(app).wait(timeout=10)
+    db.session.expire_all()
+    return response
+
+def test_async_add_queues_and_worker_saves_record(app, client, monkeypatch):
+    monkeypatch.setattr(wa, "fetch_weather_for_date", fake_fetch)
+    r = post_async(app, client, lat="39.78", lon="-89.64", timezone="America/Chicago")
+    assert b"Request queued" in r.data
+
+    job = Job.query.one()
+    assert job.status == "done"
+    status = client.get(f"/jobs/{job.id}").get_json()
+    record = WeatherRecord.query.one()
+    assert status["result"] == {"record_id": record.id, "created": True}
+    assert record.latitude == 39.78
+    assert client.get("/jobs/999").status_code == 404
+
+def test_async_add_with_several_matches_asks_for_a_choice(app, client, monkeypatch):
+    monkeypatch.setattr(wa, "search_locations", lambda city, country, admin1=None, count=6: CANDIDATES)
+    post_async(app, client)
+
+    job = Job.query.one()
+    assert job.status == "ambiguous"
+    index = client.get("/")
+    assert b"choose a location" in index.data
+    choose = client.get(f"/jobs/{job.id}/choose")
+    assert choose.data.count(b'name="lat"') == 2
+    assert WeatherRecord.query.count() == 0
+
+def test_async_add_records_failures(app, client, monkeypatch):
+    def broken_fetch(**kwargs):
+        raise RuntimeError("upstream down")
+    monkeypatch.setattr(wa, "fetch_weather_for_date", broken_fetch)
+    monkeypatch.setattr(wa, "search_locations", lambda city, country, admin1=None, count=6: CANDIDATES[:1])
+    metrics.registry.reset()
+    post_async(app, client)
+
+    job = Job.query.one()
+    assert (job.status, job.error) == ("failed", "upstream down")
+    assert b"upstream down" in client.get("/").data
+    assert 'weather_jobs_total{kind="add",status="failed"} 1' in metrics.registry.render()
+
+def test_resume_reclaims_only_jobs_whose_lease_ran_out(app, monkeypatch):
+    monkeypatch.setattr(wa, "fetch_weather_for_date", fake_fetch)
+    payload = {"city": "Oslo", "country": "Norway", "requested_date": "2024-01-01",
+               "latitude": 59.91, "longitude": 10.75, "timezone": "Europe/Oslo"}
+    now = datetime.now(UTC)
+    stale, live = (Job(kind="add", status="running", city="Oslo", country="Norway", requested_date=date(2024, 1, 1),
+                       payload=json.dumps(payload), updated_at=now - age) for age in (timedelta(hours=1), timedelta(0)))
+    db.session.add_all([stale, live])
+    db.session.commit()
+
+    queue = jobs.get_queue(app)
+    assert queue.resume(now=now) == 1
+    queue.wait(timeout=10)
+    db.session.expire_all()
+    assert (db.session.get(Job, stale.id).status, db.session.get(Job, live.id).status) == ("done", "running")
+    assert WeatherRecord.query.one().city == "Oslo"
+    # Another process resuming the same table finds nothing left to reclaim
+    assert queue.resume(now=now) == 0
+
+def test_job_waits_out_an_open_circuit(app, client, monkeypatch):
+    attempts = []
+    def flaky_fetch(**kwargs):
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise wa.CircuitOpenError("forecast", 0.3)
+        return fake_fetch(**kwargs)
+    monkeypatch.setattr(wa, "fetch_weather_for_date", flaky_fetch)
+    post_async(app, client, lat="39.78", lon="-89.64", timezone="America/Chicago")
+    assert Job.query.one().status == "queued"  # deferred, not failed
+
+    deadline = time.monotonic() + 5
+    while Job.query.one().status != "done" and time.monotonic() < deadline:
+        time.sleep(0.02)
+        db.session.expire_all()
+    assert len(attempts) == 2 and WeatherRecord.query.count() == 1
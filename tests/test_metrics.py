@@ -0,0 +1,44 @@
+from datetime import date
+
+import metrics
+from tests.test_weather_api import make_requests_get_stub, use_stub
+
+def test_histogram_renders_cumulative_buckets():
+    registry = metrics.Registry()
+    registry.observe("weather_db_commit_seconds", 0.003)
+    registry.observe("weather_db_commit_seconds", 0.2)
+    registry.inc("weather_upstream_errors_total", endpoint="forecast", source="forecast")
+    text = registry.render()
+    assert '# TYPE weather_db_commit_seconds histogram' in text
+    assert 'weather_db_commit_seconds_bucket{le="0.005"} 1' in text
+    assert 'weather_db_commit_seconds_bucket{le="+Inf"} 2' in text
+    assert 'weather_db_commit_seconds_count 2' in text
+    assert 'weather_upstream_errors_total{endpoint="forecast",source="forecast"} 1' in text
+
+def test_disabled_registry_records_nothing():
+    registry = metrics.Registry(enabled=False)
+    with registry.span("weather_db_flush_seconds"):
+        pass
+    registry.inc("weather_upstream_errors_total")
+    assert registry.render() == "\n"
+
+def test_metrics_endpoint_reports_upstream_db_and_render(app, client, monkeypatch):
+    metrics.registry.reset()
+    calls = []
+    use_stub(monkeypatch, make_requests_get_stub(calls))
+    monkeypatch.setattr(metrics.registry, "server_timing", True)
+
+    r = client.post("/add", data={
+        "requested_date": date(2000, 1, 1).isoformat(), "country": "X", "city": "Y",
+        "lat": "1.0", "lon": "2.0", "timezone": "UTC",
+    })
+    assert "upstream-archive;dur=" in r.headers["Server-Timing"]
+    assert "db-commit;dur=" in r.headers["Server-Timing"]
+    client.get("/")
+
+    text = client.get("/metrics").data.decode()
+    assert 'weather_upstream_request_seconds_count{endpoint="archive",source="historical"} 1' in text
+    assert 'weather_upstream_rows_total{endpoint="archive",source="historical"} 1' in text
+    assert 'weather_template_render_seconds_count{template="index.html"} 1' in text
+    assert "weather_db_commit_seconds_count" in text
+    assert 'weather_cache_misses_total{cache="series"} 1' in text
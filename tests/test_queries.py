@@ -0,0 +1,44 @@
+from datetime import date
+
+import queries
+from models import db, WeatherRecord
+
+def seed(rows):
+    for i, (city, temp) in enumerate(rows):
+        db.session.add(WeatherRecord(city=city, country="X", requested_date=date(2024, 1, 1 + i % 3),
+                                     temp_max_c=temp, source="historical" if i % 2 else "forecast"))
+    db.session.commit()
+
+def walk(sort, direction, filters=None, per_page=2):
+    ids, cursor = [], None
+    while True:
+        records, cursor = queries.keyset_page(sort, direction, filters or {}, cursor=cursor, per_page=per_page)
+        ids.extend(r.id for r in records)
+        if cursor is None:
+            return ids
+
+def test_keyset_walk_matches_full_ordering_with_nulls(app):
+    seed([("A", 5.0), ("B", None), ("C", 5.0), ("D", -1.0), ("E", None), ("F", 9.5), ("G", 5.0)])
+    for sort in queries.SORTABLE:
+        for direction in ("asc", "desc"):
+            expected = [r.id for r in WeatherRecord.query.order_by(*queries.order_by(sort, direction)).all()]
+            assert walk(sort, direction) == expected, (sort, direction)
+            assert len(expected) == 7
+
+def test_keyset_nulls_sort_as_smallest(app):
+    seed([("A", 5.0), ("B", None), ("C", -1.0)])
+    records, _ = queries.keyset_page("temp_max_c", "asc", {}, per_page=10)
+    assert [r.city for r in records] == ["B", "C", "A"]
+
+def test_filters_narrow_results(app):
+    seed([("A", 1.0), ("B", 2.0), ("A", 3.0), ("A", 4.0)])
+    _, _, filters, _ = queries.parse_listing_args({
+        "city": "A", "source": "forecast", "date_from": "2024-01-01", "date_to": "bad-date",
+    })
+    assert filters == {"city": "A", "source": "forecast", "date_from": date(2024, 1, 1)}
+    assert len(walk("id", "asc", filters)) == 2  # rows 0 and 2 are forecast rows for city A
+
+def test_bad_cursor_falls_back_to_first_page(app):
+    seed([("A", 1.0), ("B", 2.0)])
+    records, _ = queries.keyset_page("city", "asc", {}, cursor="not-a-cursor")
+    assert [r.city for r in records] == ["A", "B"]
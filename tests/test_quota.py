@@ -0,0 +1,83 @@
+import threading
+import time
+import types
+
+import pytest
+
+import quota
+import weather_api as wa
+from quota import HIGH, LOW, QuotaExceededError, QuotaScheduler
+from tests.test_weather_api import FakeResponse
+
+def test_lanes_share_quota_and_refuse_hopeless_waits():
+    scheduler = QuotaScheduler({"forecast": (10, 0)}, reserve=0.2, high_max_wait=0.5, low_max_wait=0.05,
+                               reserve_idle=None)
+    for _ in range(8):  # low-priority work leaves 20% of the bucket for interactive calls
+        scheduler.acquire("forecast", LOW)
+    with pytest.raises(QuotaExceededError):
+        scheduler.acquire("forecast", LOW)
+    scheduler.acquire("forecast", HIGH)
+    scheduler.acquire("forecast", HIGH)
+    with pytest.raises(QuotaExceededError, match="forecast quota exhausted"):
+        scheduler.acquire("forecast", HIGH)  # the next token is 6s away
+    lanes = scheduler.stats()["forecast"]["lanes"]
+    assert (lanes[LOW]["acquired"], lanes[LOW]["rejected"], lanes[HIGH]["acquired"]) == (8, 1, 2)
+    assert scheduler.acquire("geocoding") == 0.0  # endpoints without limits are not scheduled
+
+def test_reserve_is_released_while_interactive_calls_are_idle():
+    now = [0.0]
+    scheduler = QuotaScheduler({"forecast": (0, 10)}, reserve=0.2, reserve_idle=300, clock=lambda: now[0])
+    scheduler.acquire("forecast", HIGH)
+    with quota.lane(LOW, max_wait=0):  # a bounded wait fails fast instead of blocking for hours
+        for _ in range(7):
+            scheduler.acquire("forecast")
+        with pytest.raises(QuotaExceededError):
+            scheduler.acquire("forecast")  # the last 2 tokens are kept for interactive calls
+        now[0] = 301.0
+        scheduler.acquire("forecast")
+        scheduler.acquire("forecast")
+    assert scheduler.stats()["forecast"]["lanes"][LOW]["acquired"] == 9
+
+def test_waiting_interactive_call_goes_before_batch_work():
+    scheduler = QuotaScheduler({"archive": (600, 0)}, reserve=0)  # one token every 0.1s
+    for _ in range(600):
+        scheduler.acquire("archive")
+    order = []
+    def call(lane_name):
+        with quota.lane(lane_name):
+            scheduler.acquire("archive")
+        order.append(lane_name)
+    threads = [threading.Thread(target=call, args=(LOW,)), threading.Thread(target=call, args=(HIGH,))]
+    threads[0].start()
+    time.sleep(0.02)
+    threads[1].start()
+    for thread in threads:
+        thread.join(5)
+    assert order == [HIGH, LOW]
+
+def test_http_client_takes_tokens_per_attempt_and_backs_off_on_429():
+    scheduler = QuotaScheduler({"forecast": (600, 10000)})
+    client = wa.HttpClient(sleep=lambda seconds: None, backoff=0.0, max_backoff=0.05, quota=scheduler)
+    responses = iter([FakeResponse({}, status_code=429, headers={"Retry-After": "1"}), FakeResponse({"ok": True})])
+    client._new_session = lambda: types.SimpleNamespace(get=lambda url, params=None, timeout=None: next(responses))
+
+    assert client.get("https://api.open-meteo.com/v1/forecast", endpoint="forecast").json() == {"ok": True}
+    stats = scheduler.stats()["forecast"]
+    assert stats["lanes"][HIGH]["acquired"] == 2
+    assert stats["lanes"][HIGH]["max_wait_seconds"] >= 0.04  # the 429 held the retry back
+    assert stats["tokens"][1] == pytest.approx(9998, abs=0.1)
+
+def test_batch_runs_in_low_lane_and_metrics_show_queue_depth(app, client, monkeypatch):
+    lanes = []
+    def fake_fetch(city, country, target_date, latitude=None, longitude=None, timezone=None):
+        lanes.append((quota.current_lane(), quota.current_max_wait()))
+        return {"temp_max_c": 1.0}
+    monkeypatch.setattr(wa, "fetch_weather_for_date", fake_fetch)
+    monkeypatch.setattr(wa, "http_client", wa.HttpClient(quota=QuotaScheduler({"forecast": (600, 0)})))
+    client.post("/batch", json={"tasks": [{"city": "A", "country": "Y", "date": "2020-01-01", "latitude": 1.0, "longitude": 2.0}]})
+    assert lanes == [(LOW, app.config["QUOTA_REQUEST_MAX_WAIT"])]  # bounded inside the request
+    assert (quota.current_lane(), quota.current_max_wait()) == (HIGH, None)
+
+    body = client.get("/metrics").get_data(as_text=True)
+    assert "# TYPE weather_quota_queue_depth gauge" in body
+    assert 'weather_quota_queue_depth{endpoint="forecast",lane="low"} 0' in body
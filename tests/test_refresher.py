@@ -0,0 +1,96 @@
+from datetime import date, timedelta
+
+import refresher
+import weather_api as wa
+from models import db, MonthlyRollup, WeatherRecord
+from storage import build_record
+from tests.test_weather_api import FakeResponse, use_stub
+
+TODAY = date(2024, 6, 30)
+OLD = [date(2024, 6, 1), date(2024, 6, 2), date(2024, 6, 3)]
+
+def archive_stub(calls, missing=()):
+    def _get(url, params=None, timeout=30, **kwargs):
+        calls.append(dict(params))
+        if "geocoding-api" in url:
+            return FakeResponse({"results": [{"name": "Bergen", "admin1": "", "country": "Norway",
+                                              "latitude": 60.39, "longitude": 5.32, "timezone": "Europe/Oslo"}]})
+        start, end = date.fromisoformat(params["start_date"]), date.fromisoformat(params["end_date"])
+        times = [(start + timedelta(days=n)).isoformat() for n in range((end - start).days + 1)]
+        results = []
+        for lat in params["latitude"].split(","):
+            value = None if float(lat) in missing else float(lat)
+            results.append({"daily": {"time": times, "temperature_2m_max": [value] * len(times),
+                                      "temperature_2m_min": [value] * len(times),
+                                      "precipitation_sum": [value] * len(times),
+                                      "wind_speed_10m_max": [value] * len(times)}})
+        return FakeResponse(results if len(results) > 1 else results[0])
+    return _get
+
+def add_forecast(city, day, lat=None, lon=None):
+    db.session.add(build_record(city, "Norway", day, {"temp_max_c": 99.0, "source": "forecast"}, lat, lon, "Europe/Oslo"))
+
+def test_refresh_upgrades_stale_forecasts_with_multi_location_calls(app, monkeypatch):
+    calls = []
+    use_stub(monkeypatch, archive_stub(calls))
+    for day in OLD:
+        add_forecast("Oslo", day, 59.91, 10.75)
+        add_forecast("Tromso", day, 69.65, 18.96)
+    add_forecast("Oslo", TODAY - timedelta(days=3), 59.91, 10.75)  # still inside the archive delay
+    db.session.commit()
+
+    report = refresher.refresh_stale(today=TODAY)
+    assert (report.rows, report.updated, report.locations, report.fetch_groups) == (6, 6, 2, 1)
+    assert len(calls) == 1
+    assert calls[0]["latitude"] == "59.91,69.65"
+
+    db.session.expire_all()
+    tromso = WeatherRecord.query.filter_by(city="Tromso").all()
+    assert {(r.source, r.temp_max_c) for r in tromso} == {("historical", 69.65)}
+    assert WeatherRecord.query.filter_by(source="forecast").count() == 1
+    rollup = MonthlyRollup.query.filter_by(city="Tromso").one()
+    assert rollup.temp_max_peak == 69.65
+
+    assert refresher.refresh_stale(today=TODAY).rows == 0
+
+def test_refresh_geocodes_rows_without_coordinates_and_keeps_unarchived_days(app, monkeypatch):
+    calls = []
+    use_stub(monkeypatch, archive_stub(calls, missing={60.39}))
+    add_forecast("Bergen", OLD[0])
+    db.session.commit()
+
+    report = refresher.refresh_stale(today=TODAY)
+    assert (report.updated, report.not_archived, report.failures) == (0, 1, [])
+    db.session.expire_all()
+    assert WeatherRecord.query.one().source == "forecast"
+
+def test_refresh_cli_and_scheduler(app, monkeypatch):
+    calls = []
+    use_stub(monkeypatch, archive_stub(calls))
+    add_forecast("Oslo", date.today() - timedelta(days=30), 59.91, 10.75)
+    db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=["refresh-forecasts"])
+    assert "1 stale forecast rows, 1 updated to historical (0 merged" in result.output
+
+    add_forecast("Oslo", date.today() - timedelta(days=31), 59.91, 10.75)
+    db.session.commit()
+    report = refresher.RefreshScheduler(app, interval=3600).run_once()
+    assert report.updated == 1
+
+def test_refresh_merges_a_geocoded_row_into_the_located_row_for_its_day(app, monkeypatch):
+    use_stub(monkeypatch, archive_stub([]))
+    add_forecast("Bergen", OLD[0])  # stored before coordinates were kept
+    db.session.add(build_record("Bergen", "Norway", OLD[0], {"temp_max_c": 1.0, "source": "historical"},
+                                60.39, 5.32, "Europe/Oslo"))
+    add_forecast("Bergen", OLD[1])
+    add_forecast("Bergen", OLD[1])  # two unlocated rows for one day would collide once both are geocoded
+    db.session.commit()
+
+    report = refresher.refresh_stale(today=TODAY)
+    assert (report.rows, report.updated, report.merged) == (3, 3, 2)
+    db.session.expire_all()
+    rows = WeatherRecord.query.order_by(WeatherRecord.requested_date).all()
+    assert [(r.requested_date, r.latitude, r.source, r.temp_max_c) for r in rows] == [
+        (OLD[0], 60.39, "historical", 60.39), (OLD[1], 60.39, "historical", 60.39)]
+    assert MonthlyRollup.query.filter_by(city="Bergen").one().row_count == 2
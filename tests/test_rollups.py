@@ -0,0 +1,73 @@
+from datetime import date
+
+import rollups
+from models import db, WeatherRecord, MonthlyRollup
+
+def add(city, day, tmax, tmin, precip=1.0, wind=10.0):
+    record = WeatherRecord(city=city, country="X", requested_date=day, temp_max_c=tmax,
+                           temp_min_c=tmin, precip_mm=precip, wind_max_kmh=wind, source="historical")
+    db.session.add(record)
+    return record
+
+def snapshot():
+    return {
+        (r.city, r.year, r.month): {k: getattr(r, k) for k in rollups.EMPTY}
+        for r in MonthlyRollup.query.all()
+    }
+
+def test_rollups_follow_inserts_deletes_and_edits(app):
+    add("Oslo", date(2024, 1, 1), 5.0, -5.0, precip=2.0, wind=30.0)
+    add("Oslo", date(2024, 1, 2), 7.0, None, precip=None)
+    hottest = add("Oslo", date(2024, 1, 3), 9.0, -9.0)
+    add("Oslo", date(2024, 2, 1), 1.0, 0.0)
+    db.session.commit()
+
+    jan = MonthlyRollup.query.filter_by(city="Oslo", month=1).one()
+    summary = rollups.summarize(jan)
+    assert summary["days"] == 3
+    assert summary["mean_temp_max_c"] == 7.0
+    assert summary["max_temp_c"] == 9.0 and summary["min_temp_c"] == -9.0
+    assert summary["total_precip_mm"] == 3.0
+    assert summary["peak_wind_kmh"] == 30.0
+
+    db.session.delete(hottest)
+    db.session.commit()
+    jan = MonthlyRollup.query.filter_by(city="Oslo", month=1).one()
+    assert jan.row_count == 2 and jan.temp_max_peak == 7.0 and jan.temp_min_low == -5.0
+
+    record = WeatherRecord.query.filter_by(requested_date=date(2024, 2, 1)).one()
+    record.requested_date = date(2024, 1, 20)
+    db.session.commit()
+    assert MonthlyRollup.query.filter_by(city="Oslo", month=2).count() == 0
+    assert MonthlyRollup.query.filter_by(city="Oslo", month=1).one().row_count == 3
+
+    incremental = snapshot()
+    rollups.rebuild(db.session.connection())
+    db.session.commit()
+    assert snapshot() == incremental
+
+def test_stats_endpoint_and_rebuild_command(app, client):
+    add("Oslo", date(2024, 1, 1), 5.0, -5.0)
+    add("Bergen", date(2024, 1, 1), 8.0, 2.0)
+    db.session.commit()
+
+    data = client.get("/stats?city=Bergen").get_json()
+    assert len(data) == 1
+    assert data[0]["mean_temp_c"] == 5.0 and data[0]["year"] == 2024
+
+    MonthlyRollup.query.delete()
+    db.session.commit()
+    result = app.test_cli_runner().invoke(args=["rebuild-rollups"])
+    assert "Rebuilt 2 monthly rollups" in result.output
+    assert len(client.get("/stats").get_json()) == 2
+
+def test_apply_inserts_merges_into_an_existing_group_in_sql(app):
+    connection = db.session.connection()
+    row = {"city": "Oslo", "country": "X", "requested_date": date(2024, 1, 1)}
+    rollups.apply_inserts(connection, [{**row, "temp_max_c": 5.0, "temp_min_c": None, "precip_mm": 1.0, "wind_max_kmh": None}])
+    # A second writer hitting the same (city, country, year, month) merges instead of failing on the unique key
+    rollups.apply_inserts(connection, [{**row, "temp_max_c": 7.0, "temp_min_c": -3.0, "precip_mm": None, "wind_max_kmh": 12.0}])
+    db.session.commit()
+    group = MonthlyRollup.query.one()
+    assert (group.row_count, group.temp_max_sum, group.temp_max_peak) == (2, 12.0, 7.0)
+    assert (group.temp_min_count, group.temp_min_low, group.precip_count, group.wind_max_peak) == (1, -3.0, 1, 12.0)
@@ -0,0 +1,72 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import pytest
+
+import weather_api as wa
+from singleflight import SingleFlight
+from tests.test_weather_api import make_requests_get_stub, use_stub
+
+def run_concurrently(n, fn):
+    with ThreadPoolExecutor(max_workers=n) as pool:
+        futures = [pool.submit(fn) for _ in range(n)]
+        return [future.exception() or future.result() for future in futures]
+
+# Polls `condition` until it holds or `timeout` seconds pass; returns whether it held.
+def wait_until(condition, timeout=5.0):
+    deadline, tick = time.monotonic() + timeout, threading.Event()
+    while not condition():
+        if time.monotonic() >= deadline:
+            return False
+        tick.wait(timeout=0.001)
+    return True
+
+# Holds the leader inside fn until every other caller has joined the in-flight call.
+def gated(flight, waiters, fn):
+    def wrapped():
+        assert wait_until(lambda: flight.coalesced >= waiters), "callers never joined the in-flight call"
+        return fn()
+    return wrapped
+
+def test_concurrent_callers_share_one_call_and_its_error():
+    flight = SingleFlight()
+    calls = []
+    def work():
+        calls.append(1)
+        return {"value": 42}
+    results = run_concurrently(5, lambda: flight.do("k", gated(flight, 4, work)))
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+    assert all(result == {"value": 42} for result, _ in results)
+
+    def fail():
+        raise RuntimeError("boom")
+    errors = run_concurrently(3, lambda: flight.do("k", gated(flight, 6, fail)))
+    assert [str(error) for error in errors] == ["boom"] * 3
+    assert flight.stats() == {"leaders": 2, "coalesced": 6, "in_flight": 0}
+
+    with pytest.raises(RuntimeError):
+        flight.do("k", fail)
+    assert flight.do("k", lambda: 1) == (1, False)
+
+def test_fetch_and_search_coalesce_identical_upstream_calls(monkeypatch):
+    calls = []
+    stub = make_requests_get_stub(calls)
+    def slow_get(url, params=None, **kwargs):
+        flight = wa.geocode_flight if "geocoding-api" in url else wa.weather_flight
+        assert wait_until(lambda: flight.coalesced >= 3), "callers never joined the in-flight call"
+        return stub(url, params=params, **kwargs)
+    use_stub(monkeypatch, slow_get)
+
+    old = date.today() - timedelta(days=40)
+    days = run_concurrently(4, lambda: wa.fetch_weather_for_date("X", "Y", old, latitude=1.0, longitude=2.0, timezone="UTC"))
+    assert len(calls) == 1
+    assert all(day == days[0] for day in days)
+    assert len({id(day) for day in days}) == 4  # waiters get their own copies
+
+    found = run_concurrently(4, lambda: wa.search_locations("Springfield", "United States"))
+    assert len(calls) == 2
+    assert all(len(candidates) == 2 for candidates in found)
+    assert wa.weather_flight.stats()["coalesced"] == 3
@@ -0,0 +1,97 @@
+from datetime import date
+
+import numpy as np
+from sqlalchemy import inspect
+
+import snapshot
+import versions
+from models import db, MonthlyRollup, WeatherRecord
+
+def seed():
+    db.session.add_all([
+        WeatherRecord(city="São Paulo", country="Brazil", requested_date=date(2024, 1, 1), temp_max_c=30.5,
+                      temp_min_c=20.0, source="historical", latitude=-23.55, longitude=-46.63, timezone="UTC"),
+        WeatherRecord(city="Oslo", country="Norway", requested_date=date(2024, 1, 2), temp_max_c=None,
+                      temp_min_c=-4.0, source="forecast"),
+        WeatherRecord(city="Oslo", country="Norway", requested_date=date(2024, 2, 1), temp_max_c=1.5,
+                      source="historical"),
+    ])
+    db.session.commit()
+
+def dump():
+    columns = [c.name for c in WeatherRecord.__table__.columns]
+    return [tuple(getattr(r, name) for name in columns)
+            for r in WeatherRecord.query.order_by(WeatherRecord.id)]
+
+def test_snapshot_round_trip_keeps_rows_and_rebuilds_indexes(app, tmp_path):
+    seed()
+    before = dump()
+    directory = str(tmp_path / "snap")
+    assert snapshot.export_snapshot(directory, chunk_rows=2) == 3
+
+    manifest, arrays, dictionaries = snapshot.read_snapshot(directory)
+    assert manifest["rows"] == 3 and isinstance(arrays["temp_max_c"], np.memmap)
+    assert dictionaries["city"] == ["São Paulo", "Oslo"] and arrays["city"].tolist() == [0, 1, 1]
+
+    indexes = {i["name"] for i in inspect(db.engine).get_indexes("weather_records")}
+    version = versions.current()
+    report = snapshot.load_snapshot(directory, replace=True)
+    assert (report.inserted, report.skipped, report.rollups) == (3, 0, 3)
+    assert report.deferred_indexes == len(indexes) > 0
+    assert {i["name"] for i in inspect(db.engine).get_indexes("weather_records")} == indexes
+    db.session.expire_all()
+    assert dump() == before
+    assert versions.current() == version + 1
+    assert db.session.query(MonthlyRollup).count() == 3
+
+    # Appending the same snapshot skips every stored row
+    report = snapshot.load_snapshot(directory)
+    assert (report.inserted, report.skipped, report.deferred_indexes) == (0, 3, 0)
+    assert WeatherRecord.query.count() == 3
+
+def test_load_records_cli_reads_exports_and_snapshots(app, client, tmp_path):
+    seed()
+    csv_path = tmp_path / "records.csv"
+    csv_path.write_bytes(client.get("/export.csv").data)
+    WeatherRecord.query.filter_by(city="Oslo").delete()
+    db.session.commit()
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["load-records", str(csv_path)])
+    assert result.exit_code == 0, result.output
+    assert "2 rows loaded, 1 already stored" in result.output
+    oslo = WeatherRecord.query.filter_by(city="Oslo").order_by(WeatherRecord.requested_date).all()
+    assert [(r.requested_date, r.temp_max_c, r.temp_min_c) for r in oslo] == [
+        (date(2024, 1, 2), None, -4.0), (date(2024, 2, 1), 1.5, None)]
+    assert oslo[0].created_at is not None
+
+    result = runner.invoke(args=["export-snapshot", str(tmp_path / "snap")])
+    assert "Exported 3 rows" in result.output
+    result = runner.invoke(args=["load-records", str(tmp_path / "snap"), "--replace", "--batch-size", "2"])
+    assert result.exit_code == 0, result.output
+    assert "3 rows loaded, 0 already stored" in result.output
+    assert WeatherRecord.query.count() == 3
+
+def test_bulk_load_keys_days_by_location_and_keeps_the_last_copy(app):
+    seed()
+    day = date(2024, 1, 1).isoformat()
+    columns = {
+        "city": ["São Paulo", "São Paulo", "Oslo", "Oslo"],
+        "country": ["Brazil", "Brazil", "Norway", "Norway"],
+        "requested_date": [day, day, day, day],
+        "latitude": [-23.55, -22.0, 59.91, 59.91],
+        "longitude": [-46.63, -47.0, 10.75, 10.75],
+        "temp_max_c": [1.0, 2.0, 3.0, 4.0],
+        "source": ["historical"] * 4,
+        "created_at": ["2024-01-02 00:00:00.000000"] * 4,
+    }
+    report = snapshot.bulk_load(columns)
+    assert (report.inserted, report.skipped, report.duplicates) == (2, 1, 1)
+    rows = WeatherRecord.query.filter_by(requested_date=date(2024, 1, 1)).all()
+    assert sorted((r.city, r.latitude, r.temp_max_c) for r in rows) == [
+        ("Oslo", 59.91, 4.0), ("São Paulo", -23.55, 30.5), ("São Paulo", -22.0, 2.0)]
+
+def test_id_sequence_reset_targets_the_largest_loaded_id():
+    from sqlalchemy.dialects import postgresql
+    sql = str(snapshot._advance_id_sequence().compile(dialect=postgresql.dialect()))
+    assert "setval(pg_get_serial_sequence(" in sql and "max(weather_records.id)" in sql
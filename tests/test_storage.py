@@ -0,0 +1,81 @@
+from datetime import date, datetime, UTC
+
+import pytest
+from sqlalchemy import inspect, insert, text
+from sqlalchemy.exc import IntegrityError
+
+import autocomplete
+import storage
+from models import db, MonthlyRollup, WeatherRecord
+
+DAY = date(2024, 1, 1)
+ILLINOIS = {"lat": "39.78", "lon": "-89.64", "timezone": "America/Chicago"}
+MISSOURI = {"lat": "37.2", "lon": "-93.29", "timezone": "America/Chicago"}
+
+def test_same_named_places_are_stored_and_found_separately(app, client, monkeypatch):
+    import weather_api as wa
+    monkeypatch.setattr(wa, "fetch_weather_for_date", lambda **kw: {"temp_max_c": kw["latitude"], "source": "historical"})
+    form = {"requested_date": DAY.isoformat(), "city": "Springfield", "country": "United States"}
+
+    assert b"Record added" in client.post("/add", data={**form, **ILLINOIS}, follow_redirects=True).data
+    assert b"Record added" in client.post("/add", data={**form, **MISSOURI}, follow_redirects=True).data
+    assert b"Record already stored" in client.post("/add", data={**form, **MISSOURI}, follow_redirects=True).data
+    assert sorted(r.temp_max_c for r in WeatherRecord.query) == [37.2, 39.78]
+
+    assert storage.find_stored("Springfield", "United States", DAY, 37.2, -93.29).temp_max_c == 37.2
+    assert storage.find_stored("Springfield", "United States", DAY) is None  # ambiguous without coordinates
+    with pytest.raises(IntegrityError):
+        db.session.add(storage.build_record("Springfield", "United States", DAY, {"source": "historical"},
+                                            37.2, -93.29, "America/Chicago"))
+        db.session.commit()
+    db.session.rollback()
+
+def test_upsert_refreshes_a_row_another_writer_inserted_first(app, monkeypatch):
+    upsert_insert = storage.upsert_insert
+    def racing_insert(connection, table):
+        # A second writer commits the same day between the lookup and the insert
+        with db.engine.begin() as other:
+            other.execute(insert(table).values(city="Oslo", country="Norway", requested_date=DAY, latitude=59.91,
+                                               longitude=10.75, source="forecast", temp_max_c=1.0,
+                                               created_at=datetime.now(UTC)))
+        return upsert_insert(connection, table)
+    monkeypatch.setattr(storage, "upsert_insert", racing_insert)
+
+    storage.upsert_days("Oslo", "Norway", [{"date": DAY, "temp_max_c": 2.0, "source": "historical"}],
+                        59.91, 10.75, "Europe/Oslo")
+    record = WeatherRecord.query.one()
+    assert (record.temp_max_c, record.source, record.timezone) == (2.0, "historical", "Europe/Oslo")
+    assert MonthlyRollup.query.one().row_count == 1
+
+def test_rows_without_coordinates_are_adopted_by_the_first_located_write(app):
+    db.session.add(WeatherRecord(city="Oslo", country="Norway", requested_date=DAY, source="forecast"))
+    db.session.commit()
+
+    record, created = storage.upsert_record("Oslo", "Norway", DAY, {"temp_max_c": 3.0, "source": "historical"},
+                                            59.91, 10.75, "Europe/Oslo")
+    assert not created and WeatherRecord.query.count() == 1
+    assert (record.latitude, record.temp_max_c, record.geo_cell) == (59.91, 3.0, storage.cell_for(59.91, 10.75))
+    assert autocomplete.index.search("oslo")[0]["latitude"] == 59.91  # on_write listeners saw the Core write
+
+def test_upgrade_schema_keeps_duplicates_and_dedupe_records_removes_them(app, caplog):
+    db.session.execute(text("DROP INDEX uq_weather_records_location_day"))
+    for temp in (1.0, 2.0):
+        db.session.add(WeatherRecord(city="Oslo", country="Norway", requested_date=DAY, source="historical",
+                                     latitude=59.91, longitude=10.75, temp_max_c=temp))
+    db.session.add(WeatherRecord(city="Oslo", country="Norway", requested_date=DAY, source="historical"))
+    db.session.commit()
+    db.session.remove()
+
+    def unique_index():
+        return "uq_weather_records_location_day" in {i["name"] for i in inspect(db.engine).get_indexes("weather_records")}
+
+    storage.upgrade_schema(db.engine)
+    assert not unique_index() and WeatherRecord.query.count() == 3
+    assert "dedupe-records" in caplog.text and "59.91" in caplog.text
+    db.session.remove()
+
+    result = app.test_cli_runner().invoke(args=["dedupe-records"])
+    assert "Removed 1 duplicate rows." in result.output and "'id': 1" in result.output
+    assert unique_index()
+    assert {(r.latitude, r.temp_max_c) for r in WeatherRecord.query} == {(None, None), (59.91, 2.0)}
+    assert MonthlyRollup.query.one().row_count == 2
@@ -1,13 +1,16 @@
 import types
 from datetime import date, timedelta
 
+import pytest
+
 import weather_api as wa
 
 class FakeResponse:
-    def __init__(self, json_data, status_code=200, captured=None):
+    def __init__(self, json_data, status_code=200, captured=None, headers=None):
         self._json = json_data
         self.status_code = status_code
         self.captured = captured or {}
+        self.headers = headers or {}
 
     def json(self):
         return self._json
@@ -16,6 +19,10 @@ class FakeResponse:
         if self.status_code >= 400:
             raise Exception(f"HTTP {self.status_code}")
 
+# Routes the shared HTTP client's per-host sessions to a stub `get` function.
+def use_stub(monkeypatch, get):
+    monkeypatch.setattr(wa.http_client, "_new_session", lambda: types.SimpleNamespace(get=get))
+
 def make_requests_get_stub(store):
     def _get(url, params=None, timeout=30, **kwargs):
         params = params or {}
@@ -30,7 +37,7 @@ def make_requests_get_stub(store):
             return FakeResponse(data, captured={"url": url, "params": params})
         elif "forecast" in url:
             past_days = int(params.get("past_days", 0) or 0)
-            days = 7 + past_days
+            days = int(params.get("forecast_days", 7)) + past_days
             start = date.today() - timedelta(days=past_days)
             times = [(start + timedelta(d)).isoformat() for d in range(days)]
             daily = {
@@ -57,23 +64,31 @@ def make_requests_get_stub(store):
 
 def test_search_locations_filters_by_region(monkeypatch):
     calls = []
-    monkeypatch.setattr(wa, "requests", types.SimpleNamespace(get=make_requests_get_stub(calls)))
+    use_stub(monkeypatch, make_requests_get_stub(calls))
     results = wa.search_locations("Springfield", "United States", admin1="Illinois")
     assert any(r["admin1"] == "Illinois" for r in results)
     assert all("Springfield" in r["name"] for r in results)
 
 def test_fetch_future_uses_forecast(monkeypatch):
     calls = []
-    monkeypatch.setattr(wa, "requests", types.SimpleNamespace(get=make_requests_get_stub(calls)))
+    use_stub(monkeypatch, make_requests_get_stub(calls))
     future = date.today() + timedelta(days=2)
     out = wa.fetch_weather_for_date("X", "Y", future, latitude=1.0, longitude=2.0, timezone="UTC")
     assert any("forecast" in c["url"] for c in calls)
     assert out["source"] == "forecast"
     assert out["temp_max_c"] == 25.0
 
+def test_fetch_beyond_default_week_requests_more_forecast_days(monkeypatch):
+    calls = []
+    use_stub(monkeypatch, make_requests_get_stub(calls))
+    for offset in (10, wa.MAX_FORECAST_DAYS - 1):
+        out = wa.fetch_weather_for_date("X", "Y", date.today() + timedelta(days=offset), latitude=1.0, longitude=2.0)
+        assert out["source"] == "forecast" and out["temp_max_c"] == 25.0
+        assert int(calls[-1]["params"]["forecast_days"]) == offset + 1
+
 def test_fetch_recent_past_uses_forecast_with_past_days(monkeypatch):
     calls = []
-    monkeypatch.setattr(wa, "requests", types.SimpleNamespace(get=make_requests_get_stub(calls)))
+    use_stub(monkeypatch, make_requests_get_stub(calls))
     recent = date.today() - timedelta(days=2)
     out = wa.fetch_weather_for_date("X", "Y", recent, latitude=1.0, longitude=2.0, timezone="UTC")
     matched = [c for c in calls if "forecast" in c["url"]]
@@ -83,9 +98,161 @@ def test_fetch_recent_past_uses_forecast_with_past_days(monkeypatch):
 
 def test_fetch_old_past_uses_archive(monkeypatch):
     calls = []
-    monkeypatch.setattr(wa, "requests", types.SimpleNamespace(get=make_requests_get_stub(calls)))
+    use_stub(monkeypatch, make_requests_get_stub(calls))
     old = date(2000, 1, 1)
     out = wa.fetch_weather_for_date("X", "Y", old, latitude=1.0, longitude=2.0, timezone="UTC")
     assert any("archive-api" in c["url"] for c in calls)
     assert out["source"] == "historical"
     assert out["precip_mm"] == 5.0
+
+def test_search_locations_repeat_lookup_uses_cache(monkeypatch):
+    calls = []
+    use_stub(monkeypatch, make_requests_get_stub(calls))
+    first = wa.search_locations("Springfield", "United States")
+    first[0]["name"] = "mutated"
+    second = wa.search_locations("  springfield ", "UNITED STATES")
+    assert len(calls) == 1
+    assert second[0]["name"] == "Springfield"
+    assert wa.geocode_cache.stats()["hits"] == 1
+
+def test_search_locations_caches_empty_results(monkeypatch):
+    calls = []
+    def empty_get(url, params=None, timeout=30, **kwargs):
+        calls.append(params)
+        return FakeResponse({"results": []})
+    use_stub(monkeypatch, empty_get)
+    assert wa.search_locations("Nowhere", "Atlantis") == []
+    assert wa.search_locations("Nowhere", "Atlantis") == []
+    assert len(calls) == 2  # name query + fallback, once
+
+def test_fetch_next_day_served_from_series_cache(monkeypatch):
+    calls = []
+    use_stub(monkeypatch, make_requests_get_stub(calls))
+    today = date.today()
+    first = wa.fetch_weather_for_date("X", "Y", today, latitude=1.0, longitude=2.0, timezone="UTC")
+    second = wa.fetch_weather_for_date("X", "Y", today + timedelta(days=1), latitude=1.0, longitude=2.0, timezone="UTC")
+    assert len(calls) == 1
+    assert second["temp_max_c"] == first["temp_max_c"] == 25.0
+    assert second["source"] == "forecast"
+    assert wa.series_cache.stats()["hits"] == 1
+
+def test_series_cache_keys_on_rounded_coordinates_timezone_and_source(monkeypatch):
+    from cache import MISS
+    calls = []
+    use_stub(monkeypatch, make_requests_get_stub(calls))
+    old = date(2000, 1, 1)
+    wa.fetch_weather_for_date("X", "Y", old, latitude=1.0, longitude=2.0, timezone="UTC")
+    wa.fetch_weather_for_date("X", "Y", old, latitude=1.00001, longitude=2.0, timezone="UTC")
+    wa.fetch_weather_for_date("X", "Y", old, latitude=1.0, longitude=2.0, timezone="Europe/Paris")
+    assert len(calls) == 2
+    # An archive day is never served from, or as, a forecast entry for the same place and date
+    assert wa.series_cache.get(1.0, 2.0, "UTC", "historical", old) is not MISS
+    assert wa.series_cache.get(1.0, 2.0, "UTC", "forecast", old) is MISS
+
+def test_fetch_range_splits_archive_and_forecast(monkeypatch):
+    calls = []
+    use_stub(monkeypatch, make_requests_get_stub(calls))
+    today = date.today()
+    start = today - timedelta(days=10)
+    end = today + timedelta(days=2)
+    out = wa.fetch_weather_for_range(1.0, 2.0, "UTC", start, end)
+
+    archive = [c for c in calls if "archive-api" in c["url"]]
+    forecast = [c for c in calls if "forecast" in c["url"]]
+    assert len(archive) == 1 and len(forecast) == 1
+    assert archive[0]["params"]["start_date"] == start.isoformat()
+    assert archive[0]["params"]["end_date"] == (today - timedelta(days=8)).isoformat()
+    assert forecast[0]["params"]["past_days"] == 7
+    assert [d["date"] for d in out["days"]][-1] == end
+    assert {d["source"] for d in out["days"]} == {"historical", "forecast"}
+
+    wa.fetch_weather_for_range(1.0, 2.0, "UTC", today, end)
+    assert len(calls) == 2  # already covered by the cached forecast response
+
+def test_http_client_retries_transient_errors_with_backoff(monkeypatch):
+    statuses = [503, 429, 200]
+    sleeps = []
+    def flaky_get(url, params=None, timeout=None, **kwargs):
+        return FakeResponse({"ok": True}, status_code=statuses.pop(0), headers={"Retry-After": "1"})
+    client = wa.HttpClient(retries=3, backoff=0.5, sleep=sleeps.append)
+    monkeypatch.setattr(client, "_new_session", lambda: types.SimpleNamespace(get=flaky_get))
+
+    response = client.get("https://api.example.test/v1/forecast")
+    assert response.status_code == 200
+    assert len(sleeps) == 2
+    assert all(1.0 <= s <= client.max_backoff for s in sleeps)
+
+def test_http_client_gives_up_after_retries(monkeypatch):
+    attempts = []
+    def failing_get(url, params=None, timeout=None, **kwargs):
+        attempts.append(timeout)
+        raise wa.requests.ConnectionError("refused")
+    client = wa.HttpClient(retries=2, connect_timeout=2, read_timeout=7, sleep=lambda s: None)
+    monkeypatch.setattr(client, "_new_session", lambda: types.SimpleNamespace(get=failing_get))
+    with pytest.raises(wa.requests.ConnectionError):
+        client.get("https://api.example.test/v1/forecast")
+    assert attempts == [(2, 7)] * 3
+
+def test_http_client_reuses_one_session_per_host(monkeypatch):
+    created = []
+    def new_session():
+        created.append(1)
+        return types.SimpleNamespace(get=lambda url, params=None, timeout=None: FakeResponse({}))
+    client = wa.HttpClient()
+    monkeypatch.setattr(client, "_new_session", new_session)
+    client.get("https://a.example.test/x")
+    client.get("https://a.example.test/y")
+    client.get("https://b.example.test/x")
+    assert len(created) == 2
+
+def test_fetch_many_runs_tasks_concurrently_in_input_order(monkeypatch):
+    import threading
+    import time
+    active, peak, lock = [0], [0], threading.Lock()
+    calls = []
+    stub = make_requests_get_stub(calls)
+    def slow_get(url, params=None, **kwargs):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.05)
+        with lock:
+            active[0] -= 1
+        return stub(url, params=params, **kwargs)
+    use_stub(monkeypatch, slow_get)
+
+    old = date.today() - timedelta(days=60)
+    tasks = [{"city": "X", "country": "Y", "date": (old - timedelta(days=n)).isoformat(),
+              "latitude": float(n), "longitude": 2.0, "timezone": "UTC"} for n in range(12)]
+    tasks.append({"city": "X", "country": "Y", "date": "not-a-date", "latitude": 1.0, "longitude": 2.0})
+    started = time.perf_counter()
+    results = wa.fetch_many(tasks, max_concurrency=16, per_host=4)
+    elapsed = time.perf_counter() - started
+
+    assert [r["ok"] for r in results] == [True] * 12 + [False]
+    assert [r["weather"]["geo"]["latitude"] for r in results[:12]] == [float(n) for n in range(12)]
+    assert "does not match format" in results[-1]["error"]
+    assert peak[0] == 4  # per-host limit
+    assert elapsed < 12 * 0.05
+
+def test_circuit_breaker_opens_fails_fast_and_recovers():
+    now = [0.0]
+    breaker = wa.CircuitBreaker("forecast", failure_threshold=2, latency_budget=1.0, reset_timeout=30, clock=lambda: now[0])
+    statuses = iter([500, 500, 200])
+    client = wa.HttpClient(sleep=lambda s: None, retries=0, breakers={"forecast": breaker})
+    client._new_session = lambda: types.SimpleNamespace(
+        get=lambda url, params=None, timeout=None: FakeResponse({}, status_code=next(statuses)))
+
+    for _ in range(2):
+        assert client.get("https://api.open-meteo.com/v1/forecast", endpoint="forecast").status_code == 500
+    assert breaker.state == "open"
+    with pytest.raises(wa.CircuitOpenError) as excinfo:
+        client.get("https://api.open-meteo.com/v1/forecast", endpoint="forecast")
+    assert excinfo.value.retry_after == 30 and breaker.rejected == 1
+
+    now[0] = 31.0  # half-open: one trial call goes through and closes the circuit
+    assert client.get("https://api.open-meteo.com/v1/forecast", endpoint="forecast").status_code == 200
+    assert (breaker.state, breaker.failures, breaker.opens) == ("closed", 0, 1)
+
+    breaker.record(elapsed=5.0, ok=True)  # over the latency budget counts as a failure
+    assert breaker.failures == 1
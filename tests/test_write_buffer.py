@@ -0,0 +1,87 @@
+import threading
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import text
+
+import weather_api as wa
+from app import create_app
+from models import db, WeatherRecord
+
+def make_app(tmp_path, monkeypatch, **env):
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'prod.db'}")
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    app = create_app()
+    app.config.update(TESTING=True)
+    return app
+
+def test_production_mode_applies_sqlite_pragmas(tmp_path, monkeypatch):
+    app = make_app(tmp_path, monkeypatch, SQLITE_MODE="production", SQLITE_BUSY_TIMEOUT_MS="1234")
+    with app.app_context():
+        pragma = lambda name: db.session.execute(text(f"PRAGMA {name}")).scalar()
+        assert pragma("journal_mode") == "wal"
+        assert pragma("synchronous") == 1  # NORMAL
+        assert pragma("busy_timeout") == 1234
+        assert db.engine.pool.size() == 5
+
+def test_write_behind_groups_adds_into_one_commit(tmp_path, monkeypatch):
+    app = make_app(tmp_path, monkeypatch, WRITE_BEHIND_ROWS="3", WRITE_BEHIND_DELAY_MS="60000")
+    buffer = app.extensions["write_buffer"]
+    monkeypatch.setattr(wa, "fetch_weather_for_date", lambda **kw: {"temp_max_c": 1.0, "source": "historical"})
+    client = app.test_client()
+    form = {"country": "Norway", "city": "Oslo", "lat": "59.91", "lon": "10.75", "timezone": "Europe/Oslo"}
+    first = date(2020, 1, 1)
+
+    r = client.post("/add", data={**form, "requested_date": first.isoformat()}, follow_redirects=True)
+    assert b"Record saved" in r.data
+    r = client.post("/add", data={**form, "requested_date": first.isoformat()}, follow_redirects=True)
+    assert b"Record already stored" in r.data  # buffered rows count as stored
+    client.post("/add", data={**form, "requested_date": (first + timedelta(days=1)).isoformat()})
+    with app.app_context():
+        assert WeatherRecord.query.count() == 0
+
+    client.post("/add", data={**form, "requested_date": (first + timedelta(days=2)).isoformat()})
+    deadline = time.monotonic() + 5
+    while buffer.flushes == 0 and time.monotonic() < deadline:  # the size trigger wakes the flusher
+        time.sleep(0.01)
+    with app.app_context():
+        assert WeatherRecord.query.count() == 3
+        assert WeatherRecord.query.first().latitude == 59.91
+    assert (buffer.flushes, buffer.rows_written, len(buffer)) == (1, 3, 0)
+    buffer.close()
+
+def test_failed_flush_retries_rows_one_by_one_and_drops_a_poison_row(app, monkeypatch):
+    import write_buffer
+    upsert_days = write_buffer.upsert_days
+    def failing_upsert(city, *args, **kwargs):
+        if city == "Poison":
+            raise ValueError("bad row")
+        return upsert_days(city, *args, **kwargs)
+    monkeypatch.setattr(write_buffer, "upsert_days", failing_upsert)
+    buffer = write_buffer.WriteBuffer(app, max_rows=100, max_delay=60, max_attempts=2)
+    daily = {"temp_max_c": 1.0, "source": "historical"}
+    buffer.add("Oslo", "Norway", date(2020, 1, 1), daily, 59.91, 10.75, "Europe/Oslo")
+    buffer.add("Poison", "Norway", date(2020, 1, 1), daily, 1.0, 1.0, "UTC")
+
+    assert buffer.flush() == 1  # the good row is committed despite the failed batch
+    assert [r.city for r in WeatherRecord.query] == ["Oslo"] and len(buffer) == 1
+    assert buffer.flush() == 0
+    assert (len(buffer), buffer.dropped, buffer.failures) == (0, 1, 2)
+    buffer.close()
+
+def test_add_blocks_while_the_buffer_is_full(app):
+    from write_buffer import WriteBuffer
+    buffer = WriteBuffer(app, max_rows=100, max_delay=60, max_pending=1)
+    daily = {"temp_max_c": 1.0, "source": "historical"}
+    buffer.add("Oslo", "Norway", date(2020, 1, 1), daily, 59.91, 10.75, "Europe/Oslo")
+    added = threading.Event()
+    def add_second():
+        buffer.add("Oslo", "Norway", date(2020, 1, 2), daily, 59.91, 10.75, "Europe/Oslo")
+        added.set()
+    with buffer._flush_lock:  # hold off the flusher the full buffer wakes
+        threading.Thread(target=add_second, daemon=True).start()
+        assert not added.wait(timeout=0.2)
+    assert added.wait(timeout=5)  # the flush made room
+    buffer.close()
+    assert WeatherRecord.query.count() == 2
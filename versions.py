@@ -0,0 +1,35 @@
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from models import db, TableVersion, upsert_insert, WeatherRecord
+
+RECORDS = "weather_records"
+versions = TableVersion.__table__
+
+
+# Returns the current change counter of a table (0 before its first write).
+def current(name=RECORDS):
+    version = db.session.execute(select(versions.c.version).where(versions.c.name == name)).scalar()
+    return version or 0
+
+
+# Increments a table's counter on `connection`, inside the caller's transaction.
+def bump(connection, name=RECORDS):
+    """
+    Writes that bypass ORM flushes (Core inserts, bulk UPDATEs) must call this themselves.
+    One upsert, so two first writers on a fresh database cannot both insert the row.
+    """
+    statement = upsert_insert(connection, versions).values(name=name, version=1)
+    connection.execute(statement.on_conflict_do_update(
+        index_elements=[versions.c.name], set_={"version": versions.c.version + 1}
+    ))
+
+
+# Bumps the records version whenever an ORM flush adds, edits or deletes weather records.
+@event.listens_for(Session, "after_flush")
+def _bump_on_flush(session, flush_context):
+    changed = any(isinstance(obj, WeatherRecord) for obj in session.new) or any(
+        isinstance(obj, WeatherRecord) for obj in session.deleted
+    ) or any(isinstance(obj, WeatherRecord) and session.is_modified(obj) for obj in session.dirty)
+    if changed:
+        bump(session.connection())
@@ -1,9 +1,254 @@
+import asyncio
+import contextvars
+import copy
+import functools
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
 import requests
-from datetime import date, datetime
+from requests.adapters import HTTPAdapter
+from datetime import date, datetime, timedelta
+
+import metrics
+from quota import ENDPOINTS, QuotaScheduler
+from cache import MISS, GeocodeCache, SeriesCache
+from singleflight import SingleFlight
+
+# Endpoint URLs; override with environment variables to point at a mirror or a local stand-in.
+GEO_URL = os.environ.get("OPEN_METEO_GEO_URL", "https://geocoding-api.open-meteo.com/v1/search")
+FORECAST_URL = os.environ.get("OPEN_METEO_FORECAST_URL", "https://api.open-meteo.com/v1/forecast")
+HISTORICAL_URL = os.environ.get("OPEN_METEO_ARCHIVE_URL", "https://archive-api.open-meteo.com/v1/archive")
+
+DAILY_PARAMS = ["temperature_2m_max", "temperature_2m_min", "precipitation_sum", "wind_speed_10m_max"]
+# Days the archive (ERA5) lags behind today; newer days come from the forecast API's past_days.
+ARCHIVE_DELAY_DAYS = 7
+# Furthest day ahead the forecast API can return, and how many days it returns unless asked for more.
+MAX_FORECAST_DAYS = 16
+DEFAULT_FORECAST_DAYS = 7
+# Hourly variables stored by hourly.py.
+HOURLY_PARAMS = ["temperature_2m", "precipitation", "wind_speed_10m"]
+# Locations per multi-location archive request.
+ARCHIVE_BATCH_LOCATIONS = 50
+
+# Raised instead of calling an endpoint whose circuit is open; `retry_after` is the seconds until a trial call.
+class CircuitOpenError(RuntimeError):
+    def __init__(self, endpoint, retry_after):
+        super().__init__(f"Open-Meteo {endpoint} is unavailable; retrying in {retry_after:.0f}s.")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+# Per-endpoint circuit breaker: opens after repeated failures or over-budget calls and fails fast while open.
+class CircuitBreaker:
+    """
+    Closed: calls pass; `failure_threshold` consecutive failures (errors, 429/5xx, or calls
+    slower than `latency_budget` seconds) open it. Open: calls raise CircuitOpenError at once
+    for `reset_timeout` seconds. Half-open: one trial call is let through; its success closes
+    the circuit, its failure opens it again.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, endpoint, failure_threshold: int = 5, latency_budget: float = 10.0,
+                 reset_timeout: float = 30.0, clock=time.monotonic):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.latency_budget = latency_budget
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self.rejected = 0
+
+    def before_call(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            remaining = self.opened_at + self.reset_timeout - self._clock()
+            if self.state == self.OPEN and remaining <= 0:
+                self.state = self.HALF_OPEN  # this caller is the trial
+                return
+            self.rejected += 1
+            raise CircuitOpenError(self.endpoint, max(remaining, 1.0))
+
+    def abandon(self):
+        """Called when an admitted call never reached the endpoint; a half-open trial goes to the next caller."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+    def record(self, elapsed, ok):
+        with self._lock:
+            if ok and elapsed <= self.latency_budget:
+                self.state, self.failures = self.CLOSED, 0
+                return
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state, self.opened_at = self.OPEN, self._clock()
+                self.opens += 1
 
-GEO_URL = "https://geocoding-api.open-meteo.com/v1/search"
-FORECAST_URL = "https://api.open-meteo.com/v1/forecast"
-HISTORICAL_URL = "https://archive-api.open-meteo.com/v1/archive"
+
+# Shared HTTP client: one keep-alive connection pool per host, bounded retries with jittered backoff.
+class HttpClient:
+    """
+    Thread-safe: sessions are created once per host under a lock and then shared; the
+    underlying urllib3 pools hand out connections safely to concurrent callers.
+    Connection errors, timeouts and 429/5xx responses are retried up to `retries` times,
+    sleeping a random ("full jitter") delay of up to `backoff * 2**attempt` seconds, capped at
+    `max_backoff`. A numeric Retry-After is a minimum wait: the delay is raised to it, up to `max_backoff`.
+    After the last attempt the final response is returned for the caller to raise_for_status().
+    With a `quota` scheduler, every attempt first waits for a token of its endpoint (see quota.py),
+    and a 429 with Retry-After holds back all callers of that endpoint.
+    With `breakers` ({endpoint: CircuitBreaker}), every attempt is checked and recorded by its
+    endpoint's breaker, so an outage stops retries and later calls with CircuitOpenError.
+    """
+
+    RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+    def __init__(self, connect_timeout: float = 5.0, read_timeout: float = 30.0, retries: int = 3,
+                 backoff: float = 0.5, max_backoff: float = 8.0, pool_size: int = 10, sleep=time.sleep,
+                 quota: QuotaScheduler | None = None, breakers: dict | None = None):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.pool_size = pool_size
+        self._sleep = sleep
+        self.quota = quota
+        self.breakers = breakers or {}
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            connect_timeout=float(os.environ.get("WEATHER_HTTP_CONNECT_TIMEOUT", "5")),
+            read_timeout=float(os.environ.get("WEATHER_HTTP_READ_TIMEOUT", "30")),
+            retries=int(os.environ.get("WEATHER_HTTP_RETRIES", "3")),
+            backoff=float(os.environ.get("WEATHER_HTTP_BACKOFF", "0.5")),
+            pool_size=int(os.environ.get("WEATHER_HTTP_POOL_SIZE", "10")),
+            quota=QuotaScheduler.from_env(),
+            breakers={
+                endpoint: CircuitBreaker(
+                    endpoint,
+                    failure_threshold=int(os.environ.get("WEATHER_BREAKER_FAILURES", "5")),
+                    latency_budget=float(os.environ.get("WEATHER_BREAKER_LATENCY_BUDGET", "10")),
+                    reset_timeout=float(os.environ.get("WEATHER_BREAKER_RESET_SECONDS", "30")),
+                )
+                for endpoint in ENDPOINTS
+            },
+        )
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _session(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = self._sessions[host] = self._new_session()
+        return session
+
+    def _delay(self, attempt, response=None):
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+        retry_after = str(getattr(response, "headers", {}).get("Retry-After", ""))
+        if retry_after.isdigit():
+            delay = max(delay, min(float(retry_after), self.max_backoff))
+        return delay
+
+    def get(self, url, params=None, read_timeout: float | None = None, endpoint: str | None = None):
+        session = self._session(url)
+        timeout = (self.connect_timeout, read_timeout or self.read_timeout)
+        attempt = 0
+        breaker = self.breakers.get(endpoint)
+        while True:
+            response = None
+            if breaker is not None:
+                breaker.before_call()
+            if self.quota is not None and endpoint:
+                try:
+                    self.quota.acquire(endpoint)
+                except Exception:
+                    if breaker is not None:
+                        breaker.abandon()
+                    raise
+            started = time.monotonic()
+            try:
+                response = session.get(url, params=params, timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if breaker is not None:
+                    breaker.record(time.monotonic() - started, ok=False)
+                if attempt >= self.retries:
+                    raise
+            except Exception:
+                if breaker is not None:
+                    breaker.record(time.monotonic() - started, ok=False)
+                raise
+            else:
+                if breaker is not None:
+                    breaker.record(time.monotonic() - started, ok=response.status_code not in self.RETRY_STATUSES)
+                if response.status_code not in self.RETRY_STATUSES or attempt >= self.retries:
+                    return response
+            delay = self._delay(attempt, response)
+            if self.quota is not None and endpoint and response is not None and response.status_code == 429:
+                self.quota.throttle(endpoint, delay)
+            self._sleep(delay)
+            attempt += 1
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+http_client = HttpClient.from_env()
+
+# Performs one upstream GET and returns the decoded JSON, recording latency, errors and result rows.
+def _upstream_get(endpoint, url, params, source=None, read_timeout=None):
+    labels = {"endpoint": endpoint, "source": source or ""}
+    try:
+        with metrics.span("weather_upstream_request_seconds", timing_name=f"upstream-{endpoint}", **labels):
+            response = http_client.get(url, params=params, read_timeout=read_timeout, endpoint=endpoint)
+            response.raise_for_status()
+            data = response.json()
+    except Exception:
+        metrics.inc("weather_upstream_errors_total", **labels)
+        raise
+    # Multi-location requests return one object per location
+    payloads = data if isinstance(data, list) else [data]
+    rows = sum(len(p.get("results") or (p.get("daily") or {}).get("time") or []) for p in payloads)
+    metrics.inc("weather_upstream_rows_total", rows, **labels)
+    return data
+
+# Geocoding cache shared by every caller; set GEOCODE_CACHE_PATH="" to keep it in memory only.
+geocode_cache = GeocodeCache(
+    path=os.environ.get("GEOCODE_CACHE_PATH", "geocode_cache.db") or None,
+    max_entries=int(os.environ.get("GEOCODE_CACHE_SIZE", "1024")),
+    ttl=float(os.environ.get("GEOCODE_CACHE_TTL", str(30 * 86400))),
+)
+
+# Per-day cache of whole forecast/archive responses, so neighbouring dates reuse one request.
+series_cache = SeriesCache(
+    max_entries=int(os.environ.get("SERIES_CACHE_SIZE", "8192")),
+    ttls={"forecast": float(os.environ.get("SERIES_CACHE_FORECAST_TTL", str(3 * 3600)))},
+)
+
+# In-flight upstream work shared by concurrent identical callers (see singleflight.py).
+geocode_flight = SingleFlight()
+weather_flight = SingleFlight()
 
 # Mormalizes strings for case-insensitive comparisons.
 def _norm(string):
@@ -15,23 +260,35 @@ def search_locations(city: str, country: str, count: int = 6, admin1: str | None
     return up to `count` geocoding candidates for the given city + country.
     Optionally filter by admin1 (state/province/region), case-insensitive substring match.
     Items include name, admin1, country, latitude, longitude, timezone.
+    Results (including empty ones) are served from `geocode_cache` when present.
     """
+    cache_key = geocode_cache.make_key(city, country, admin1, count)
+    cached = geocode_cache.get(cache_key)
+    if cached is not MISS:
+        return copy.deepcopy(cached)
+
+    # Concurrent searches for the same normalized key share one upstream lookup
+    results, _ = geocode_flight.do(cache_key, _geocode, city, country, count, admin1, cache_key)
+    return copy.deepcopy(results)
+
+# Geocodes via the upstream API (with a "city, country" fallback) and caches the simplified candidates.
+def _geocode(city, country, count, admin1, cache_key):
     query_string = f"{city}, {country}".strip()
     params = {"name": city, "count": count, "language": "en", "format": "json"}
     try:
-        response = requests.get(GEO_URL, params=params, timeout=20)
-        response.raise_for_status()
-        data = response.json()
+        data = _upstream_get("geocoding", GEO_URL, params, read_timeout=20)
+    except CircuitOpenError:
+        raise
     except Exception as e:
         raise RuntimeError(f"Geocoding request failed: {e}")
     results = data.get("results") or []
 
     if not results:
         try:
-            response = requests.get(GEO_URL, params={"name": query_string, "count": count, "language": "en", "format": "json"}, timeout=20)
-            response.raise_for_status()
-            data = response.json()
+            data = _upstream_get("geocoding", GEO_URL, {"name": query_string, "count": count, "language": "en", "format": "json"}, read_timeout=20)
             results = data.get("results") or []
+        except CircuitOpenError:
+            raise
         except Exception as e:
             raise RuntimeError(f"Geocoding (fallback) failed: {e}")
 
@@ -56,13 +313,66 @@ def search_locations(city: str, country: str, count: int = 6, admin1: str | None
             "longitude": result["longitude"],
             "timezone": result.get("timezone", "UTC"),
         })
+    geocode_cache.set(cache_key, simplified)
+    for listener in _geocode_listeners:
+        listener(simplified)
     return simplified
 
+_geocode_listeners = []
+
+# Registers `callback(candidates)` to be called with every fresh geocoding result (e.g. the autocomplete index).
+def on_geocode(callback):
+    _geocode_listeners.append(callback)
+    return callback
+
+# Exposes cache hit/miss and coalescing counters on /metrics (read at scrape time, so swapped instances are picked up).
+def _cache_metrics():
+    for name, cache in (("geocode", geocode_cache), ("series", series_cache)):
+        stats = cache.stats()
+        yield "weather_cache_hits_total", {"cache": name}, stats["hits"]
+        yield "weather_cache_misses_total", {"cache": name}, stats["misses"]
+    for name, flight in (("geocode", geocode_flight), ("weather", weather_flight)):
+        stats = flight.stats()
+        yield "weather_upstream_calls_total", {"call": name}, stats["leaders"]
+        yield "weather_upstream_coalesced_total", {"call": name}, stats["coalesced"]
+
+metrics.registry.add_collector(_cache_metrics)
+
+# Exposes quota queue depth and rejections of the current client's scheduler on /metrics.
+def _quota_metrics():
+    if http_client.quota is not None:
+        yield from http_client.quota.collect()
+
+metrics.registry.add_collector(_quota_metrics)
+
+# Exposes circuit state (0 closed, 1 half-open, 2 open), openings and fast failures per endpoint on /metrics.
+def _breaker_metrics():
+    levels = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+    for endpoint, breaker in http_client.breakers.items():
+        yield "weather_circuit_state", {"endpoint": endpoint}, levels[breaker.state]
+        yield "weather_circuit_opened_total", {"endpoint": endpoint}, breaker.opens
+        yield "weather_circuit_rejected_total", {"endpoint": endpoint}, breaker.rejected
+
+metrics.registry.add_collector(_breaker_metrics)
+
+# Last day the forecast API can return, counting today as the first.
+def last_forecast_day(today=None):
+    return (today or date.today()) + timedelta(days=MAX_FORECAST_DAYS - 1)
+
+_predictor = None
+
+# Registers `predictor(latitude, longitude, timezone, days) -> {day: daily fields}` for days past the forecast horizon.
+def set_predictor(predictor):
+    global _predictor
+    _predictor = predictor
+    return predictor
+
 # Selects the appropriate API based on date and returns a normalized daily weather dict.
 def fetch_weather_for_date(city: str, country: str, target_date, latitude: float | None = None, longitude: float | None = None, timezone: str | None = None):
     """
     For recent past (≤7 days), use Forecast API with past_days to bridge ERA5 delay.
-    Older past uses Archive API. Today/future uses Forecast.
+    Older past uses Archive API. Today/future uses Forecast. Dates past the forecast horizon
+    are predicted locally by the registered predictor (climatology.py), with source "predicted".
     """
     if isinstance(target_date, str):
         target_date = datetime.strptime(target_date, "%Y-%m-%d").date()
@@ -83,20 +393,50 @@ def fetch_weather_for_date(city: str, country: str, target_date, latitude: float
         timezone = timezone or "UTC"
 
     today = date.today()
-    daily_params = ["temperature_2m_max", "temperature_2m_min", "precipitation_sum", "wind_speed_10m_max"]
 
+    # Past the forecast horizon the upstream has nothing for the day; predict it locally instead
+    if target_date > last_forecast_day(today):
+        if _predictor is None:
+            raise ValueError(f"{target_date} is beyond the {MAX_FORECAST_DAYS}-day forecast horizon.")
+        fields = _predictor(latitude, longitude, timezone, [target_date])[target_date]
+        fields["geo"] = {"latitude": latitude, "longitude": longitude, "timezone": timezone}
+        return fields
+
+    # Serve from an earlier response covering the same place and day when possible
+    source = "historical" if (today - target_date).days > ARCHIVE_DELAY_DAYS else "forecast"
+    cached = series_cache.get(latitude, longitude, timezone, source, target_date)
+    if cached is not MISS:
+        return _daily_fields(cached, source, latitude, longitude, timezone)
+
+    # Concurrent requests for the same place and day wait for one upstream call
+    key = ("day",) + series_cache.make_key(latitude, longitude, timezone, source, target_date)
+    daily, shared = weather_flight.do(key, _fetch_day, latitude, longitude, timezone, target_date, today)
+    return copy.deepcopy(daily) if shared else daily
+
+# Last cached values for the day even if expired (stale-while-revalidate fallback); None when nothing was cached.
+def cached_weather_for_date(latitude, longitude, timezone, target_date):
+    timezone = timezone or "UTC"
+    for source in ("historical", "forecast"):
+        cached = series_cache.get(latitude, longitude, timezone, source, target_date, stale=True)
+        if cached is not MISS:
+            fields = _daily_fields(cached, source, latitude, longitude, timezone)
+            fields["stale"] = True
+            return fields
+    return None
+
+# Requests the single day from the forecast or archive API and caches the whole returned series.
+def _fetch_day(latitude, longitude, timezone, target_date, today):
+    daily_params = DAILY_PARAMS
     if target_date < today:
         days_back = (today - target_date).days
-        if days_back <= 7:
+        if days_back <= ARCHIVE_DELAY_DAYS:
             params = {
                 "latitude": latitude, "longitude": longitude,
                 "daily": ",".join(daily_params),
                 "timezone": timezone,
                 "past_days": days_back
             }
-            response = requests.get(FORECAST_URL, params=params, timeout=30)
-            response.raise_for_status()
-            data = response.json()
+            data = _upstream_get("forecast", FORECAST_URL, params, source="forecast")
             source = "forecast"
         else:
             params = {
@@ -104,28 +444,25 @@ def fetch_weather_for_date(city: str, country: str, target_date, latitude: float
                 "start_date": target_date.isoformat(), "end_date": target_date.isoformat(),
                 "daily": ",".join(daily_params), "timezone": timezone,
             }
-            response = requests.get(HISTORICAL_URL, params=params, timeout=30)
-            response.raise_for_status()
-            data = response.json()
+            data = _upstream_get("archive", HISTORICAL_URL, params, source="historical")
             source = "historical"
     else:
+        # The upstream returns DEFAULT_FORECAST_DAYS unless asked for more; ask for enough to reach the day
+        needed = (target_date - today).days + 1
         params = {
             "latitude": latitude, "longitude": longitude,
             "daily": ",".join(daily_params), "timezone": timezone,
+            "forecast_days": min(MAX_FORECAST_DAYS, max(DEFAULT_FORECAST_DAYS, needed)),
         }
-        response = requests.get(FORECAST_URL, params=params, timeout=30)
-        response.raise_for_status()
-        data = response.json()
+        data = _upstream_get("forecast", FORECAST_URL, params, source="forecast")
         source = "forecast"
 
     daily = data.get("daily", {})
     dates = daily.get("time", [])
-    if target_date.isoformat() in dates:
-        index = dates.index(target_date.isoformat())
-    else:
-        if not dates:
-            raise ValueError("No daily data returned from weather API.")
-        index = 0
+    series_cache.store(latitude, longitude, timezone, source, daily)
+    if target_date.isoformat() not in dates:
+        raise ValueError(f"No daily data for {target_date} returned from weather API.")
+    index = dates.index(target_date.isoformat())
 
     return {
         "temp_max_c": _safe_idx(daily.get("temperature_2m_max"), index),
@@ -136,6 +473,251 @@ def fetch_weather_for_date(city: str, country: str, target_date, latitude: float
         "geo": {"latitude": latitude, "longitude": longitude, "timezone": timezone},
     }
 
+# Fetches every day in [start_date, end_date] with at most one archive and one forecast request.
+def fetch_weather_for_range(latitude: float, longitude: float, timezone: str | None, start_date, end_date):
+    """
+    Days older than ARCHIVE_DELAY_DAYS come from one Archive API call; the rest (recent past,
+    today and future) from one Forecast API call using past_days/forecast_days.
+    Spans already held in `series_cache` are not requested again.
+    Returns {"geo": {...}, "days": [...]} where each day carries "date" plus the same fields
+    as `fetch_weather_for_date`. Days beyond the forecast horizon are predicted locally when
+    a predictor is registered, and left out otherwise.
+    """
+    if isinstance(start_date, str):
+        start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
+    if isinstance(end_date, str):
+        end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
+    if end_date < start_date:
+        raise ValueError("end_date must not be before start_date")
+    timezone = timezone or "UTC"
+
+    today = date.today()
+    last_archive_day = today - timedelta(days=ARCHIVE_DELAY_DAYS + 1)
+    spans = []
+    if start_date <= last_archive_day:
+        spans.append(("historical", start_date, min(end_date, last_archive_day)))
+    last_forecast = last_forecast_day(today)
+    if end_date > last_archive_day and start_date <= last_forecast:
+        spans.append(("forecast", max(start_date, last_archive_day + timedelta(days=1)), min(end_date, last_forecast)))
+
+    days = []
+    for source, span_start, span_end in spans:
+        key = ("span",) + series_cache.make_key(latitude, longitude, timezone, source, span_start) + (span_end,)
+        values_by_day, _ = weather_flight.do(
+            key, _fetch_span, latitude, longitude, timezone, source, span_start, span_end, today
+        )
+        for day in sorted(values_by_day):
+            fields = _daily_values(values_by_day[day], source)
+            fields["date"] = day
+            days.append(fields)
+
+    if end_date > last_forecast and _predictor is not None:
+        first = max(start_date, last_forecast + timedelta(days=1))
+        wanted = [first + timedelta(days=n) for n in range((end_date - first).days + 1)]
+        for day, fields in _predictor(latitude, longitude, timezone, wanted).items():
+            days.append({**fields, "date": day})
+
+    return {
+        "geo": {"latitude": latitude, "longitude": longitude, "timezone": timezone},
+        "days": days,
+    }
+
+# Fetches one archive date span for many locations, several locations per request.
+def fetch_archive_batch(locations, start_date, end_date, batch_size=ARCHIVE_BATCH_LOCATIONS):
+    """
+    `locations` are (latitude, longitude, timezone) tuples. Open-Meteo accepts comma-separated
+    coordinate (and timezone) lists and answers with one result per location in the same order,
+    so `batch_size` locations cost one request. Locations whose span is already cached are not sent.
+    Returns a list parallel to `locations` of {date: normalized daily fields (source "historical")}.
+    """
+    wanted = [start_date + timedelta(days=n) for n in range((end_date - start_date).days + 1)]
+    values = [None] * len(locations)
+    missing = []
+    for position, (latitude, longitude, timezone) in enumerate(locations):
+        cached = {day: series_cache.get(latitude, longitude, timezone or "UTC", "historical", day) for day in wanted}
+        if all(day_values is not MISS for day_values in cached.values()):
+            values[position] = cached
+        else:
+            missing.append(position)
+
+    for offset in range(0, len(missing), batch_size):
+        chunk = missing[offset:offset + batch_size]
+        params = {
+            "latitude": ",".join(str(locations[p][0]) for p in chunk),
+            "longitude": ",".join(str(locations[p][1]) for p in chunk),
+            "timezone": ",".join(locations[p][2] or "UTC" for p in chunk),
+            "daily": ",".join(DAILY_PARAMS),
+            "start_date": start_date.isoformat(),
+            "end_date": end_date.isoformat(),
+        }
+        data = _upstream_get("archive", HISTORICAL_URL, params, source="historical")
+        results = data if isinstance(data, list) else [data]
+        for position, result in zip(chunk, results):
+            latitude, longitude, timezone = locations[position]
+            daily = result.get("daily", {})
+            series_cache.store(latitude, longitude, timezone or "UTC", "historical", daily)
+            values[position] = {
+                date.fromisoformat(day): {name: _safe_idx(series, index) for name, series in daily.items() if name != "time"}
+                for index, day in enumerate(daily.get("time", []))
+            }
+
+    return [
+        {day: _daily_values(day_values, "historical") for day, day_values in (by_day or {}).items()
+         if start_date <= day <= end_date}
+        for by_day in values
+    ]
+
+# Fetches hourly series for [start_date, end_date]; returns {date: (source, {variable: [values per hour]})}.
+def fetch_hourly_range(latitude, longitude, timezone, start_date, end_date):
+    """
+    Like fetch_weather_for_range, days past the archive delay come from one archive request and
+    the rest from one forecast request; both endpoints take start_date/end_date for hourly data.
+    Values are local-time hours as returned by Open-Meteo (None where missing). Days past the
+    forecast horizon (last_forecast_day) are not requested and are missing from the result.
+    """
+    if end_date < start_date:
+        raise ValueError("end_date must not be before start_date")
+    timezone = timezone or "UTC"
+    today = date.today()
+    last_archive_day = today - timedelta(days=ARCHIVE_DELAY_DAYS + 1)
+    last_forecast = last_forecast_day(today)
+    spans = []
+    if start_date <= last_archive_day:
+        spans.append(("historical", "archive", HISTORICAL_URL, start_date, min(end_date, last_archive_day)))
+    if end_date > last_archive_day and start_date <= last_forecast:
+        spans.append(("forecast", "forecast", FORECAST_URL, max(start_date, last_archive_day + timedelta(days=1)),
+                      min(end_date, last_forecast)))
+
+    days = {}
+    for source, endpoint, url, span_start, span_end in spans:
+        params = {
+            "latitude": latitude, "longitude": longitude, "timezone": timezone,
+            "hourly": ",".join(HOURLY_PARAMS),
+            "start_date": span_start.isoformat(), "end_date": span_end.isoformat(),
+        }
+        hourly = _upstream_get(endpoint, url, params, source=source).get("hourly", {})
+        for index, stamp in enumerate(hourly.get("time", [])):
+            day = date.fromisoformat(stamp[:10])
+            if not span_start <= day <= span_end:
+                continue
+            _, series = days.setdefault(day, (source, {name: [] for name in HOURLY_PARAMS}))
+            for name in HOURLY_PARAMS:
+                series[name].append(_safe_idx(hourly.get(name), index))
+    return days
+
+# Returns {date: raw daily values} for one source window, using the series cache when it covers the span.
+def _fetch_span(latitude, longitude, timezone, source, start_date, end_date, today):
+    wanted = [start_date + timedelta(days=n) for n in range((end_date - start_date).days + 1)]
+    cached = {day: series_cache.get(latitude, longitude, timezone, source, day) for day in wanted}
+    if all(values is not MISS for values in cached.values()):
+        return cached
+
+    params = {
+        "latitude": latitude, "longitude": longitude,
+        "daily": ",".join(DAILY_PARAMS), "timezone": timezone,
+    }
+    if source == "historical":
+        params.update(start_date=start_date.isoformat(), end_date=end_date.isoformat())
+        endpoint, url = "archive", HISTORICAL_URL
+    else:
+        past_days = max(0, (today - start_date).days)
+        forecast_days = min(MAX_FORECAST_DAYS, max(1, (end_date - today).days + 1))
+        if past_days:
+            params["past_days"] = past_days
+        params["forecast_days"] = forecast_days
+        endpoint, url = "forecast", FORECAST_URL
+
+    daily = _upstream_get(endpoint, url, params, source=source).get("daily", {})
+    series_cache.store(latitude, longitude, timezone, source, daily)
+
+    values_by_day = {}
+    for index, day in enumerate(daily.get("time", [])):
+        day = date.fromisoformat(day)
+        if start_date <= day <= end_date:
+            values_by_day[day] = {
+                name: _safe_idx(series, index) for name, series in daily.items() if name != "time"
+            }
+    return values_by_day
+
+# Limits for fetch_many: tasks in flight overall and upstream calls in flight per host.
+MAX_CONCURRENCY = int(os.environ.get("WEATHER_FETCH_CONCURRENCY", "16"))
+MAX_PER_HOST = int(os.environ.get("WEATHER_FETCH_PER_HOST", "8"))
+
+# Fetches many (location, date) tasks concurrently on an event loop; results come back in input order.
+async def fetch_many_async(tasks, max_concurrency=MAX_CONCURRENCY, per_host=MAX_PER_HOST):
+    """
+    Each task is a mapping with city, country and date (date or "YYYY-MM-DD"), and optionally
+    latitude, longitude and timezone. Each result is {"ok": True, "weather": {...}} with the
+    fields of fetch_weather_for_date, or {"ok": False, "error": "..."}; one failing task does
+    not affect the others.
+    The blocking calls (pooled sessions, retries, caches and coalescing included) run on a
+    dedicated thread pool sized to `max_concurrency`; per-host semaphores keep any single
+    Open-Meteo host from receiving more than `per_host` concurrent calls.
+    """
+    loop = asyncio.get_running_loop()
+    overall = asyncio.Semaphore(max_concurrency)
+    hosts = {}
+
+    def host_slot(url):
+        host = urlsplit(url).netloc
+        if host not in hosts:
+            hosts[host] = asyncio.Semaphore(per_host)
+        return hosts[host]
+
+    with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="weather-fetch") as executor:
+        async def call(url, fn, *args, **kwargs):
+            # Run in a copy of the caller's context so request-scoped metrics still see the call
+            context = contextvars.copy_context()
+            async with host_slot(url):
+                return await loop.run_in_executor(executor, functools.partial(context.run, fn, *args, **kwargs))
+
+        async def run(task):
+            async with overall:
+                try:
+                    target_date = task["date"]
+                    if isinstance(target_date, str):
+                        target_date = datetime.strptime(target_date, "%Y-%m-%d").date()
+                    latitude, longitude = task.get("latitude"), task.get("longitude")
+                    timezone = task.get("timezone")
+                    if latitude is None or longitude is None:
+                        candidates = await call(GEO_URL, search_locations, task["city"], task["country"], count=1)
+                        if not candidates:
+                            raise ValueError(f"No geocoding results for '{task['city']}, {task['country']}'.")
+                        latitude, longitude = candidates[0]["latitude"], candidates[0]["longitude"]
+                        timezone = candidates[0].get("timezone", "UTC")
+                    days_back = (date.today() - target_date).days
+                    url = HISTORICAL_URL if days_back > ARCHIVE_DELAY_DAYS else FORECAST_URL
+                    weather = await call(
+                        url, fetch_weather_for_date,
+                        city=task.get("city", ""), country=task.get("country", ""), target_date=target_date,
+                        latitude=latitude, longitude=longitude, timezone=timezone,
+                    )
+                    return {"ok": True, "weather": weather}
+                except Exception as e:
+                    return {"ok": False, "error": str(e) or e.__class__.__name__}
+
+        return await asyncio.gather(*(run(task) for task in tasks))
+
+# Synchronous wrapper around fetch_many_async for Flask routes, CLI commands and other sync callers.
+def fetch_many(tasks, max_concurrency=MAX_CONCURRENCY, per_host=MAX_PER_HOST):
+    return asyncio.run(fetch_many_async(list(tasks), max_concurrency=max_concurrency, per_host=per_host))
+
+# Maps one day of raw Open-Meteo values onto the normalized field names.
+def _daily_values(values, source):
+    return {
+        "temp_max_c": values.get("temperature_2m_max"),
+        "temp_min_c": values.get("temperature_2m_min"),
+        "precip_mm": values.get("precipitation_sum"),
+        "wind_max_kmh": values.get("wind_speed_10m_max"),
+        "source": source,
+    }
+
+# Builds the normalized daily dict from one cached day of Open-Meteo values.
+def _daily_fields(values, source, latitude, longitude, timezone):
+    fields = _daily_values(values, source)
+    fields["geo"] = {"latitude": latitude, "longitude": longitude, "timezone": timezone}
+    return fields
+
 # Safely returns list[index] or None if out of range.
 def _safe_idx(values, index):
     if values is None:
@@ -0,0 +1,143 @@
+import atexit
+import threading
+
+from models import db
+from storage import upsert_days
+
+
+# Write-behind buffer: groups upserts from many requests into one transaction per flush.
+class WriteBuffer:
+    """
+    Rows are acknowledged before they are committed. A flush runs when `max_rows` rows are
+    waiting or `max_delay` seconds have passed, whichever comes first. It upserts every
+    buffered row through storage.upsert_days and commits once.
+    Durability: rows still buffered when the process is killed are lost (at most `max_pending`
+    rows). close() is registered with atexit until it runs, so a normal shutdown flushes.
+    When a flush's transaction fails, its rows are retried one per transaction, so one bad row
+    cannot hold back the rest; a row that fails `max_attempts` flushes is dropped and logged.
+    Backpressure: add() blocks while `max_pending` rows are waiting, until a flush makes room.
+    """
+
+    def __init__(self, app, max_rows: int = 200, max_delay: float = 0.25, max_pending: int = 0,
+                 max_attempts: int = 5):
+        self.app = app
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.max_pending = max_pending or 10 * max_rows
+        self.max_attempts = max_attempts
+        self.flushes = 0
+        self.rows_written = 0
+        self.failures = 0
+        self.dropped = 0
+        self._pending = {}
+        self._attempts = {}
+        self._lock = threading.Lock()
+        self._room = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._loop, name="write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def add(self, city, country, requested_date, daily, latitude=None, longitude=None, timezone=None):
+        """Buffers one row; a later add for the same location and date replaces it. Blocks while the buffer is full."""
+        key = (city, country, requested_date, latitude, longitude)
+        with self._room:
+            while len(self._pending) >= self.max_pending and key not in self._pending and not self._closed:
+                self._wake.set()
+                self._room.wait(self.max_delay)
+            self._pending[key] = (daily, timezone)
+            self._attempts.pop(key, None)
+            full = len(self._pending) >= self.max_rows
+        if full:
+            self._wake.set()
+
+    def pending(self, city, country, requested_date, latitude=None, longitude=None):
+        """
+        Returns the buffered daily values for a row that has not been committed yet, or None.
+        Without coordinates, a row is returned only if the day is buffered for one location (as storage.find_stored).
+        """
+        with self._lock:
+            if latitude is not None and longitude is not None:
+                entries = [self._pending.get((city, country, requested_date, latitude, longitude))]
+            else:
+                entries = [entry for key, entry in self._pending.items() if key[:3] == (city, country, requested_date)]
+        return entries[0][0] if len(entries) == 1 and entries[0] else None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        """Commits everything buffered so far, in one transaction if it succeeds; returns the number of rows written."""
+        with self._flush_lock:
+            with self._room:
+                batch, self._pending = self._pending, {}
+                self._room.notify_all()
+            if not batch:
+                return 0
+
+            with self.app.app_context():
+                try:
+                    self._write(batch)
+                    written = len(batch)
+                except Exception:
+                    db.session.rollback()
+                    self.failures += 1
+                    self.app.logger.exception("Write-behind flush of %d rows failed; retrying them one by one", len(batch))
+                    written = sum(self._write_row(key, entry) for key, entry in batch.items())
+                else:
+                    with self._lock:
+                        for key in batch:
+                            self._attempts.pop(key, None)
+            self.flushes += 1
+            self.rows_written += written
+            return written
+
+    def close(self):
+        atexit.unregister(self.close)
+        self._closed = True
+        self._wake.set()
+        self._thread.join(timeout=5)
+        self.flush()
+
+    # Upserts `batch` ({key: (daily, timezone)}) and commits once.
+    def _write(self, batch):
+        by_location = {}
+        for (city, country, day, latitude, longitude), (daily, timezone) in batch.items():
+            by_location.setdefault((city, country, latitude, longitude, timezone), []).append({**daily, "date": day})
+        for (city, country, latitude, longitude, timezone), days in by_location.items():
+            upsert_days(city, country, days, latitude, longitude, timezone, commit=False)
+        db.session.commit()
+
+    # Writes one row of a failed batch on its own; a failed row goes back to the buffer or, after max_attempts, is dropped.
+    def _write_row(self, key, entry):
+        try:
+            self._write({key: entry})
+        except Exception:
+            db.session.rollback()
+            with self._lock:
+                if key in self._pending:  # a newer add for the same day replaces this row
+                    return 0
+                attempts = self._attempts.get(key, 0) + 1
+                if attempts < self.max_attempts:
+                    self._attempts[key] = attempts
+                    self._pending[key] = entry
+                    return 0
+                self._attempts.pop(key, None)
+                self.dropped += 1
+            self.app.logger.exception("Write-behind dropped %s for %s after %d failed attempts", key[:3], key[3:], attempts)
+            return 0
+        with self._lock:
+            self._attempts.pop(key, None)
+        return 1
+
+    def _loop(self):
+        while not self._closed:
+            self._wake.wait(self.max_delay)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception("Write-behind flush failed")